@@ -55,4 +55,10 @@ setup(
         "python-crontab",
         "mock==1.0.1",
         ],
+    extras_require={
+        "dedupe": ["Pillow"],
+        "local": ["scandir"],
+        "archive": ["Pillow"],
+        "ranking": ["numpy"],
+        },
 )
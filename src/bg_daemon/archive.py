@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+"""
+    bg_daemon.archive
+
+    The cold tier for old backups. Only the most recent backups are kept
+    next to the target; older ones are packed into a single container file
+    in the bg_daemon home, so years of wallpapers don't cost years of
+    inodes. They can be shrunk on the way (if PIL is installed) since
+    nobody looks at them until they are restored, in their own format so
+    they are restored under their own name.
+
+    The container is append-only, images are written one after the other.
+    A separate index maps the digest of every image (the hash-prefix in its
+    backup name) to its offset and length, so restoring an image is a
+    single seek. The index is only replaced once the image is safely in the
+    container: a crash leaves some unused bytes at worst.
+"""
+import os
+import io
+import json
+import logging
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+# the formats we downscale, and the save options they take
+_SHRINK_OPTIONS = {"JPEG": ("quality",), "PNG": (), "WEBP": ("quality",)}
+
+
+class cold_archive:
+    """
+        cold_archive
+
+        A container of archived images, indexed by digest.
+
+        <Properties>
+            filename:   The container file
+
+            index:      The index file
+
+            max_width:  Images are downscaled to fit in max_width x
+                        max_height before they are archived, 0 keeps them
+                        as they are
+
+            max_height: Same idea
+
+            quality:    The JPEG (or WebP) quality of downscaled images
+
+        <Functions>
+            add():      Archives an image
+
+            restore():  Writes an archived image back to disk
+
+            digests():  The digests of the archived images
+    """
+    filename = None
+    index = None
+    max_width = 0
+    max_height = 0
+    quality = 85
+
+    def __init__(self, filename, index, max_width=0, max_height=0,
+                 quality=85):
+
+        self.filename = filename
+        self.index = index
+        self.max_width = max_width
+        self.max_height = max_height
+        self.quality = quality
+
+        self._index = {}
+        self._load()
+
+    """
+        add
+
+        Appends an image to the container.
+
+        <Arguments>
+            path:   The image to archive, it's not removed
+
+            digest: The key to restore it with
+
+        <Returns>
+            False if the image couldn't be archived
+    """
+    def add(self, path, digest):
+
+        if digest in self._index:
+            return True
+
+        name = os.path.basename(path)
+        try:
+            data = self._shrink(path)
+            if data is None:
+                with open(path, "rb") as fp:
+                    data = fp.read()
+
+            with open(self.filename, "ab") as fp:
+                offset = fp.tell()
+                fp.write(data)
+                fp.flush()
+                os.fsync(fp.fileno())
+
+        except (IOError, OSError) as e:
+            logger.error("Couldn't archive {}: {}".format(path, e))
+            return False
+
+        self._index[digest] = {"offset": offset, "length": len(data),
+                               "name": name}
+        self._save()
+
+        logger.debug("archived {} ({} bytes)".format(path, len(data)))
+        return True
+
+    """
+        restore
+
+        Writes an archived image back to disk.
+
+        <Arguments>
+            digest:         The digest of the image
+
+            destination:    Where to write it
+
+        <Returns>
+            The name the image had when it was archived, None if there's no
+            such image
+    """
+    def restore(self, digest, destination):
+
+        entry = self._index.get(digest)
+        if entry is None:
+            return None
+
+        with open(self.filename, "rb") as fp:
+            fp.seek(entry["offset"])
+            data = fp.read(entry["length"])
+
+        if len(data) != entry["length"]:
+            raise IOError("The archive is truncated!")
+
+        with open(destination, "wb") as fp:
+            fp.write(data)
+
+        return entry["name"]
+
+    def digests(self):
+
+        return list(self._index)
+
+    """
+        _shrink
+
+        Downscales an image to fit in max_width x max_height, in the format
+        it has (an animated gif would lose its frames, it's kept as it is).
+
+        <Returns>
+            The image data, or None if the image should be kept as it is
+    """
+    def _shrink(self, path):
+
+        if Image is None or not (self.max_width and self.max_height):
+            return None
+
+        try:
+            image = Image.open(path)
+            kind = image.format
+            if kind not in _SHRINK_OPTIONS:
+                return None
+
+            if image.size[0] <= self.max_width and \
+                    image.size[1] <= self.max_height:
+                return None
+
+            image.thumbnail((self.max_width, self.max_height),
+                            Image.ANTIALIAS)
+            if kind == "JPEG" and image.mode != "RGB":
+                image = image.convert("RGB")
+
+            options = dict((option, getattr(self, option))
+                           for option in _SHRINK_OPTIONS[kind])
+            output = io.BytesIO()
+            image.save(output, kind, **options)
+
+        except (IOError, ValueError) as e:
+            logger.debug("Couldn't shrink {}: {}".format(path, e))
+            return None
+
+        return output.getvalue()
+
+    def _load(self):
+
+        if not os.path.exists(self.index):
+            return
+
+        try:
+            with open(self.index) as fp:
+                self._index = json.load(fp)
+        except (IOError, ValueError) as e:
+            logger.error("Couldn't load the archive index {}".format(e))
+
+    def _save(self):
+
+        partial = "{}.part".format(self.index)
+        with open(partial, "wt") as fp:
+            json.dump(self._index, fp, separators=(",", ":"))
+        os.rename(partial, self.index)
+
+
+logger = logging.getLogger("bg_daemon")
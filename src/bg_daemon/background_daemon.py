@@ -8,17 +8,46 @@
 """
 import os
 import datetime
-import shutil
 import json
 import time
-import subprocess
-import shlex
 import argparse
+import threading
+import socket
+import sys
 
 import importlib
 from bg_daemon.log import logger as log
+from bg_daemon.log import configure as configure_logging
+from bg_daemon.lock import lockfile
+from bg_daemon.hook import hook_runner
+from bg_daemon import journal
+from bg_daemon import phash
+from bg_daemon.pool import image_pool
+from bg_daemon.mirror import mirror_server
+from bg_daemon.fetchers.hedgedfetcher import hedgedfetcher
+from bg_daemon.deadline import deadline, deadline_exceeded
+from bg_daemon.archive import cold_archive
+from bg_daemon.budget import usage_budget
+from bg_daemon import control
+from bg_daemon.schedule import (host_offset, next_update, idle_point,
+                                next_cron_due)
 from bg_daemon.util import (HOME, initialize_default_settings,
-                            initialize_home_directory, get_digest_for_file)
+                            initialize_home_directory, get_backup_filename,
+                            list_backups, link_or_copy, is_online,
+                            sync_crontab_entry, CRONTAB_FREQUENCY)
+
+# the longest the daemon sleeps between polls, in seconds
+DAEMON_TICK = 5
+
+# how long the daemon waits after a failed poll, the update is still due
+# so it's tried again then (like the next cron run would)
+DAEMON_ERROR_WAIT = 60
+
+# how long do we wait for the connectivity check, in seconds
+CONNECTIVITY_TIMEOUT = 2
+
+# how many skipped links are remembered
+MAX_SKIPPED = 1000
 
 
 class background_daemon:
@@ -31,7 +60,16 @@ class background_daemon:
 
         <Properties>
             fetcher:    The instance of the fetcher class. It downloads an
-                        image based on some specified parameters
+                        image based on some specified parameters. If a list
+                        of fetchers is given in the settings, they are
+                        queried concurrently.
+
+            hedge_deadline: With several fetchers, how long do we wait for
+                        them
+
+            hedge_strategy: With several fetchers, "first" takes the first
+                        candidate that arrives, "best" the best one that
+                        arrives before the deadline
 
             target:     A folder or filename to which save the image if
                         everything worked out properly
@@ -48,6 +86,58 @@ class background_daemon:
 
             update_hook:A command to call with "subprocess" once the image has
                         been placed correctly.
+
+            env:        Environment variables for the update_hook
+
+            hook_timeout: How long can the update_hook run before we kill it
+
+            hook_delay: In daemon mode, changes that happen within this many
+                        seconds of each other trigger a single hook run
+
+            journal_file: Where to append a record of every poll/update
+
+            dedupe:     Drop images that look like a recent wallpaper
+
+            dedupe_distance: How many bits can the perceptual hashes of two
+                        images differ for them to be considered duplicates
+
+            offline_fallback: Rotate through the images we already have if
+                        the network is down
+
+            connectivity_check: A host:port we try to connect to before
+                        updating to know if we're online
+
+            update_deadline: How long (in seconds) can an update take, it's
+                        split across its phases and every network operation
+                        gets what's left as its timeout
+
+            deadline_shares: The fraction of update_deadline reserved for
+                        each phase (see bg_daemon.deadline)
+
+            hot_backups: How many backups are kept next to the target, older
+                        ones are moved to the archive. None keeps them all
+
+            archive_max_width, archive_max_height: Archived images are
+                        downscaled to fit in this size (needs PIL), 0 keeps
+                        them as they are
+
+            budget:     The bandwidth and API call limits, see
+                        bg_daemon.budget. Close to them, downloads are
+                        thrifty; past them, we only rotate through the local
+                        pool
+
+            jitter:     Up to how many random seconds are added to the time
+                        of the next update (see bg_daemon.schedule)
+
+            splay:      When run from cron, due updates wait for a per-host
+                        offset of up to this many seconds
+
+            prefetch:   In daemon mode, how many images are downloaded ahead
+                        of time (in the idle time between updates) so an
+                        update only has to promote one
+
+            control_socket: In daemon mode, where the control socket (see
+                        bg_daemon.control) listens, empty disables it
     """
     fetcher = None
     target = None
@@ -57,6 +147,40 @@ class background_daemon:
     slack = None
     backup = None
     update_hook = None
+    env = None
+    hook_timeout = 30
+    hook_delay = 2
+    hook = None
+    daemonized = False
+    journal_file = os.path.join(HOME, "journal.jsonl")
+    dedupe = False
+    dedupe_distance = 3
+    hashes = None
+    offline_fallback = False
+    connectivity_check = "api.imgur.com:443"
+    pool = None
+    mirror_settings = None
+    hedge_deadline = 10
+    hedge_strategy = "first"
+    update_deadline = None
+    deadline_shares = None
+    _deadline = None
+    hot_backups = None
+    archive_max_width = 0
+    archive_max_height = 0
+    archive = None
+    budget = None
+    jitter = 0
+    splay = 0
+    prefetch = 0
+    _prefetch_at = None
+    _prefetch_window = None
+    control_socket = os.path.join(HOME, "control.sock")
+    settings_file = None
+    _commands = None
+    _fetching = None
+    _last_run = None
+    _skipped = None
 
     """
         __init__
@@ -78,47 +202,229 @@ class background_daemon:
             if not os.path.exists(filename):
                 initialize_default_settings(filename)
 
+        self.settings_file = filename
+
+        # commands run between polls, never in the middle of one, and only
+        # one update or prefetch uses the fetcher at a time
+        self._commands = threading.Lock()
+        self._fetching = threading.Lock()
+
         try:
             with open(filename) as fp:
                 data = json.load(fp)
         except Exception as e:
             raise
 
+        if 'log' in data:
+            configure_logging(data['log'])
+
+        self.mirror_settings = data.get('mirror', {})
+
+        names = None
         if 'daemon' in data:
 
             data = data['daemon']
             for key in data:
 
                 if key == 'fetcher':
-                    module_name = "bg_daemon.fetchers.{}".format(data[key])
-                    module = importlib.import_module(module_name)
-                    fetcher = getattr(module, data[key])
-                    self.fetcher = fetcher()
+                    names = data[key]
                     continue
 
                 setattr(self, key, data[key])
 
+            # several fetchers are queried concurrently, see hedgedfetcher
+            if isinstance(names, list):
+                self.fetcher = hedgedfetcher([_load_fetcher(name)
+                                              for name in names],
+                                             self.hedge_deadline,
+                                             self.hedge_strategy)
+            elif names is not None:
+                self.fetcher = _load_fetcher(names)
+
             if self.backup == "yes":
                 self.backup = True
             else:
                 self.backup = False
 
-    """ daemon
+        self.hook = hook_runner(self.update_hook, self.env, self.hook_timeout,
+                                self.hook_delay)
+
+        if self.offline_fallback:
+            self.pool = image_pool(str(self.target), os.path.join(HOME, "pool"),
+                                   os.path.join(HOME, "pool.json"))
+
+        if self.budget:
+            self.budget = usage_budget(os.path.join(HOME, "budget.json"),
+                                       self.budget,
+                                       self.budget.get("threshold", 0.8))
+        else:
+            self.budget = None
+
+        if self.hot_backups is not None:
+            self.archive = cold_archive(os.path.join(HOME, "archive.pack"),
+                                        os.path.join(HOME, "archive.json"),
+                                        self.archive_max_width,
+                                        self.archive_max_height)
+
+        if self.dedupe and phash.Image is None:
+            log.error("PIL is not installed, can't detect duplicates")
+        elif self.dedupe:
+            self.hashes = phash.hash_index(os.path.join(HOME, "phash.idx"),
+                                           self.dedupe_distance)
 
-        Daemonizes this object and process to call poll every now and then...
+    """ daemon
 
-        TODO: this
+        Keeps this process around and polls every now and then. The lock is
+        held for as long as the daemon runs, so cron invocations exit right
+        away and forced ones are picked up here.
     """
     def daemon(self):
 
-        pass
+        lock = lockfile(os.path.join(HOME, "lock"))
+
+        if not lock.acquire():
+            log.error("Another instance is running (pid {}), "
+                      "exiting".format(lock.holder()))
+            return False
+
+        log.info("Starting daemon mode")
+        self.daemonized = True
+
+        server = None
+        if self.control_socket:
+            server = control.control_server(self.control_socket,
+                                            {"next": self.next_image,
+                                             "skip": self.skip_image,
+                                             "status": self.status,
+                                             "reload": self.reload})
+            server.start()
+
+        try:
+            while True:
+                # a timeout or a dns failure shouldn't end daemon mode, the
+                # journal has the error
+                try:
+                    with self._commands:
+                        self._poll(lock.take_request())
+                    if self._prefetch_due():
+                        self._prefetch()
+                except Exception as e:
+                    log.error("The update failed! {}".format(e))
+                    time.sleep(DAEMON_ERROR_WAIT)
+                    continue
+
+                time.sleep(self._time_to_next_poll())
+
+        except KeyboardInterrupt:
+            log.info("Stopping daemon mode")
+
+        finally:
+            if server is not None:
+                server.shutdown()
+            self.hook.stop()
+            self.daemonized = False
+            lock.release()
+
+        return True
+
+    """
+        mirror
+
+        Runs in mirror mode: instead of updating the background, the fetcher
+        fills a catalog of images that is served over HTTP to the machines
+        using the "mirrorfetcher". See the "mirror" section of the settings.
+    """
+    def mirror(self):
+
+        settings = self.mirror_settings
+        server = mirror_server(self.fetcher,
+                               settings.get("directory",
+                                            os.path.join(HOME, "mirror")),
+                               settings.get("address", ""),
+                               settings.get("port", 8080),
+                               settings.get("catalog_size", 200),
+                               settings.get("interval", 300))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            log.info("Stopping mirror mode")
+            server.shutdown()
 
     """
         Update
 
         Fetches an image and replaces it in the target file or folder.
+
+        <Arguments>
+            record: a journal.run_record in which the timings, the fetcher's
+                    stats and the outcome of this update are recorded
+
+        <Returns>
+            True if the image was updated
+    """
+    def update(self, record=None):
+
+        if record is None:
+            record = journal.run_record()
+
+        # images downloaded ahead of time cost nothing
+        if self.prefetch and self._promote_prefetched(record):
+            return True
+
+        with self._fetching:
+            # a prefetch we waited for may have queued an image
+            if self.prefetch and self._promote_prefetched(record):
+                return True
+
+            return self._budgeted_update(record)
+
+    """
+        _budgeted_update
+
+        Fetches a new image within the budget, see update
+    """
+    def _budgeted_update(self, record):
+
+        if self.budget is None:
+            return self._update(record)
+
+        if self.budget.exhausted():
+            log.info("The budget is used up, not downloading anything")
+            record.data["budget"] = "exhausted"
+            if self.pool is not None:
+                return self._rotate_from_pool(record)
+            record.data["outcome"] = "over_budget"
+            return None
+
+        # cheaper downloads once we get close to the limits
+        self.fetcher.thrifty = self.budget.thrifty()
+        if self.fetcher.thrifty:
+            record.data["budget"] = "thrifty"
+
+        # every attempt counts, not only the one in the record
+        used = _usage(self.fetcher)
+        try:
+            return self._update(record)
+        finally:
+            self._charge(used)
+
     """
-    def update(self):
+        _charge
+
+        Adds what the fetcher spent since it had spent "before" to the
+        budget
+    """
+    def _charge(self, before):
+
+        after = _usage(self.fetcher)
+        self.budget.record(after[0] - before[0], after[1] - before[1])
+
+    """
+        _update
+
+        Does the actual update, see update
+    """
+    def _update(self, record):
 
         assert(isinstance(self.retries, int))
         assert(isinstance(self.target, str) or
@@ -126,63 +432,417 @@ class background_daemon:
         assert(isinstance(self.slack, int))
 
         self.target = str(self.target)
+        outcome = "no_candidate"
 
-        for i in range(self.retries):
+        # don't waste retries x slack seconds if we know we're offline
+        if self.pool is not None and not self._is_online():
+            log.info("We are offline, rotating from the local pool")
+            return self._rotate_from_pool(record)
 
-            query = self.fetcher.query()
+        self._deadline = None
+        if self.update_deadline:
+            self._deadline = deadline(self.update_deadline,
+                                      self.deadline_shares)
+        self.fetcher.update_deadline = self._deadline
 
-            if query is not None:
-                break
+        interrupted = None
+        i = 0
+        try:
+            for i in range(self.retries):
+
+                try:
+                    with record.phase("query"):
+                        # an interrupted download is resumed instead
+                        query = interrupted or self.fetcher.query()
+                except deadline_exceeded:
+                    raise
+                except Exception as e:
+                    if self.pool is None:
+                        raise
+                    log.error("Fetcher error, rotating from the local pool! "
+                              "{}".format(e))
+                    return self._rotate_from_pool(record)
+
+                record.data.update(getattr(self.fetcher, "stats", None) or {})
+
+                if query is None:
+                    # an incremental query saw everything, that won't
+                    # change in "slack" seconds
+                    stats = getattr(self.fetcher, "stats", None) or {}
+                    if stats.get("caught_up"):
+                        outcome = "caught_up"
+                        break
+                    self._sleep()
+                    continue
 
-            time.sleep(self.slack)
+                with record.phase("fetch"):
+                    if os.path.isdir(self.target):
+                        self.fetcher.fetch(query, self.target)
+                        self.fetcher.save_info(query, self.info_file)
+                        outcome = "updated"
+                    else:
+                        outcome = self._replace_target(query)
 
-        if query is None:
+                record.data.update(getattr(self.fetcher, "stats", None) or {})
+
+                # a failed download stays a candidate for the next query
+                if outcome in ("updated", "duplicate", "skipped"):
+                    _done(self.fetcher, query)
+
+                if outcome == "interrupted":
+                    interrupted = query
+                    self._sleep()
+                    continue
+
+                # a duplicate isn't worth waiting for, try another one now
+                if outcome not in ("duplicate", "skipped"):
+                    break
+
+        except deadline_exceeded as e:
+            log.error("Giving up on this update! {}".format(e))
+            outcome = "deadline"
+
+        record.data["attempts"] = i + 1
+
+        if outcome != "updated":
+            record.data["outcome"] = outcome
             return None
 
-        if (self.backup and not os.path.isdir(self.target) and
-                os.path.exists(self.target)):
+        self._run_hook(record)
+
+        record.data["outcome"] = "updated"
+        return True
+
+    """
+        _run_hook
+
+        Run the update command, the environment variables are passed to the
+        hook in case the daemon is not in the same namespace (happens with
+        chron). In daemon mode, back-to-back changes share a single run
+    """
+    def _run_hook(self, record):
+
+        if not self.update_hook:
+            return
+
+        timeout = None
+        if self._deadline is not None and not self.daemonized:
+            try:
+                timeout = self._deadline.timeout("hook")
+            except deadline_exceeded as e:
+                log.error("Not running the update hook! {}".format(e))
+                return
+
+        with record.phase("hook"):
+            if self.daemonized:
+                self.hook.schedule()
+            else:
+                self.hook.run(timeout)
+
+    """
+        _sleep
+
+        Waits "slack" seconds before retrying, unless that would go past
+        the update deadline
+    """
+    def _sleep(self):
+
+        if self._deadline is not None and \
+                self._deadline.remaining() <= self.slack:
+            raise deadline_exceeded("No time left to retry")
+
+        time.sleep(self.slack)
+
+    """
+        _is_online
+
+        A quick check to see if the network works before spending retries
+        on it
+    """
+    def _is_online(self):
+
+        host, port = self.connectivity_check.rsplit(":", 1)
+        return is_online(host, int(port), CONNECTIVITY_TIMEOUT)
+
+    """
+        _rotate_from_pool
+
+        Promotes the next image of the local pool to the target, used when
+        we can't get anything from the network.
+
+        <Returns>
+            True if the target was replaced
+    """
+    def _rotate_from_pool(self, record):
+
+        with record.phase("fallback"):
+            image = self.pool.next(exclude=self.target)
+
+            if image is None:
+                log.error("The local pool is empty, nothing to rotate")
+                record.data["outcome"] = "offline"
+                return None
 
-            digest = get_digest_for_file(self.target)
-            name, ext = os.path.splitext(self.target)
-            backup_target = "{}-{}{}".format(name, digest, ext)
+            # the partial of an interrupted download is left alone
+            partial = self._side_filename("pool")
+            if os.path.exists(partial):
+                os.unlink(partial)
+            link_or_copy(image, partial)
+            self._install(partial)
+
+        if self.info_file:
+            with open(self.info_file, "wt") as fp:
+                json.dump({"title": os.path.basename(image), "link": image,
+                           "section": "local pool"}, fp)
+
+        self._run_hook(record)
+
+        record.data["outcome"] = "fallback"
+        return True
+
+    """
+        _partial_filename
+
+        The hidden file next to the target in which images are prepared
+    """
+    def _partial_filename(self):
+
+        return self._side_filename("part")
+
+    """
+        _side_filename
+
+        A hidden file next to the target, images are prepared there so they
+        can be renamed over the target
+    """
+    def _side_filename(self, suffix):
+
+        directory, basename = os.path.split(self.target)
+        return os.path.join(directory, ".{}.{}".format(basename, suffix))
+
+    """
+        _install
+
+        Backs up the current target (as a hardlink) and renames the prepared
+        image over it.
+
+        <Arguments>
+            partial: the prepared image, in the same directory as the target
+    """
+    def _install(self, partial):
+
+        # a target with other links (e.g., it came from the pool) is already
+        # kept somewhere else
+        if (self.backup and os.path.exists(self.target) and
+                os.stat(self.target).st_nlink == 1):
+            backup_target = get_backup_filename(self.target)
 
             # we will only backup if it's not there yet
             if not os.path.exists(backup_target):
                 try:
-                    shutil.copyfile(self.target, backup_target)
-                except:
-                    log.error("couldn't create backup image!")
-                    pass
+                    link_or_copy(self.target, backup_target)
+                    if self.pool is not None:
+                        self.pool.add(backup_target)
+                except (IOError, OSError) as e:
+                    log.error("couldn't create backup image! {}".format(e))
+
+        os.rename(partial, self.target)
+
+        if self.archive is not None:
+            self._archive_backups()
+
+    """
+        _archive_backups
+
+        Keeps the "hot_backups" most recent backups next to the target and
+        moves the rest to the archive.
+    """
+    def _archive_backups(self):
+
+        backups = []
+        for digest, path in list_backups(self.target):
+            try:
+                backups.append((os.stat(path).st_mtime, digest, path))
+            except OSError:
+                continue
+
+        backups.sort(reverse=True)
+        for mtime, digest, path in backups[self.hot_backups:]:
+            if self.archive.add(path, digest):
+                os.unlink(path)
+
+    """
+        restore
+
+        Makes an old image the target again, from the archive or from the
+        backups next to the target.
+
+        <Arguments>
+            digest: The hash-prefix of the image (the one in its backup
+                    name)
+
+        <Returns>
+            True if the image was restored
+    """
+    def restore(self, digest):
+
+        lock = lockfile(os.path.join(HOME, "lock"))
+        if not lock.acquire():
+            log.error("Another instance is running (pid {}), try again "
+                      "later".format(lock.holder()))
+            return False
 
         try:
-            self.fetcher.fetch(query, self.target)
-            self.fetcher.save_info(query, self.info_file)
+            self.target = str(self.target)
+            partial = self._side_filename("restore")
+            if os.path.exists(partial):
+                os.unlink(partial)
+
+            backups = dict(list_backups(self.target))
+            if digest in backups:
+                link_or_copy(backups[digest], partial)
+                name = os.path.basename(backups[digest])
+            elif self.archive is not None:
+                name = self.archive.restore(digest, partial)
+            else:
+                name = None
+
+            if name is None:
+                log.error("There's no image with digest {}".format(digest))
+                return False
+
+            self._install(partial)
+
+            if self.info_file:
+                with open(self.info_file, "wt") as fp:
+                    json.dump({"title": name, "link": digest,
+                               "section": "restored"}, fp)
+
+            self._run_hook(journal.run_record())
+
+        finally:
+            lock.release()
+
+        log.info("Restored {}".format(digest))
+        return True
+
+    """
+        _replace_target
+
+        Replaces the target file in a rename-based transaction: the image is
+        downloaded next to the target, the old target is hardlinked to its
+        backup name and the new image is renamed over the target. No image is
+        ever copied and, if anything fails, the target is left untouched.
+
+        Images that are near-duplicates of a recent wallpaper are dropped
+        before they replace the target.
+
+        A download that fails halfway is kept, so fetchers that can resume
+        (see imgurfetcher) continue it when the same image is fetched again.
+        Anything else left in the partial (e.g., an older download of
+        another image) is dropped.
+
+        <Arguments>
+            query: the object returned by the fetcher's query method
+
+        <Returns>
+            "updated" if the target was replaced, "interrupted" if part of
+            the image was downloaded, "fetch_failed", "duplicate" or
+            "skipped" otherwise
+    """
+    def _replace_target(self, query):
+
+        partial = self._partial_filename()
+
+        if getattr(query, "link", None) in self._skipped_links():
+            log.info("{} was skipped before, dropping it".format(query.link))
+            return "skipped"
+
+        before = _file_size(partial)
+
+        try:
+            self.fetcher.fetch(query, partial)
+        except deadline_exceeded:
+            # what we got so far is kept if the next update can resume it
+            if not _resumable(self.fetcher, partial, before, query):
+                _drop_partial(self.fetcher, partial)
+            raise
         except Exception as e:
             log.error("Fetcher error, couldn't fetch image! {}".format(e))
-            if self.backup and not os.path.isdir(self.target):
-                try:
-                    shutil.copyfile(backup_target, self.target)
-                    shutil.rmfile(backup_taget)
-                except Exception as e:
-                    log.error("Couldn't load backup image! {}".format(e))
-                    pass
-            else:
-                raise
+            if _resumable(self.fetcher, partial, before, query):
+                return "interrupted"
+            _drop_partial(self.fetcher, partial)
+            return "fetch_failed"
+
+        name = getattr(query, "link", None) or os.path.basename(self.target)
+        digest = phash.dhash(partial) if self.hashes is not None else None
+        if digest is not None:
+            duplicate = self.hashes.find(digest)
+            if duplicate is not None:
+                log.info("{} is a duplicate of {}, dropping it".format(
+                         name, duplicate))
+                os.unlink(partial)
+                return "duplicate"
+
+        self._install(partial)
+
+        if digest is not None:
+            self.hashes.add(digest, name)
+
+        try:
+            self.fetcher.save_info(query, self.info_file)
+        except Exception as e:
+            log.error("Couldn't save image information! {}".format(e))
 
-        # Run the update command, the environment variables are overwritten
-        # in case the daemon is not in the same namespace (happens with chron)
-        if self.update_hook:
-            os.environ.update(self.env)
-            subprocess.call(shlex.split(self.update_hook))
+        return "updated"
 
     """
         poll method.
 
-        Checks whether is time to update or not
+        Checks whether is time to update or not. Only one instance polls at
+        a time, if another one is already running we exit right away. Forced
+        polls leave a request behind so the running instance updates once
+        more before exiting.
 
     """
     def poll(self, force=False):
 
+        lock = lockfile(os.path.join(HOME, "lock"))
+
+        if not lock.acquire():
+            if force:
+                lock.request()
+                log.info("An update is already running (pid {}), queueing "
+                         "the forced update".format(lock.holder()))
+            else:
+                log.info("Another instance is running (pid {}), "
+                         "exiting".format(lock.holder()))
+            self._journal(journal.run_record(forced=force), "busy")
+            return False
+
+        try:
+            self._sync_crontab()
+            result = self._poll(force)
+            while lock.take_request():
+                log.info("Running a forced update queued by another instance")
+                result = self._poll(True)
+        finally:
+            lock.release()
+
+        # a request may have been queued right before we released the lock
+        if lock.take_request():
+            return self.poll(True)
+
+        return result
+
+    """
+        _poll
+
+        Checks the timestamp and updates if needed, the caller should hold
+        the lock
+    """
+    def _poll(self, force=False):
+
         filename = os.path.join(HOME, "timestamp")
 
         log.info("Polling")
@@ -194,26 +854,303 @@ class background_daemon:
                 updatedate = datetime.datetime.fromtimestamp(float(timestamp))
             except:
                 log.error("timestamp is corrupted!, initializing...")
-                return self._initialize_datetime()
+                return self._initialize_timestamp()
+
+            record = journal.run_record(forced=force)
 
             if force or datetime.datetime.now() > updatedate:
+                # keep cron runs of a fleet from hitting imgur at once
+                if self.splay and not force and not self.daemonized:
+                    time.sleep(host_offset(self.splay, "splay"))
+
                 log.debug("updating timestamp")
-                self.update()
-                nexttimestamp = datetime.datetime.now() + datetime.timedelta(
-                        seconds=self.frequency)
+                try:
+                    self.update(record)
+                except Exception:
+                    self._journal(record, "error")
+                    raise
 
                 with open(filename, "wt") as fp:
-                    fp.write(nexttimestamp.strftime("%s"))
+                    fp.write(self._next_timestamp())
 
+                self._journal(record, record.data.get("outcome"))
                 return True
 
             else:
+                self._journal(record, "not_due")
                 return False
 
         else:
             log.info("No timestamp found! initializing...")
             return self._initialize_timestamp()
 
+    """
+        _journal
+
+        Appends the record of this run to the journal, a broken journal
+        should never break an update.
+    """
+    def _journal(self, record, outcome):
+
+        # the last update, prefetches happen in between
+        if not record.data.get("prefetch"):
+            self._last_run = record.data
+        try:
+            journal.append(self.journal_file, record.finish(outcome))
+        except (IOError, OSError, TypeError, ValueError) as e:
+            log.error("Couldn't write to the journal! {}".format(e))
+
+    """
+        show_stats method
+
+        Summarizes the journal and prints it to stdout
+    """
+    def show_stats(self):
+
+        if not os.path.exists(self.journal_file):
+            print("There is no journal yet! {}".format(self.journal_file))
+            return
+
+        journal.print_summary(journal.aggregate(self.journal_file))
+
+    """
+        _time_to_next_poll
+
+        How long should the daemon sleep before polling again. We never
+        sleep longer than DAEMON_TICK so queued requests are served quickly.
+    """
+    def _time_to_next_poll(self):
+
+        remaining = self._next_poll() - time.time()
+        return max(0, min(remaining, DAEMON_TICK))
+
+    """
+        _next_poll
+
+        The time of the next update, according to the timestamp
+    """
+    def _next_poll(self):
+
+        filename = os.path.join(HOME, "timestamp")
+
+        try:
+            with open(filename) as fp:
+                return float(fp.read())
+        except (IOError, ValueError):
+            return time.time() + self.frequency
+
+    """
+        _next_timestamp
+
+        The contents of the timestamp file for the next update: when the
+        crontab entry runs next if it was derived from the frequency,
+        otherwise the next slot of this host's schedule plus some jitter
+        (see bg_daemon.schedule)
+    """
+    def _next_timestamp(self):
+
+        now = time.time()
+
+        # cron only runs when an update is due, be due when it does
+        if not self.daemonized and os.path.exists(CRONTAB_FREQUENCY):
+            return str(next_cron_due(now, self.frequency))
+
+        return str(int(next_update(now, self.frequency, self.jitter)))
+
+    """
+        _sync_crontab
+
+        Rewrites the crontab entry if the frequency changed since it was
+        derived from it
+    """
+    def _sync_crontab(self):
+
+        try:
+            if sync_crontab_entry(self.frequency):
+                log.info("The frequency changed, rewrote the crontab entry")
+        except Exception as e:
+            log.error("Couldn't rewrite the crontab entry! {}".format(e))
+
+    """
+        _prefetch_due
+
+        Whether it's time to prefetch. Prefetching happens once per idle
+        window (the time until the next update), at a point of the window
+        that depends on the host, so machines that update at the same time
+        still don't prefetch at the same time.
+    """
+    def _prefetch_due(self):
+
+        if not self.prefetch:
+            return False
+
+        now = time.time()
+        window = self._next_poll()
+
+        if window != self._prefetch_window:
+            self._prefetch_window = window
+            self._prefetch_at = idle_point(now, window, self.jitter)
+
+        if self._prefetch_at is None or now < self._prefetch_at:
+            return False
+
+        self._prefetch_at = None
+        return True
+
+    """
+        _prefetched
+
+        The images that were prefetched, the oldest first
+    """
+    def _prefetched(self):
+
+        directory = os.path.join(HOME, "prefetch")
+        if not os.path.isdir(directory):
+            return []
+
+        return [os.path.join(directory, name)
+                for name in sorted(os.listdir(directory))
+                if not name.startswith(".") and not name.endswith(".json")]
+
+    """
+        _prefetch
+
+        Downloads an image into the prefetch queue ($HOME/prefetch), along
+        with its information, unless the queue is full. Nothing is done
+        near the limits of the budget.
+
+        <Returns>
+            True if an image was added to the queue
+    """
+    def _prefetch(self):
+
+        if len(self._prefetched()) >= self.prefetch or \
+                os.path.isdir(self.target):
+            return False
+
+        if self.budget is not None and self.budget.thrifty():
+            return False
+
+        directory = os.path.join(HOME, "prefetch")
+        if not os.path.isdir(directory):
+            os.mkdir(directory)
+
+        # named after the time, so the queue sorts from the oldest
+        ext = os.path.splitext(str(self.target))[1]
+        stamp = int(time.time() * 1000)
+        while True:
+            image = os.path.join(directory, "{:d}{}".format(stamp, ext))
+            if not os.path.exists(image):
+                break
+            stamp += 1
+        partial = os.path.join(directory, ".{}.part".format(
+                               os.path.basename(image)))
+
+        record = journal.run_record(prefetch=True)
+
+        # the command lock isn't held, "next" can promote what's queued
+        # while we download
+        with self._fetching:
+            self._deadline = None
+            if self.update_deadline:
+                self._deadline = deadline(self.update_deadline,
+                                          self.deadline_shares)
+            self.fetcher.update_deadline = self._deadline
+
+            used = _usage(self.fetcher)
+            try:
+                with record.phase("query"):
+                    query = self.fetcher.query()
+
+                if query is not None:
+                    with record.phase("fetch"):
+                        self.fetcher.fetch(query, partial)
+                    self.fetcher.save_info(query, "{}.json".format(image))
+                    os.rename(partial, image)
+                    _done(self.fetcher, query)
+
+            except Exception as e:
+                log.error("Couldn't prefetch an image! {}".format(e))
+                query = None
+
+            finally:
+                record.data.update(getattr(self.fetcher, "stats", None) or {})
+                if self.budget is not None:
+                    self._charge(used)
+                # a prefetch isn't resumed, its partial name is never reused
+                _drop_partial(self.fetcher, partial)
+
+        if query is None:
+            self._journal(record, "no_candidate")
+            return False
+
+        log.info("Prefetched {}".format(getattr(query, "link", image)))
+        self._journal(record, "prefetched")
+        return True
+
+    """
+        _promote_prefetched
+
+        Makes the oldest prefetched image the target. Near-duplicates of a
+        recent wallpaper are dropped on the way.
+
+        <Returns>
+            True if the target was replaced
+    """
+    def _promote_prefetched(self, record):
+
+        if os.path.isdir(self.target):
+            return False
+
+        self.target = str(self.target)
+        for image in self._prefetched():
+
+            info = "{}.json".format(image)
+            if self._info_link(info) in self._skipped_links():
+                log.info("{} was skipped before, dropping it".format(image))
+                os.unlink(image)
+                os.unlink(info)
+                continue
+
+            with record.phase("fetch"):
+                digest = None
+                if self.hashes is not None:
+                    digest = phash.dhash(image)
+
+                if digest is not None and \
+                        self.hashes.find(digest) is not None:
+                    log.info("{} is a duplicate, dropping it".format(image))
+                    os.unlink(image)
+                    if os.path.exists(info):
+                        os.unlink(info)
+                    continue
+
+                # the partial of an interrupted download is left alone
+                partial = self._side_filename("prefetched")
+                if os.path.exists(partial):
+                    os.unlink(partial)
+                link_or_copy(image, partial)
+                os.unlink(image)
+                self._install(partial)
+
+            if digest is not None:
+                self.hashes.add(digest, image)
+
+            if os.path.exists(info):
+                if self.info_file:
+                    with open(info) as source:
+                        data = source.read()
+                    with open(self.info_file, "wt") as fp:
+                        fp.write(data)
+                os.unlink(info)
+
+            self._run_hook(record)
+
+            record.data["outcome"] = "prefetched"
+            return True
+
+        return False
+
     """
         show_info method
 
@@ -256,9 +1193,7 @@ class background_daemon:
         filename = os.path.join(HOME, "timestamp")
         try:
             with open(filename, "wb") as fp:
-                nexttimestamp = datetime.datetime.now() + datetime.timedelta(
-                        seconds=self.frequency)
-                fp.write(nexttimestamp.strftime("%s"))
+                fp.write(self._next_timestamp())
 
             return True
 
@@ -266,21 +1201,299 @@ class background_daemon:
             # TODO: error handling here could be friendlier
             raise
 
+    """
+        next_image
+
+        The "next" command of the control socket: updates right away,
+        promoting a prefetched image if there's any.
+
+        <Returns>
+            The outcome and timings of the update
+    """
+    def next_image(self):
+
+        with self._commands:
+            self._poll(True)
+            # the queue just got shorter, fill it in this idle window
+            self._prefetch_window = None
+
+        run = self._last_run or {}
+        return {"outcome": run.get("outcome"),
+                "timings": run.get("timings")}
+
+    """
+        skip_image
+
+        The "skip" command of the control socket: the current image is
+        never shown again (it's not kept as a backup and, if it's fetched
+        or prefetched again, it's dropped) and it's changed right away.
+
+        <Returns>
+            The skipped link, and the outcome and timings of the update
+    """
+    def skip_image(self):
+
+        with self._commands:
+            self.target = str(self.target)
+            link = self._info_link(self.info_file)
+            if link is not None:
+                self._skip_link(link)
+
+            backup = None
+            if os.path.isfile(self.target):
+                backup = get_backup_filename(self.target)
+                if os.path.exists(backup):
+                    backup = None
+
+            self._poll(True)
+            self._prefetch_window = None
+
+            # the backup that _install just made of the skipped image
+            if backup is not None and os.path.exists(backup):
+                os.unlink(backup)
+
+        run = self._last_run or {}
+        return {"skipped": link, "outcome": run.get("outcome"),
+                "timings": run.get("timings")}
+
+    """
+        status
+
+        The "status" command of the control socket, it doesn't wait for a
+        running update
+
+        <Returns>
+            The current image, the prefetch queue, the seconds until the
+            next update and the journal record of the last run
+    """
+    def status(self):
+
+        return {"pid": os.getpid(),
+                "current": self._info_link(self.info_file),
+                "queue": len(self._prefetched()),
+                "prefetch": self.prefetch,
+                "next_update": round(self._next_poll() - time.time(), 1),
+                "last_run": self._last_run}
+
+    """
+        reload
+
+        The "reload" command of the control socket: the settings are loaded
+        into a new instance whose state replaces ours, so settings that
+        were removed go back to their defaults
+    """
+    def reload(self):
+
+        with self._commands:
+            fresh = background_daemon(self.settings_file)
+
+            self.hook.stop()
+            fresh.daemonized = self.daemonized
+            fresh._commands = self._commands
+            fresh._fetching = self._fetching
+            fresh._last_run = self._last_run
+
+            # a prefetch keeps using the old fetcher until it's done
+            with self._fetching:
+                vars(self).clear()
+                vars(self).update(vars(fresh))
+
+        log.info("Reloaded {}".format(self.settings_file))
+        return {"settings": self.settings_file}
+
+    """
+        _skipped_links
+
+        The links that were skipped with the "skip" command, they are kept
+        in $HOME/skipped.json
+    """
+    def _skipped_links(self):
+
+        if self._skipped is None:
+            self._skipped = []
+            filename = os.path.join(HOME, "skipped.json")
+            try:
+                with open(filename) as fp:
+                    self._skipped = json.load(fp)
+            except (IOError, ValueError):
+                pass
+
+        return self._skipped
+
+    def _skip_link(self, link):
+
+        skipped = self._skipped_links()
+        if link in skipped:
+            return
+
+        skipped.append(link)
+        del skipped[:-MAX_SKIPPED]
+
+        filename = os.path.join(HOME, "skipped.json")
+        partial = "{}.part".format(filename)
+        with open(partial, "wt") as fp:
+            json.dump(skipped, fp)
+        os.rename(partial, filename)
+
+    """
+        _info_link
+
+        The link in an information file (see save_info), or None
+    """
+    def _info_link(self, filename):
+
+        if not filename:
+            return None
+
+        try:
+            with open(filename) as fp:
+                return json.load(fp).get("link")
+        except (IOError, ValueError, AttributeError):
+            return None
+
+
+def _done(fetcher, image):
+    """
+        _done
+
+        Tells the fetcher its candidate was installed (or dropped for good),
+        only some fetchers care
+    """
+    done = getattr(fetcher, "done", None)
+    if done is not None:
+        done(image)
+
+
+def _usage(fetcher):
+    """
+        _usage
+
+        The (bytes, calls) a fetcher spent so far, fetchers that don't use
+        the network don't keep track
+    """
+    usage = getattr(fetcher, "usage", None)
+    if usage is None:
+        return (0, 0)
+    return usage()
+
+
+def _file_size(filename):
+
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+
+def _resumable(fetcher, partial, before, query):
+    """
+        _resumable
+
+        Whether a failed fetch left a download that can be resumed: the
+        partial grew during this attempt, and the fetcher can resume it.
+        Fetchers that can't resume don't say.
+    """
+    if _file_size(partial) <= before:
+        return False
+
+    resumable = getattr(fetcher, "resumable", None)
+    if resumable is None:
+        return False
+    return resumable(partial, query)
+
+
+def _drop_partial(fetcher, partial):
+    """
+        _drop_partial
+
+        Removes a partial download, and whatever the fetcher kept to resume
+        it
+    """
+    if os.path.exists(partial):
+        os.unlink(partial)
+
+    discard = getattr(fetcher, "discard", None)
+    if discard is not None:
+        discard(partial)
+
+
+def _load_fetcher(name):
+    """
+        _load_fetcher
+
+        Loads the fetcher module bg_daemon.fetchers.<name> and returns an
+        instance of the class with the same name
+    """
+    module_name = "bg_daemon.fetchers.{}".format(name)
+    module = importlib.import_module(module_name)
+    fetcher = getattr(module, name)
+    return fetcher()
+
+
+def _control_socket():
+    """
+        _control_socket
+
+        Where the daemon's control socket is, without loading the settings
+        into a daemon instance
+    """
+    try:
+        with open(os.path.join(HOME, "settings.json")) as fp:
+            path = json.load(fp).get("daemon", {}).get("control_socket")
+    except (IOError, ValueError):
+        path = None
+
+    return path or background_daemon.control_socket
+
 
 """
     The main method is set to generate a new instance and call update. This
     is useful if you want to call it from a chrontab or whatever
 """
 if __name__ == "__main__":
-    daemon = background_daemon()
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--info", help="Show info about current image",
                         action="store_true")
     parser.add_argument("--force", help="Disregard the last updated check",
                         action="store_true")
+    parser.add_argument("--daemon", help="Keep running and poll periodically"
+                        " instead of exiting", action="store_true")
+    parser.add_argument("--stats", help="Summarize the journal of past runs",
+                        action="store_true")
+    parser.add_argument("--mirror", help="Serve images to other machines "
+                        "instead of updating the background",
+                        action="store_true")
+    parser.add_argument("--restore", help="Make an old image (by the digest "
+                        "in its backup name) the background again",
+                        metavar="DIGEST")
+    parser.add_argument("--control", help="Send a command to the running "
+                        "daemon", choices=control.COMMANDS)
     args = parser.parse_args()
+
+    # the daemon answers, we don't need to load anything
+    if args.control:
+        try:
+            reply = control.send(_control_socket(), args.control,
+                                 5 if args.control == "status" else None)
+        except socket.error as e:
+            print("Is the daemon running? Couldn't connect: {}".format(e))
+            sys.exit(1)
+
+        for key in sorted(reply):
+            print("{:30}: {}".format(key, reply[key]))
+        sys.exit(0 if reply.get("ok") else 1)
+
+    daemon = background_daemon()
     if args.info:
         daemon.show_info()
+    elif args.stats:
+        daemon.show_stats()
+    elif args.mirror:
+        daemon.mirror()
+    elif args.restore:
+        daemon.restore(args.restore)
+    elif args.daemon:
+        daemon.daemon()
     else:
         daemon.poll(args.force)
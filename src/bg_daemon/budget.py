@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""
+    bg_daemon.budget
+
+    Bandwidth and API call accounting, for machines on metered or shared
+    uplinks. Every update adds the bytes it downloaded and the API calls it
+    made to the counters of the current hour and day, which are kept in the
+    bg_daemon home so they survive restarts (and cron).
+
+    The daemon checks how much of the budget is used before updating: past
+    a threshold it asks the fetcher to be thrifty (smaller variants of the
+    images, no probing), and once a limit is reached it only rotates
+    through the images it already has.
+"""
+import os
+import json
+import time
+import logging
+
+# the accounting windows, in seconds
+WINDOWS = {"hour": 3600, "day": 86400}
+
+
+class usage_budget:
+    """
+        usage_budget
+
+        Per hour and per day usage counters and their limits.
+
+        <Properties>
+            filename:   Where the counters are kept
+
+            limits:     A dictionary with any of bytes_per_hour,
+                        bytes_per_day, calls_per_hour and calls_per_day.
+                        Missing or null limits aren't enforced
+
+            threshold:  The fraction of a limit after which we should be
+                        thrifty
+
+        <Functions>
+            record():   Adds to the counters
+
+            used():     The largest fraction of a limit that's used
+
+            thrifty():  True if we are past the threshold
+
+            exhausted(): True if a limit was reached
+    """
+    filename = None
+    limits = None
+    threshold = None
+
+    def __init__(self, filename, limits, threshold=0.8):
+
+        self.filename = filename
+        self.limits = limits
+        self.threshold = threshold
+
+        self._counters = {}
+        self._load()
+
+    """
+        record
+
+        Adds the usage of an update to the counters of the current hour and
+        day.
+    """
+    def record(self, bytes=0, calls=0):
+
+        for window in WINDOWS:
+            counter = self._counter(window)
+            counter["bytes"] += bytes
+            counter["calls"] += calls
+
+        self._save()
+
+    def used(self):
+
+        used = 0.0
+        for window in WINDOWS:
+            counter = self._counter(window)
+            for kind in ("bytes", "calls"):
+                limit = self.limits.get("{}_per_{}".format(kind, window))
+                if limit:
+                    used = max(used, counter[kind] / float(limit))
+
+        return used
+
+    def thrifty(self):
+
+        return self.used() >= self.threshold
+
+    def exhausted(self):
+
+        return self.used() >= 1
+
+    """
+        _counter
+
+        The counter of the current window, a new one if the window changed
+    """
+    def _counter(self, window):
+
+        start = int(time.time() // WINDOWS[window] * WINDOWS[window])
+        counter = self._counters.get(window)
+
+        if counter is None or counter["start"] != start:
+            counter = {"start": start, "bytes": 0, "calls": 0}
+            self._counters[window] = counter
+
+        return counter
+
+    def _load(self):
+
+        if not os.path.exists(self.filename):
+            return
+
+        try:
+            with open(self.filename) as fp:
+                self._counters = json.load(fp)
+        except (IOError, ValueError) as e:
+            logger.error("Couldn't load the budget {}".format(e))
+
+    def _save(self):
+
+        partial = "{}.part".format(self.filename)
+        try:
+            with open(partial, "wt") as fp:
+                json.dump(self._counters, fp)
+            os.rename(partial, self.filename)
+        except (IOError, OSError) as e:
+            logger.error("Couldn't save the budget {}".format(e))
+
+
+logger = logging.getLogger("bg_daemon")
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+"""
+    bg_daemon.cache
+
+    A download cache shared by every user on the host. On a terminal server
+    every user runs their own daemon, and they would all download the same
+    popular images separately. With a shared cache, an image is downloaded
+    once per host: the fetchers look it up in the cache first, and publish
+    what they download so the next user finds it.
+
+    Concurrent access is handled with:
+
+        * lock files, so only one user downloads a given image while the
+          others wait for it to show up in the cache. There's a fixed set of
+          them (an entry uses the one its key picks), the cache doesn't gain
+          a file per image that's never removed
+        * atomic publishing, images are written to a temporary name and
+          renamed into place, so a reader never sees a partial image
+        * LRU eviction, hits refresh an entry's mtime and the oldest entries
+          are removed once the cache grows beyond its size limit
+
+    The cache directory should be writable by every user (e.g., a setgid
+    directory owned by a common group). If it's sticky (like /tmp), users can
+    only evict their own entries.
+"""
+import os
+import time
+import errno
+import fcntl
+import logging
+
+from hashlib import sha256
+from bg_daemon.util import link_or_copy
+
+# how often we check a busy entry lock while waiting for it, in seconds
+_LOCK_POLL_INTERVAL = 0.1
+
+# how many lock files the entries share, downloads of two images that share
+# one wait for each other
+_LOCK_SLOTS = 64
+
+
+class shared_cache:
+    """
+        shared_cache
+
+        A directory of downloaded images keyed by their link.
+
+        <Properties>
+            directory:  The shared cache directory
+
+            max_bytes:  The size after which old entries are evicted
+
+            timeout:    How long we wait for another user downloading the
+                        same image before downloading it ourselves
+
+        <Functions>
+            get():      Copies (or links) a cached image to a destination
+
+            publish():  Adds an image to the cache
+
+            fetch():    Gets an image from the cache, downloading and
+                        publishing it if it's not there yet
+    """
+    directory = None
+    max_bytes = None
+    timeout = None
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, timeout=120):
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+
+    """
+        get
+
+        Looks up an image in the cache.
+
+        <Arguments>
+            link:           The link of the image
+
+            destination:    Where to put the image if it's cached, it must
+                            not exist
+
+        <Returns>
+            True if the image was in the cache
+    """
+    def get(self, link, destination):
+
+        entry = self._entry(link)
+
+        try:
+            link_or_copy(entry, destination)
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                logger.error("Couldn't read {} from the cache {}".format(
+                             entry, e))
+            return False
+
+        # refresh the entry for the LRU, we can't if it's not ours
+        try:
+            os.utime(entry, None)
+        except OSError:
+            pass
+
+        logger.info("Found {} in the shared cache".format(link))
+        return True
+
+    """
+        publish
+
+        Adds an image to the cache, the entry is readable by everyone.
+
+        <Arguments>
+            link:       The link of the image
+
+            filename:   The downloaded image
+    """
+    def publish(self, link, filename):
+
+        entry = self._entry(link)
+        partial = "{}.{}.part".format(entry, os.getpid())
+
+        try:
+            link_or_copy(filename, partial)
+            os.chmod(partial, 0644)
+            os.rename(partial, entry)
+        except (IOError, OSError) as e:
+            logger.error("Couldn't publish {} to the cache {}".format(link, e))
+            if os.path.exists(partial):
+                os.unlink(partial)
+            return
+
+        self._evict()
+
+    """
+        fetch
+
+        Gets an image through the cache. If another user is downloading the
+        same image, we wait for them instead of downloading it twice.
+
+        <Arguments>
+            link:           The link of the image
+
+            destination:    Where to put the image
+
+            download:       A function called as download(link, destination)
+                            when the image isn't cached
+    """
+    def fetch(self, link, destination, download):
+
+        if self.get(link, destination):
+            return
+
+        fd = self._lock(link)
+        try:
+            # somebody might have published it while we waited
+            if fd is not None and self.get(link, destination):
+                return
+
+            download(link, destination)
+            self.publish(link, destination)
+
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def _entry(self, link):
+
+        key = sha256(link).hexdigest()
+        ext = os.path.splitext(link)[1][:5]
+        return os.path.join(self.directory, "{}{}".format(key, ext))
+
+    def _lock_filename(self, link):
+
+        slot = int(sha256(link).hexdigest()[:8], 16) % _LOCK_SLOTS
+        return os.path.join(self.directory, "{:02x}.lock".format(slot))
+
+    """
+        _lock
+
+        Takes the lock of an entry, waiting up to timeout seconds for it.
+        Returns None if we couldn't get it, in that case we go on without it.
+    """
+    def _lock(self, link):
+
+        path = self._lock_filename(link)
+
+        # lock files can be owned by someone else, we only need to read them
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                return None
+            try:
+                fd = os.open(path, os.O_RDONLY | os.O_CREAT, 0644)
+            except OSError:
+                return None
+
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    break
+
+            if time.time() > deadline:
+                logger.info("Gave up waiting for {}".format(path))
+                break
+
+            time.sleep(_LOCK_POLL_INTERVAL)
+
+        os.close(fd)
+        return None
+
+    """
+        _evict
+
+        Removes the least recently used entries until the cache fits in
+        max_bytes.
+    """
+    def _evict(self):
+
+        entries = []
+        total = 0
+        for filename in os.listdir(self.directory):
+            if filename.endswith((".lock", ".part")):
+                continue
+
+            path = os.path.join(self.directory, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                # it's someone else's or it's already gone
+                continue
+
+
+logger = logging.getLogger("bg_daemon")
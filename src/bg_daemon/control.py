@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+"""
+    bg_daemon.control
+
+    The control socket of daemon mode. A running daemon listens on a
+    Unix-domain socket (in the bg_daemon home, so only the user can reach
+    it) and answers a few commands right away, without starting a new
+    process that loads the settings and fetches from scratch:
+
+        next        change the image now (a prefetched one if there's any)
+        skip        never show the current image again and change it
+        status      the prefetch queue, the next update and the last run
+        reload      load the settings again
+
+    The protocol is a single line per connection: the client sends the
+    command and the daemon answers with a json object and closes the
+    connection. send() is the client side.
+"""
+import os
+import json
+import socket
+import threading
+import logging
+import SocketServer
+
+COMMANDS = ("next", "skip", "status", "reload")
+
+# the longest command we read, anything longer isn't a command
+_MAX_COMMAND = 64
+
+
+class _unix_server(SocketServer.ThreadingMixIn,
+                   SocketServer.UnixStreamServer):
+
+    daemon_threads = True
+    control = None
+
+
+class _request_handler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+
+        command = self.rfile.readline(_MAX_COMMAND).strip()
+        reply = self.server.control.dispatch(command)
+        self.wfile.write(json.dumps(reply) + "\n")
+
+
+class control_server:
+    """
+        control_server
+
+        Serves the commands of a daemon on a Unix-domain socket, from a
+        background thread.
+
+        <Properties>
+            path:       The path of the socket
+
+            handlers:   A dictionary from a command to the function that
+                        runs it, the function returns a dictionary that's
+                        sent back
+
+        <Functions>
+            start():    Starts serving
+
+            dispatch(): Runs a command and returns its reply
+
+            shutdown(): Stops serving and removes the socket
+    """
+    path = None
+    handlers = None
+
+    def __init__(self, path, handlers):
+
+        self.path = path
+        self.handlers = handlers
+
+        # we hold the daemon lock, a socket that's there is a leftover
+        if os.path.exists(path):
+            os.unlink(path)
+
+        # only the user can connect, from the moment the socket exists
+        umask = os.umask(0177)
+        try:
+            self.server = _unix_server(path, _request_handler)
+        finally:
+            os.umask(umask)
+        self.server.control = self
+
+        self._thread = None
+
+    def start(self):
+
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        name="control")
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info("Listening for commands on {}".format(self.path))
+
+    """
+        dispatch
+
+        Runs a command, errors are sent back instead of breaking the daemon
+
+        <Returns>
+            The reply, a dictionary with "ok" and either the result of the
+            command or an "error"
+    """
+    def dispatch(self, command):
+
+        handler = self.handlers.get(command)
+        if handler is None:
+            return {"ok": False,
+                    "error": "Unknown command {!r}, try one of {}".format(
+                             command, ", ".join(COMMANDS))}
+
+        try:
+            reply = dict(handler() or {})
+        except Exception as e:
+            logger.error("The {} command failed! {}".format(command, e))
+            return {"ok": False, "error": str(e)}
+
+        reply["ok"] = True
+        return reply
+
+    def shutdown(self):
+
+        self.server.shutdown()
+        self.server.server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def send(path, command, timeout=None):
+    """
+        send:
+
+        sends a command to the daemon listening on a control socket.
+
+        arguments:
+            path: the path of the socket
+
+            command: one of COMMANDS
+
+            timeout: how many seconds to wait for the reply, None waits until
+            the command is done (an update can take a while)
+
+        output:
+            the reply of the daemon, a dictionary
+
+        raises:
+            socket.error if there's no daemon listening
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(timeout)
+    try:
+        connection.connect(path)
+        connection.sendall("{}\n".format(command))
+
+        chunks = []
+        while True:
+            chunk = connection.recv(4096)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        connection.close()
+
+    return json.loads("".join(chunks))
+
+
+logger = logging.getLogger("bg_daemon")
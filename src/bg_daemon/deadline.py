@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+    bg_daemon.deadline
+
+    An end-to-end time budget for an update. Without it, a stalled socket
+    can hang an update forever (and with cron, processes pile up).
+
+    The budget is split across the phases of an update, in order: each
+    phase can use whatever the previous ones left, minus the shares reserved
+    for the phases that come after it. Network operations use what their
+    phase can spend as their timeout, and once that's gone they raise
+    deadline_exceeded instead of starting.
+"""
+import time
+
+# the phases of an update, in order
+PHASES = ("search", "album", "probe", "download", "hook")
+
+# the fraction of the budget reserved for each phase
+DEFAULT_SHARES = {"search": 0.3, "album": 0.15, "probe": 0.1,
+                  "download": 0.4, "hook": 0.05}
+
+
+class deadline_exceeded(Exception):
+    """
+        deadline_exceeded
+
+        Raised when a phase has no time left
+    """
+    pass
+
+
+class deadline:
+    """
+        deadline
+
+        The time budget of a single update.
+
+        <Properties>
+            total:      The budget, in seconds
+
+            shares:     The fraction of the budget reserved for each phase
+
+        <Functions>
+            remaining(): The time left for the whole update
+
+            timeout():  The time a phase can spend, to be used as the
+                        timeout of its network operations
+    """
+    total = None
+    shares = None
+
+    def __init__(self, total, shares=None):
+
+        self.total = total
+        self.shares = dict(DEFAULT_SHARES)
+        self.shares.update(shares or {})
+
+        self._start = time.time()
+
+    def remaining(self):
+
+        return self.total - (time.time() - self._start)
+
+    """
+        timeout
+
+        The time the phase can spend: the remaining budget minus what's
+        reserved for the phases after it.
+
+        <Arguments>
+            phase:      One of PHASES
+
+        <Returns>
+            A timeout in seconds, it raises deadline_exceeded if there's no
+            time left
+    """
+    def timeout(self, phase):
+
+        later = PHASES[PHASES.index(phase) + 1:]
+        reserved = self.total * sum(self.shares.get(name, 0)
+                                    for name in later)
+
+        available = self.remaining() - reserved
+        if available <= 0:
+            raise deadline_exceeded("No time left for the {} phase".format(
+                                    phase))
+
+        return available
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+    bg_daemon.fetchers.albumcache
+
+    A persistent cache of album listings. Popular albums come back in
+    search after search, and expanding one costs an API call every time.
+    The listing of an album barely changes, so we keep the images of the
+    albums we expanded (as candidate records in their list form) for a
+    while.
+
+    Entries expire after "ttl" seconds, and once there are more than
+    "max_entries" albums the least recently used ones are dropped. A hit
+    only writes the file when it changes the order: every cron run is a
+    new process, the order has to be saved for the next one to evict the
+    right albums.
+"""
+import os
+import json
+import time
+import logging
+
+from collections import OrderedDict
+from bg_daemon.fetchers.candidate import candidate
+
+
+class album_cache:
+    """
+        album_cache
+
+        Album listings keyed by album id.
+
+        <Properties>
+            filename:       Where the cache is kept
+
+            ttl:            How long (in seconds) is a listing good for
+
+            max_entries:    How many albums are kept
+
+        <Functions>
+            get():          The images of an album, or None
+
+            put():          Stores the images of an album
+    """
+    filename = None
+    ttl = None
+    max_entries = None
+
+    def __init__(self, filename, ttl=86400, max_entries=500):
+
+        self.filename = filename
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        # album id -> [time it was listed, [record lists]], oldest use first
+        self._entries = OrderedDict()
+        self._load()
+
+    """
+        get
+
+        <Returns>
+            A list of candidate records, or None if the album isn't cached
+            or its listing expired
+    """
+    def get(self, album_id):
+
+        entry = self._entries.get(album_id)
+        if entry is None:
+            return None
+
+        # an expired entry stays in the file until the next write
+        if time.time() - entry[0] > self.ttl:
+            del self._entries[album_id]
+            return None
+
+        # it's the most recently used now
+        if next(reversed(self._entries)) != album_id:
+            del self._entries[album_id]
+            self._entries[album_id] = entry
+            self._save()
+
+        logger.debug("album %s was cached", album_id)
+        return [candidate.from_list(values) for values in entry[1]]
+
+    """
+        put
+
+        Stores the listing of an album. Only candidate records are cached.
+    """
+    def put(self, album_id, images):
+
+        if not all(isinstance(image, candidate) for image in images):
+            return
+
+        self._entries.pop(album_id, None)
+        self._entries[album_id] = [time.time(),
+                                   [image.to_list() for image in images]]
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+        self._save()
+
+    def _load(self):
+
+        if not os.path.exists(self.filename):
+            return
+
+        try:
+            with open(self.filename) as fp:
+                entries = json.load(fp)
+        except (IOError, ValueError) as e:
+            logger.error("Couldn't load the album cache {}".format(e))
+            return
+
+        # they were saved from the least to the most recently used
+        now = time.time()
+        for album_id, entry in entries:
+            if now - entry[0] <= self.ttl:
+                self._entries[album_id] = entry
+
+    def _save(self):
+
+        partial = "{}.part".format(self.filename)
+        try:
+            with open(partial, "wt") as fp:
+                json.dump(self._entries.items(), fp, separators=(",", ":"))
+            os.rename(partial, self.filename)
+        except (IOError, OSError) as e:
+            logger.error("Couldn't save the album cache {}".format(e))
+
+
+logger = logging.getLogger("bg_daemon")
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+    bg_daemon.fetchers.candidate
+
+    A compact record for the images (and albums) an API search returns.
+    imgurpython turns every result into a model object carrying every field
+    imgur sends; we only keep the handful that selection, fetching and
+    save_info use, in a __slots__ class without a per-instance dictionary.
+
+    Records serialize to plain lists (to_list/from_list), so caches can store
+    them as JSON without the field names.
+"""
+
+# the fields we keep, the order is the serialization order
+FIELDS = ("id", "link", "title", "description", "width", "height", "size",
+          "views", "datetime", "nsfw", "section", "account_url", "is_album")
+
+
+class candidate(object):
+    """
+        candidate
+
+        An image or album from a search, the fields are attributes (missing
+        ones are None).
+    """
+    __slots__ = FIELDS
+
+    def __init__(self, *values):
+
+        values = values + (None,) * (len(FIELDS) - len(values))
+        for name, value in zip(FIELDS, values):
+            setattr(self, name, value)
+
+    """
+        from_api
+
+        Builds a record from an item of an API response, the rest of the
+        item is dropped
+    """
+    @classmethod
+    def from_api(cls, item):
+
+        return cls(*[item.get(name) for name in FIELDS])
+
+    @classmethod
+    def from_list(cls, values):
+
+        return cls(*values)
+
+    def to_list(self):
+
+        return [getattr(self, name) for name in FIELDS]
+
+    def __eq__(self, other):
+
+        return isinstance(other, candidate) and \
+            self.to_list() == other.to_list()
+
+    def __ne__(self, other):
+
+        return not self == other
+
+    def __repr__(self):
+
+        return "candidate({!r}, {!r})".format(self.id, self.link)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+    bg_daemon.fetchers.cursor
+
+    A high-water mark for "recent" mode. Without it, every update looks at
+    the newest page of results and picks from its head, so the same image
+    comes back until something newer is posted.
+
+    The cursor remembers, for every query, the date of the newest item we
+    already went through (and the ids posted at that exact second). Results
+    are filtered down to what's newer than that and walked from the oldest
+    to the newest, so consecutive updates move forward through the posts
+    and each poll only deals with what's new.
+
+    A page only holds the newest results. If more than a page was posted
+    since the last update, the gap is skipped.
+"""
+import os
+import json
+import logging
+
+
+class recent_cursor:
+    """
+        recent_cursor
+
+        The persistent high-water marks of the recent mode queries.
+
+        <Properties>
+            filename:   Where the marks are kept
+
+        <Functions>
+            unseen():   Filters results down to what's past the mark
+
+            advance():  Moves the mark past the given results
+    """
+    filename = None
+
+    def __init__(self, filename):
+
+        self.filename = filename
+        self._marks = {}
+        self._load()
+
+    """
+        unseen
+
+        <Arguments>
+            query:  The query the results come from
+
+            items:  The results, anything with id and datetime attributes
+
+        <Returns>
+            The results past the mark, from the oldest to the newest. Items
+            without a date are kept, at the end.
+    """
+    def unseen(self, query, items):
+
+        mark = self._marks.get(query)
+        dated = []
+        undated = []
+
+        for item in items:
+            date = getattr(item, "datetime", None)
+            if date is None:
+                undated.append(item)
+            elif mark is None or date > mark["datetime"] or \
+                    (date == mark["datetime"] and item.id not in mark["ids"]):
+                dated.append(item)
+
+        # stable, items posted on the same second keep their order
+        dated.sort(key=lambda item: item.datetime)
+        return dated + undated
+
+    """
+        advance
+
+        Moves the mark of a query past the given results, they won't be
+        returned by unseen again.
+    """
+    def advance(self, query, items):
+
+        dates = [item.datetime for item in items
+                 if getattr(item, "datetime", None) is not None]
+        if not dates:
+            return
+
+        mark = self._marks.get(query, {"datetime": None, "ids": []})
+        newest = max(dates)
+
+        if newest > mark["datetime"]:
+            mark = {"datetime": newest, "ids": []}
+
+        if newest == mark["datetime"]:
+            mark["ids"] = sorted(set(mark["ids"]).union(
+                item.id for item in items
+                if getattr(item, "datetime", None) == newest))
+
+        self._marks[query] = mark
+        self._save()
+
+    def _load(self):
+
+        if not os.path.exists(self.filename):
+            return
+
+        try:
+            with open(self.filename) as fp:
+                self._marks = json.load(fp)
+        except (IOError, ValueError) as e:
+            logger.error("Couldn't load the recent cursor {}".format(e))
+
+    def _save(self):
+
+        partial = "{}.part".format(self.filename)
+        try:
+            with open(partial, "wt") as fp:
+                json.dump(self._marks, fp, separators=(",", ":"))
+            os.rename(partial, self.filename)
+        except (IOError, OSError) as e:
+            logger.error("Couldn't save the recent cursor {}".format(e))
+
+
+logger = logging.getLogger("bg_daemon")
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+import time
+import threading
+import logging
+import Queue
+
+STRATEGIES = ("first", "best")
+
+
+class hedgedfetcher:
+    """
+        hedgedfetcher class
+
+        Queries several fetchers at the same time (e.g., imgur and a local
+        directory) so a slow source doesn't set the update latency. It's used
+        by the daemon when the "fetcher" setting is a list.
+
+        With the "first" strategy, the first candidate that arrives wins.
+        With "best", we wait for every fetcher (up to the deadline) and keep
+        the candidate with the highest resolution. Fetchers that didn't answer
+        in time are abandoned: their answer is dropped when it arrives, and
+        they are not queried again until it does.
+
+        <Properties>
+
+            fetchers: the list of fetcher instances
+
+            deadline: how long (in seconds) do we wait for the fetchers
+
+            strategy: either "first" or "best"
+
+            stats: the stats of the fetcher that provided the last candidate
+
+            update_deadline: The deadline of the current update (see
+                             bg_daemon.deadline), passed on to the fetchers
+
+            thrifty: Passed on to the fetchers, see bg_daemon.budget
+
+        <Functions>
+
+            query(): Queries every fetcher and picks a candidate
+            fetch(): Fetches the candidate with the fetcher that provided it
+            save_info(): Same idea
+            done(): Same idea
+            usage(): The bytes and API calls spent by all the fetchers
+    """
+    fetchers = None
+    deadline = None
+    strategy = None
+    stats = None
+    update_deadline = None
+    thrifty = False
+
+    def __init__(self, fetchers, deadline=10, strategy="first"):
+
+        if not fetchers:
+            raise ValueError("At least one fetcher is needed!")
+
+        if strategy not in STRATEGIES:
+            raise ValueError("Unknown strategy {}".format(strategy))
+
+        self.fetchers = fetchers
+        self.deadline = deadline
+        self.strategy = strategy
+        self.stats = {}
+
+        self._busy = set()
+        self._busy_lock = threading.Lock()
+        self._owner = None
+
+    """
+        query
+
+        Queries every fetcher that's not busy concurrently.
+
+        <Returns>
+            The selected candidate, or None if no fetcher found one. If every
+            fetcher failed, the first error is raised.
+    """
+    def query(self):
+
+        results = Queue.Queue()
+        started = 0
+
+        wait = self.deadline
+        if self.update_deadline is not None:
+            wait = min(wait, self.update_deadline.timeout("search"))
+
+        for fetcher in self.fetchers:
+            with self._busy_lock:
+                if fetcher in self._busy:
+                    logger.info("{} is still busy, skipping it".format(
+                                _name(fetcher)))
+                    continue
+                self._busy.add(fetcher)
+
+            fetcher.update_deadline = self.update_deadline
+            fetcher.thrifty = self.thrifty
+            thread = threading.Thread(target=self._query,
+                                      args=(fetcher, results),
+                                      name=_name(fetcher))
+            thread.daemon = True
+            thread.start()
+            started += 1
+
+        deadline = time.time() + wait
+        pending = started
+        selected = None
+        errors = []
+
+        while pending:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+
+            try:
+                fetcher, candidate, error = results.get(timeout=remaining)
+            except Queue.Empty:
+                break
+
+            pending -= 1
+
+            if error is not None:
+                errors.append(error)
+                continue
+
+            if candidate is None:
+                continue
+
+            if self.strategy == "first":
+                selected = (fetcher, candidate)
+                break
+
+            if selected is None or _score(candidate) > _score(selected[1]):
+                selected = (fetcher, candidate)
+
+        if pending:
+            logger.info("Abandoning {} slow fetchers".format(pending))
+
+        if selected is None:
+            if errors and len(errors) == started:
+                raise errors[0]
+            return None
+
+        self._owner, candidate = selected
+        self.stats = dict(getattr(self._owner, "stats", None) or {})
+        self.stats['fetcher'] = _name(self._owner)
+
+        logger.info("Using the candidate from {}".format(_name(self._owner)))
+        return candidate
+
+    def fetch(self, imgobject, filename):
+
+        if self._owner is None:
+            raise ValueError("There's no candidate to fetch!")
+
+        self._owner.update_deadline = self.update_deadline
+        result = self._owner.fetch(imgobject, filename)
+        self.stats.update(getattr(self._owner, "stats", None) or {})
+        return result
+
+    def save_info(self, imgobject, filename):
+
+        if self._owner is None:
+            raise ValueError("There's no candidate to save!")
+
+        return self._owner.save_info(imgobject, filename)
+
+    def done(self, imgobject):
+
+        if self._owner is not None:
+            _done(self._owner, imgobject)
+
+    def resumable(self, filename, imgobject):
+
+        resumable = getattr(self._owner, "resumable", None)
+        if resumable is None:
+            return False
+        return resumable(filename, imgobject)
+
+    def discard(self, filename):
+
+        # the partial may be left by any of them, in an earlier run
+        for fetcher in self.fetchers:
+            discard = getattr(fetcher, "discard", None)
+            if discard is not None:
+                discard(filename)
+
+    def usage(self):
+
+        used = [0, 0]
+        for fetcher in self.fetchers:
+            for i, value in enumerate(_usage(fetcher)):
+                used[i] += value
+
+        return tuple(used)
+
+    def _query(self, fetcher, results):
+
+        candidate = None
+        error = None
+
+        try:
+            candidate = fetcher.query()
+        except Exception as e:
+            logger.error("{} failed: {}".format(_name(fetcher), e))
+            error = e
+        finally:
+            with self._busy_lock:
+                self._busy.discard(fetcher)
+
+        results.put((fetcher, candidate, error))
+
+
+def _name(fetcher):
+
+    return fetcher.__class__.__name__
+
+
+def _done(fetcher, imgobject):
+    """
+        _done:
+
+        tells a fetcher its candidate was installed, only some fetchers
+        care
+    """
+    done = getattr(fetcher, "done", None)
+    if done is not None:
+        done(imgobject)
+
+
+def _usage(fetcher):
+    """
+        _usage:
+
+        the (bytes, calls) a fetcher spent, fetchers that don't use the
+        network don't keep track
+    """
+    usage = getattr(fetcher, "usage", None)
+    if usage is None:
+        return (0, 0)
+    return usage()
+
+
+def _score(candidate):
+    """
+        _score:
+
+        candidates with more pixels are better
+    """
+    return (getattr(candidate, "width", 0) or 0) * \
+        (getattr(candidate, "height", 0) or 0)
+
+
+logger = logging.getLogger("bg_daemon")
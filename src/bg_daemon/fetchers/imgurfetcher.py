@@ -4,15 +4,122 @@ import requests
 import os
 import json
 import sys
+import time
 import logging
 
 from imgurpython import ImgurClient
+from imgurpython.client import API_URL, MASHAPE_URL
+from imgurpython.helpers.error import ImgurClientError, \
+    ImgurClientRateLimitError
 from imgurpython.helpers import GalleryAlbum, GalleryImage
 from imgurpython.imgur.models.image import Image
+import bg_daemon.cache
+import bg_daemon.fetchers.ranking
+from bg_daemon import imageinfo
+from bg_daemon.fetchers.candidate import candidate
 from bg_daemon.util import HOME
+from bg_daemon.fetchers.planner import query_planner
+from bg_daemon.fetchers.cursor import recent_cursor
+from bg_daemon.fetchers.albumcache import album_cache
 
 CLIENT_ID = "b0d705fbff41bc1"
 
+# imgur's q_size_px buckets and the smallest side they start at
+SEARCH_SIZES = (("huge", 10000), ("lrg", 5000), ("big", 2000), ("med", 500),
+                ("small", 0))
+
+
+class timed_client(ImgurClient):
+    """
+        timed_client
+
+        An anonymous ImgurClient whose requests time out. The stock client
+        calls requests without a timeout, so a stalled socket hangs it.
+        make_request does what the stock one does (mashape, the token
+        refresh, the credits), we can't patch a timeout into its requests
+        calls since other threads use them too.
+
+        Searches and album listings return compact candidate records
+        instead of imgurpython's models.
+
+        <Properties>
+            timeout: the timeout of the next request, in seconds
+    """
+    timeout = None
+
+    def __init__(self, client_id, timeout):
+
+        # the stock constructor spends an API call on get_credits
+        self.client_id = client_id
+        self.client_secret = None
+        self.auth = None
+        self.mashape_key = None
+        self.credits = None
+        self.timeout = timeout
+
+    def make_request(self, method, route, data=None, force_anon=False):
+
+        method = method.lower()
+        headers = self.prepare_headers(force_anon)
+        url = MASHAPE_URL if self.mashape_key is not None else API_URL
+        url += route if 'oauth2' in route else "3/{}".format(route)
+
+        response = self._send(method, url, headers, data)
+
+        # the access token expired, try again with a new one
+        if response.status_code == 403 and self.auth is not None:
+            self.auth.refresh()
+            response = self._send(method, url, self.prepare_headers(), data)
+
+        self.credits = dict((name, response.headers.get(
+                             "X-RateLimit-{}".format(name)))
+                            for name in ("UserLimit", "UserRemaining",
+                                         "UserReset", "ClientLimit",
+                                         "ClientRemaining"))
+
+        if response.status_code == 429:
+            raise ImgurClientRateLimitError()
+
+        try:
+            response_data = response.json()
+        except ValueError:
+            raise ImgurClientError('JSON decoding of response failed.')
+
+        if isinstance(response_data.get('data'), dict) and \
+                'error' in response_data['data']:
+            raise ImgurClientError(response_data['data']['error'],
+                                   response.status_code)
+
+        return response_data.get('data', response_data)
+
+    def _send(self, method, url, headers, data):
+
+        if method in ('delete', 'get'):
+            return requests.request(method, url, headers=headers,
+                                    params=data, data=data,
+                                    timeout=self.timeout)
+
+        return requests.request(method, url, headers=headers, data=data,
+                                timeout=self.timeout)
+
+    def gallery_search(self, q, advanced=None, sort='time', window='all',
+                       page=0):
+
+        if advanced:
+            data = dict((field, advanced[field]) for field in advanced
+                        if field in self.allowed_advanced_search_fields)
+        else:
+            data = {'q': q}
+
+        items = self.make_request('GET', 'gallery/search/{}/{}/{}'.format(
+                                  sort, window, page), data)
+        return [candidate.from_api(item) for item in items]
+
+    def get_album_images(self, album_id):
+
+        items = self.make_request('GET', 'album/{}/images'.format(album_id))
+        return [candidate.from_api(item) for item in items]
+
 
 class imgurfetcher:
     """
@@ -53,10 +160,85 @@ class imgurfetcher:
 
             nsfw: Defines if images marked as nsfw should be fetched or not.
 
+            adaptive: In keywords mode, pick keyword combinations based on
+                      how well they did in the past instead of at random.
+
+            negative_ttl: When adaptive, how long (in seconds) are queries
+                          that returned nothing skipped
+
+            shared_cache: A download cache directory shared by all the users
+                          in this host, images are downloaded only once per
+                          host.
+
+            shared_cache_size: The size of the shared cache, in bytes
+
+            probe: Before downloading a candidate, fetch its first
+                   "probe_bytes" bytes with a range request and check the
+                   real dimensions in its header. Candidates whose metadata
+                   is wrong are rejected, and candidates without metadata
+                   are checked this way.
+
+            probe_bytes: How much of the image is fetched by the probe
+
+            probe_timeout: How long (in seconds) do we wait for the probe
+
+            incremental: In recent mode, remember the newest post we went
+                         through and only pick posts after it, walking
+                         forward through them across updates (see
+                         bg_daemon.fetchers.cursor)
+
+            album_cache_size: How many album listings are cached, so albums
+                              that come back are expanded without an API
+                              call. 0 disables the cache.
+
+            album_cache_ttl: How long (in seconds) is an album listing
+                             cached
+
+            search_size: Ask imgur for images in one of its size buckets
+                         (small, med, big, lrg or huge). Buckets are ranges,
+                         so larger images are left out too. "auto" only
+                         asks for "huge" when min_width or min_height is
+                         past its start, and for no bucket otherwise.
+
+            search_type: Ask imgur for one type of image (jpg, png, gif...)
+
+            ranking: Try candidates by score (views, aspect ratio, resolution,
+                     file size and recency, see bg_daemon.fetchers.ranking)
+                     instead of at random or by date. One of the best
+                     "ranking_top_k" candidates is picked at random.
+
+            ranking_weights: The weight of each feature in the score
+
+            ranking_top_k: How many of the best candidates are picked from
+
+            screen_width, screen_height: The size of the screen, for the
+                     ranking. min_width and min_height are used if unset.
+
+            thrifty: Set by the daemon when the bandwidth budget is nearly
+                     used up (see bg_daemon.budget): images are downloaded
+                     in the "thrifty_variant" size and not probed
+
+            thrifty_variant: The imgur thumbnail suffix used when thrifty,
+                             "h" is 1024x1024 and "l" is 640x640
+
+            timeout: How long (in seconds) do we wait for imgur when there's
+                     no update deadline
+
+            update_deadline: The deadline of the current update (see
+                             bg_daemon.deadline), set by the daemon. Every
+                             request uses the time left for its phase as its
+                             timeout.
+
+            stats: What happened during the last query and fetch: the query
+                   string, pages fetched, candidates examined, rejections by
+                   reason and bytes downloaded. Used for the run journal.
+
         <Functions>
 
             query(): Finds a candidate gallery to download
             fetch(): From the candidate, get the image data.
+            done(): The candidate was installed (or dropped for good)
+            usage(): The bytes and API calls spent so far
     """
     keywords = None
     subreddits = None
@@ -67,6 +249,34 @@ class imgurfetcher:
     blacklist_words = None
     mode = None
     nsfw = False
+    adaptive = False
+    negative_ttl = 86400
+    planner = None
+    shared_cache = None
+    shared_cache_size = 512 * 1024 * 1024
+    cache = None
+    probe = False
+    probe_bytes = 16 * 1024
+    probe_timeout = 10
+    incremental = False
+    cursor = None
+    album_cache_size = 0
+    album_cache_ttl = 86400
+    albums = None
+    search_size = None
+    search_type = None
+    ranking = False
+    ranking_weights = None
+    ranking_top_k = 10
+    screen_width = None
+    screen_height = None
+    thrifty = False
+    thrifty_variant = "h"
+    timeout = 60
+    update_deadline = None
+    stats = None
+    _used = (0, 0)
+    _pending = None
 
     """
         __init__
@@ -106,6 +316,25 @@ class imgurfetcher:
         # much
         self.client_id = CLIENT_ID
 
+        self._reset_stats()
+
+        if self.adaptive:
+            self.planner = query_planner(os.path.join(HOME, "planner.json"),
+                                         self.negative_ttl)
+        self._last_plan = None
+
+        if self.incremental:
+            self.cursor = recent_cursor(os.path.join(HOME, "cursor.json"))
+
+        if self.album_cache_size:
+            self.albums = album_cache(os.path.join(HOME, "albums.json"),
+                                      self.album_cache_ttl,
+                                      self.album_cache_size)
+
+        if self.shared_cache:
+            self.cache = bg_daemon.cache.shared_cache(self.shared_cache,
+                                                      self.shared_cache_size)
+
     """
         query
 
@@ -123,18 +352,78 @@ class imgurfetcher:
         query = self._build_query()
         logger.info("Querying imgur with {}".format(query))
 
+        self._reset_stats()
+        self.stats['query'] = query
+        self._pending = None
+
         # Download gallery data
-        client = ImgurClient(self.client_id, None)
-        data = client.gallery_search(query, sort='time', window='year',
-                                     page=0)
+        start = time.time()
+        client = timed_client(self.client_id, self._timeout("search"))
+        data = client.gallery_search(query, self._advanced_search(query),
+                                     sort='time', window='year', page=0)
+        latency = time.time() - start
+        self.stats['pages'] += 1
 
         # if we didn't get anything back... tough luck
         if data is None or len(data) < 1:
+            self._record_plan(0, 0, latency)
             return None
 
         logger.info("Found successful query {}".format(query))
 
-        return self._select_image(data)
+        results = len(data)
+
+        incremental = self.cursor is not None and self.mode == "recent"
+        if incremental:
+            data = self.cursor.unseen(query, data)
+            unseen = list(data)
+            logger.info("{} of {} results are new".format(len(unseen),
+                                                          results))
+
+            # retrying won't find anything either, see caught_up
+            if not unseen:
+                self.stats['caught_up'] = True
+
+        selected_image = self._select_image(data)
+
+        # what _select_image rejected is behind us now, it pops the head of
+        # data unless it ranked a copy of it. The selected post (the last one
+        # popped) stays ahead of the cursor until done(), so a failed
+        # download is picked again
+        if incremental:
+            if not self.ranking:
+                unseen = unseen[:len(unseen) - len(data)]
+            if selected_image is None:
+                self.cursor.advance(query, unseen)
+            else:
+                if not self.ranking:
+                    self.cursor.advance(query, unseen[:-1])
+                    unseen = unseen[-1:]
+                self._pending = (selected_image, query, unseen)
+
+        # the observed pass rate tells how many results were usable
+        examined = self.stats['examined']
+        passed = examined - sum(self.stats['rejected'].values())
+        usable = results * float(passed) / examined if examined else 0
+        self._record_plan(results, usable, latency)
+
+        return selected_image
+
+    """
+        done
+
+        Tells the fetcher that the candidate query returned was installed,
+        or dropped for good (e.g., a duplicate). In incremental mode, the
+        cursor only moves past it now.
+    """
+    def done(self, imgobject):
+
+        if self._pending is None or self._pending[0] is not imgobject:
+            return
+
+        selected_image, query, unseen = self._pending
+        self._pending = None
+        self.cursor.advance(query, unseen)
 
     """
         fetch function
@@ -153,7 +442,7 @@ class imgurfetcher:
         if imgobject is None:
             raise ValueError("ImgObject wasn't initialized properly!")
 
-        if not isinstance(imgobject, GalleryImage) and not isinstance(imgobject, Image):
+        if not _is_image(imgobject):
             raise ValueError("ImgObject wasn't initialized properly!")
 
         if filename is None:
@@ -163,35 +452,123 @@ class imgurfetcher:
             raise ValueError("Filename should be a string!")
 
         # title will be changed to ascii before saving
-        title = imgobject.title.encode('ascii', 'replace')
+        title = _title(imgobject).encode('ascii', 'replace')
         logger.info("Saving image {} to {}".format(title, filename))
 
-        req = requests.get(imgobject.link)
+        link = imgobject.link
+        if self.thrifty:
+            link = _variant(link, self.thrifty_variant)
+
+        filename = _add_extension(filename, link)
+        resuming = _resume_state(filename, link) is not None
+
+        if self.cache is not None and not resuming:
+            # a leftover of another interrupted download, the cache won't
+            # write over it
+            if os.path.isfile(filename):
+                os.unlink(filename)
+            self.cache.fetch(link, filename, self._download)
+        else:
+            self._download(link, filename)
+
+        return True
+
+    """
+        _download
+
+        Downloads a link into filename. If the download is interrupted,
+        filename is left in place along with the validators of the response
+        (see _resume_state), and the next download of the same link into the
+        same file continues where this one stopped.
+    """
+    def _download(self, link, filename):
+
+        # if we aren't provided an extension, we will do it for you.
+        filename = _add_extension(filename, link)
+        resume = "{}.resume".format(filename)
+
+        headers = {}
+        offset = 0
+        state = _resume_state(filename, link)
+        if state is not None:
+            offset = os.path.getsize(filename)
+            headers["Range"] = "bytes={}-".format(offset)
+            headers["If-Range"] = state["validator"]
+
+        req = requests.get(link, headers=headers, stream=True,
+                           timeout=self._timeout("download"))
 
         if not isinstance(req, requests.Response):
             raise ValueError("Didn't get a proper response from the server")
 
+        # we had everything already, or the file changed under us
+        if offset and req.status_code == 416:
+            req.close()
+            os.unlink(resume)
+            return self._download(link, filename)
+
         # check that we get a 200 response.
         req.raise_for_status();
 
-        # if we aren't provided an extension, we will do it for you.
-        if len(os.path.splitext(filename)[1]) == 0:
-            root, ext = os.path.splitext(imgobject.link)
-            filename = "{}{}".format(filename, ext)
+        if offset and req.status_code == 206:
+            logger.info("Resuming {} at byte {}".format(link, offset))
+            mode = 'ab'
+        else:
+            mode = 'wb'
+            _save_resume_state(resume, link, req.headers)
 
-        with open(filename, 'wb') as fp:
-            for chunk in req.iter_content():
+        # the timeout is per read, a trickle could still go on forever
+        with open(filename, mode) as fp:
+            for chunk in req.iter_content(chunk_size=64 * 1024):
                 fp.write(chunk)
+                self.stats['bytes'] += len(chunk)
+                if self.update_deadline is not None:
+                    self.update_deadline.timeout("download")
 
         req.close()
-        return True
+
+        if os.path.exists(resume):
+            os.unlink(resume)
+
+    """
+        resumable
+
+        Whether an interrupted fetch of imgobject into filename left what's
+        needed to resume it (see _resume_state)
+
+        <Returns>
+            True if the next fetch of imgobject into filename can resume
+    """
+    def resumable(self, filename, imgobject):
+
+        link = getattr(imgobject, "link", None)
+        if link is None:
+            return False
+
+        if self.thrifty:
+            link = _variant(link, self.thrifty_variant)
+
+        filename = _add_extension(filename, link)
+        return _resume_state(filename, link) is not None
+
+    """
+        discard
+
+        Removes the resume state of an interrupted download into filename,
+        the download itself is left to the caller
+    """
+    def discard(self, filename):
+
+        resume = "{}.resume".format(filename)
+        if os.path.exists(resume):
+            os.unlink(resume)
 
     def save_info(self, imgobject, filename):
 
         if imgobject is None:
             raise ValueError("ImgObject wasn't initialized properly!")
 
-        if not isinstance(imgobject, GalleryImage) and not isinstance(imgobject, Image):
+        if not _is_image(imgobject):
             raise ValueError("ImgObject wasn't initialized properly!")
 
         if filename is None:
@@ -202,7 +579,7 @@ class imgurfetcher:
 
         info = {}
 
-        info['title'] = imgobject.title.encode('ascii', 'replace')
+        info['title'] = _title(imgobject).encode('ascii', 'replace')
         info['link'] = imgobject.link
         info['author'] = imgobject.account_url if imgobject.account_url else "N/A"
         info['section'] = imgobject.section
@@ -233,7 +610,13 @@ class imgurfetcher:
             assert(isinstance(self.subreddits, list))
             subreddit = random.choice(self.subreddits)
 
-        if self.mode == 'keywords':
+        if self.mode == 'keywords' and self.planner is not None:
+            # let the planner pick the combination most likely to pay off
+            keywords, subreddit = self.planner.plan(self.keywords,
+                                                    self.subreddits)
+            self._last_plan = (keywords, subreddit)
+
+        elif self.mode == 'keywords':
             # get a random number of keywords and build a query
             number_of_keywords = random.randint(1, 2)
             random.shuffle(self.keywords)
@@ -252,6 +635,43 @@ class imgurfetcher:
 
         return query
 
+    """
+        _advanced_search
+
+        Moves our filters to imgur's advanced search, so the results we get
+        back are mostly usable: the query words must all match (q_all), the
+        blacklisted words must not (q_not), and the type and size of the
+        images can be constrained.
+
+        <Returns>
+            The advanced search parameters, or None if there's nothing to
+            search for (e.g., recent mode without subreddits)
+    """
+    def _advanced_search(self, query):
+
+        if not query.strip():
+            return None
+
+        advanced = {'q_all': query.strip()}
+
+        if self.blacklist_words:
+            advanced['q_not'] = " ".join(self.blacklist_words)
+
+        if self.search_type:
+            advanced['q_type'] = self.search_type
+
+        # buckets are ranges, any of them but the largest (it's open ended)
+        # leaves out images larger than the minimums
+        if self.search_size == "auto":
+            side = max(self.min_width or 0, self.min_height or 0)
+            name, start = SEARCH_SIZES[0]
+            if side >= start:
+                advanced['q_size_px'] = name
+        elif self.search_size:
+            advanced['q_size_px'] = self.search_size
+
+        return advanced
+
     """
         _select_image
 
@@ -264,11 +684,17 @@ class imgurfetcher:
 
         attempts = 0
 
+        if self.ranking:
+            screen = (self.screen_width or self.min_width or 1920,
+                      self.screen_height or self.min_height or 1080)
+            galleries = bg_daemon.fetchers.ranking.order(
+                galleries, screen, self.ranking_weights, self.ranking_top_k)
+
         while not elected:
 
             logger.debug("Selecting image...")
 
-            if self.mode == "keywords":
+            if self.mode == "keywords" and not self.ranking:
                 selected_image = random.choice(galleries)
             else:
                 try:
@@ -278,28 +704,35 @@ class imgurfetcher:
 
             # if the "image" is actually an album, try to get a valid candidate
             # image from it.
-            if isinstance(selected_image, GalleryAlbum):
+            if _is_album(selected_image):
                 selected_image = self._get_image_from_album(selected_image)
                 if selected_image is None:
                     continue
 
-            if selected_image.title is None:
-                selected_image.title = "undefined"
-
-            title = selected_image.title.encode("utf-8", errors='ignore')
+            # the candidate may be shared (e.g., with the album cache), it's
+            # never changed
+            title = _title(selected_image).encode("utf-8", errors='ignore')
 
-            logger.debug("Selecting Image {}".format(title))
+            logger.debug("Selecting Image %s", title)
             attempts += 1
             if attempts > 30:
                 return None
 
-            if selected_image.width < self.min_width:
-                logger.debug("Rejecting due to width...")
-                continue
+            self.stats['examined'] += 1
 
-            if selected_image.height < self.min_height:
-                logger.debug("Rejecting due to height...")
-                continue
+            # without metadata, the probe checks the size later on
+            unknown_size = selected_image.width is None or \
+                selected_image.height is None
+
+            if not (unknown_size and self.probe):
+
+                if selected_image.width < self.min_width:
+                    self._reject("width")
+                    continue
+
+                if selected_image.height < self.min_height:
+                    self._reject("height")
+                    continue
 
             if self.blacklist_words is not None:
 
@@ -311,25 +744,150 @@ class imgurfetcher:
 
                 if len(blacklist_words.intersection(title)):
 
-                    logger.debug("Rejecting due to blacklist_words...")
+                    self._reject("blacklist_words")
                     continue
 
                 if selected_image.description is not None:
                     description = set(selected_image.description.split())
                     if len(blacklist_words.intersection(description)):
-                        logger.debug("Rejecting due to blacklist_words...")
+                        self._reject("blacklist_words")
                         continue
 
                 if selected_image.nsfw and not self.nsfw:
-                    logger.debug("Rejecting due to nsfw tag")
+                    self._reject("nsfw")
                     continue
 
+            if self.probe and not self.thrifty and \
+                    self._probe(selected_image) is None:
+                continue
+
             elected = True
 
-        logger.debug("Selected image {}".format(selected_image.link))
+        logger.debug("Selected image %s", selected_image.link)
 
         return selected_image
 
+    """
+        _probe
+
+        Reads the dimensions of a candidate from the first bytes of the
+        image. The candidate itself is left alone.
+
+        <Returns>
+            The (width, height) of the image, or None if the candidate
+            should be rejected
+    """
+    def _probe(self, image):
+
+        headers = {"Range": "bytes=0-{}".format(self.probe_bytes - 1)}
+        try:
+            req = requests.get(image.link, headers=headers, stream=True,
+                               timeout=min(self.probe_timeout,
+                                           self._timeout("probe")))
+            req.raise_for_status()
+
+            # servers that ignore the range send everything, we stop early
+            data = ""
+            for chunk in req.iter_content(chunk_size=4096):
+                data += chunk
+                if len(data) >= self.probe_bytes:
+                    break
+            req.close()
+
+        except requests.RequestException as e:
+            logger.debug("Couldn't probe %s: %s", image.link, e)
+            self._reject("probe_failed")
+            return None
+
+        self.stats['bytes'] += len(data)
+        size = imageinfo.dimensions_from_bytes(data[:self.probe_bytes])
+
+        # e.g., a huge EXIF block before the frame, we can't tell
+        if size is None:
+            logger.debug("Couldn't read the size of %s", image.link)
+            if image.width is None or image.height is None:
+                self._reject("unprobed")
+                return None
+            return image.width, image.height
+
+        if image.width is not None and image.height is not None and \
+                (image.width, image.height) != size:
+            self._reject("probe_mismatch")
+            return None
+
+        width, height = size
+
+        if width < self.min_width:
+            self._reject("width")
+            return None
+
+        if height < self.min_height:
+            self._reject("height")
+            return None
+
+        return size
+
+    """
+        _timeout
+
+        The timeout for a request in the given phase of the update
+    """
+    def _timeout(self, phase):
+
+        if self.update_deadline is None:
+            return self.timeout
+
+        return self.update_deadline.timeout(phase)
+
+    """
+        _reject
+
+        Counts a rejected candidate for the stats
+    """
+    def _reject(self, reason):
+
+        rejected = self.stats['rejected']
+        rejected[reason] = rejected.get(reason, 0) + 1
+        logger.debug("Rejecting due to %s...", reason)
+
+    """
+        _record_plan
+
+        Lets the planner know how the last planned query did
+    """
+    def _record_plan(self, results, usable, latency):
+
+        if self.planner is None or self._last_plan is None:
+            return
+
+        keywords, subreddit = self._last_plan
+        self.planner.record(keywords, subreddit, results, usable, latency)
+        self._last_plan = None
+
+    """
+        usage
+
+        The bytes downloaded and the API calls (pages) made since the
+        fetcher was created. The stats only cover the last query.
+
+        <Returns>
+            A (bytes, calls) tuple
+    """
+    def usage(self):
+
+        stats = self.stats or {}
+        return (self._used[0] + stats.get('bytes', 0),
+                self._used[1] + stats.get('pages', 0))
+
+    def _reset_stats(self):
+
+        stats = self.stats or {}
+        self._used = (self._used[0] + stats.get('bytes', 0),
+                      self._used[1] + stats.get('pages', 0))
+
+        self.stats = {'query': None, 'pages': 0, 'examined': 0,
+                      'rejected': {}, 'bytes': 0}
+
     """
         _get_image_from_album
 
@@ -337,15 +895,24 @@ class imgurfetcher:
     """
     def _get_image_from_album(self, album):
 
-        if not isinstance(album, GalleryAlbum):
+        if not _is_album(album):
             raise ValueError("Album should be "
                              "a GalleryAlbum instance!")
 
-        # Download gallery data
-        client = ImgurClient(self.client_id, None)
         album_id = album.id
 
-        images = client.get_album_images(album_id)
+        images = None
+        if self.albums is not None:
+            images = self.albums.get(album_id)
+
+        # Download gallery data
+        if images is None:
+            client = timed_client(self.client_id, self._timeout("album"))
+            images = client.get_album_images(album_id)
+            self.stats['pages'] += 1
+
+            if images is not None and self.albums is not None:
+                self.albums.put(album_id, images)
 
         # Try to select an appropriate image from this album, return the
         # first one that fits our criteria.
@@ -353,4 +920,109 @@ class imgurfetcher:
             return self._select_image(images)
 
 
+def _is_album(item):
+    """
+        _is_album:
+
+        albums come as candidate records from our client, or as
+        GalleryAlbum objects from imgurpython
+    """
+    if isinstance(item, candidate):
+        return bool(item.is_album)
+
+    return isinstance(item, GalleryAlbum)
+
+
+def _is_image(item):
+
+    if isinstance(item, candidate):
+        return not item.is_album
+
+    return isinstance(item, GalleryImage) or isinstance(item, Image)
+
+
+def _title(item):
+    """
+        _title:
+
+        the title of an image, images without one are "undefined"
+    """
+    return item.title if item.title is not None else "undefined"
+
+
+def _variant(link, suffix):
+    """
+        _variant:
+
+        the link of a smaller version of an imgur image, imgur serves them
+        with a suffix after the image id (e.g., abcdefgh.jpg)
+    """
+    root, ext = os.path.splitext(link)
+    if "i.imgur.com/" not in root or ext.lower() not in (".jpg", ".jpeg",
+                                                          ".png"):
+        return link
+
+    return "{}{}{}".format(root, suffix, ext)
+
+
+def _add_extension(filename, link):
+    """
+        _add_extension:
+
+        if filename has no extension, use the one in the link
+    """
+    if len(os.path.splitext(filename)[1]) == 0:
+        root, ext = os.path.splitext(link)
+        filename = "{}{}".format(filename, ext)
+
+    return filename
+
+
+"""
+    _resume_state
+
+    The validators of an interrupted download of link into filename.
+
+    <Returns>
+        A dictionary with the link and the validator to send with If-Range,
+        or None if there's nothing to resume
+"""
+def _resume_state(filename, link):
+
+    resume = "{}.resume".format(filename)
+    if not os.path.exists(filename) or not os.path.exists(resume):
+        return None
+
+    try:
+        with open(resume) as fp:
+            state = json.load(fp)
+    except (IOError, ValueError):
+        return None
+
+    if state.get("link") != link or not state.get("validator"):
+        return None
+
+    return state
+
+
+def _save_resume_state(resume, link, headers):
+    """
+        _save_resume_state:
+
+        keeps the validator of a response, so the download can be resumed
+        only if the image didn't change. Weak etags can't be used for ranges.
+    """
+    validator = headers.get("ETag")
+    if not validator or validator.startswith("W/"):
+        validator = headers.get("Last-Modified")
+
+    if not validator:
+        if os.path.exists(resume):
+            os.unlink(resume)
+        return
+
+    with open(resume, "wt") as fp:
+        json.dump({"link": link, "validator": validator}, fp)
+
+
 logger = logging.getLogger("bg_daemon")
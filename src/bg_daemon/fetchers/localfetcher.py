@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+import os
+import re
+import json
+import time
+import random
+import shutil
+import logging
+
+from bg_daemon import imageinfo
+from bg_daemon.util import HOME
+
+try:
+    _scandir = os.scandir
+except AttributeError:
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp")
+
+
+class local_image:
+    """
+        local_image
+
+        An image from the local library, its path and dimensions.
+    """
+    def __init__(self, path, width, height):
+
+        self.path = path
+        self.link = path
+        self.title = os.path.basename(path)
+        self.width = width
+        self.height = height
+
+
+class localfetcher:
+    """
+        localfetcher class
+
+        Picks images from a local photo library (e.g., a NAS share) instead
+        of the network.
+
+        The library is described by a persistent index: every directory with
+        its modification time, its subdirectories and the dimensions of its
+        images, read from their headers. Refreshing the index only lists the
+        directories whose mtime changed, and it's done at most every
+        "local_refresh" seconds, so picking an image doesn't walk the tree.
+        The images that pass our filters are kept in the index too, so a
+        run only filters the library again when the index or the filters
+        changed.
+
+        <Properties>
+
+            local_directory: the root of the photo library
+
+            local_refresh: how often (in seconds) is the index refreshed
+
+            min_height: use the size of your screen here, so nothing is too
+                        ugly
+
+            min_width: same idea here
+
+            blacklist_words: a list containing words that might hint something
+                             you don't want to see, matched against the path
+
+            stats: What happened during the last query and fetch
+
+        <Functions>
+
+            query(): Picks a random image from the index
+            fetch(): Copies the image to the target filename
+    """
+    local_directory = None
+    local_refresh = 3600
+    min_height = 0
+    min_width = 0
+    blacklist_words = None
+    stats = None
+
+    """
+        __init__
+
+        Loads filename (the settings file) and populates it with the pertinent
+        information
+
+        <Arguments>
+
+            filename: The location of the settings file.
+
+            index: Where the index is kept, defaults to local_index.json in
+                   the bg_daemon home
+    """
+    def __init__(self, filename=None, index=None):
+
+        logger.debug("initializing local fetcher")
+        if not filename:
+            filename = os.path.join(HOME, "settings.json")
+
+        with open(filename, 'rU') as fp:
+            data = json.load(fp)
+
+        if 'fetcher' in data:
+
+            for key in data['fetcher']:
+                if key == 'query' or key == 'fetch' or key == 'save':
+                    raise ValueError("The settings file is corrupted!")
+
+                setattr(self, key, data['fetcher'][key])
+
+        if not self.local_directory:
+            raise ValueError("local_directory must be set to use local "
+                             "images!")
+
+        self.local_directory = os.path.abspath(
+            os.path.expanduser(self.local_directory))
+        self.index = index or os.path.join(HOME, "local_index.json")
+
+        self._index = {"root": self.local_directory, "refreshed": 0,
+                       "directories": {}}
+        self._reset_stats()
+        self._load()
+
+    """
+        query
+
+        Picks a random image that passes our filters.
+
+        <Returns>
+            A local_image, or None if there's no suitable image
+    """
+    def query(self):
+
+        self._reset_stats()
+        self.stats['query'] = self.local_directory
+
+        if time.time() - self._index["refreshed"] > self.local_refresh:
+            self.refresh()
+
+        candidates = self._get_candidates()
+        while candidates:
+            # swap the pick with the last one so removing it is O(1)
+            position = random.randrange(len(candidates))
+            path, width, height = candidates[position]
+            self.stats['examined'] += 1
+
+            if os.path.exists(path):
+                return local_image(path, width, height)
+
+            logger.debug("%s is gone", path)
+            self._reject("gone")
+            candidates[position] = candidates[-1]
+            candidates.pop()
+
+        return None
+
+    """
+        fetch function
+
+        Copies an image from the library.
+
+        <parameters>
+            imgobject: the local_image returned by query
+            filename:  the target filename. Where to save the file
+
+        <Returns>
+            True if everything is fine
+    """
+    def fetch(self, imgobject, filename):
+
+        if not isinstance(imgobject, local_image):
+            raise ValueError("ImgObject wasn't initialized properly!")
+
+        if not isinstance(filename, str):
+            raise ValueError("Filename should be a string!")
+
+        logger.info("Copying image {} to {}".format(imgobject.path, filename))
+        shutil.copyfile(imgobject.path, filename)
+        self.stats['bytes'] += os.path.getsize(filename)
+        return True
+
+    def save_info(self, imgobject, filename):
+
+        if not isinstance(imgobject, local_image):
+            raise ValueError("ImgObject wasn't initialized properly!")
+
+        info = {}
+        info['title'] = imgobject.title
+        info['link'] = imgobject.path
+        info['author'] = "N/A"
+        info['width'] = imgobject.width
+        info['height'] = imgobject.height
+
+        with open(filename, "wt") as fp:
+            json.dump(info, fp)
+
+        return True
+
+    """
+        refresh
+
+        Brings the index up to date. Directories whose mtime didn't change
+        are not listed again, we only stat them to find out.
+    """
+    def refresh(self):
+
+        old = self._index["directories"]
+        if self._index.get("root") != self.local_directory:
+            old = {}
+
+        directories = {}
+        pending = [self.local_directory]
+        scanned = 0
+
+        while pending:
+            directory = pending.pop()
+            try:
+                mtime = os.stat(directory).st_mtime
+            except OSError:
+                continue
+
+            entry = old.get(directory)
+            if entry is None or entry["mtime"] != mtime:
+                entry = self._scan(directory, mtime, entry)
+                scanned += 1
+
+            directories[directory] = entry
+            pending.extend(os.path.join(directory, name)
+                           for name in entry["subdirectories"])
+
+        logger.debug("refreshed the local index, listed {} of {} "
+                     "directories".format(scanned, len(directories)))
+
+        self._index = {"root": self.local_directory,
+                       "refreshed": time.time(),
+                       "directories": directories}
+        self._index["candidates"] = self._filter()
+        self._save()
+
+    """
+        _scan
+
+        Lists a directory, reading the headers of the images we didn't know
+        about. Images that were already indexed keep their dimensions.
+    """
+    def _scan(self, directory, mtime, old):
+
+        known = old["images"] if old is not None else {}
+        subdirectories = []
+        images = {}
+
+        for name, is_directory in _list_directory(directory):
+            if name.startswith("."):
+                continue
+
+            if is_directory:
+                subdirectories.append(name)
+                continue
+
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+
+            if name in known:
+                images[name] = known[name]
+                continue
+
+            size = imageinfo.file_dimensions(os.path.join(directory, name))
+            if size is not None:
+                images[name] = list(size)
+
+        return {"mtime": mtime, "subdirectories": subdirectories,
+                "images": images}
+
+    """
+        _get_candidates
+
+        The images that pass our filters, from the index unless the filters
+        changed since it was saved. The stats of a query only count the
+        images it examined, what the filters rejected across the library is
+        in the index (and logged when it's filtered).
+    """
+    def _get_candidates(self):
+
+        candidates = self._index.get("candidates")
+        if candidates is None or candidates["filters"] != self._filters():
+            candidates = self._filter()
+            self._index["candidates"] = candidates
+            self._save()
+
+        return candidates["images"]
+
+    """
+        _filters
+
+        The settings the candidates depend on, as they're stored in the
+        index
+    """
+    def _filters(self):
+
+        return [self.min_width, self.min_height,
+                sorted(word.lower() for word in self.blacklist_words or [])]
+
+    """
+        _filter
+
+        Goes through the whole index for the images that pass our filters.
+
+        <Returns>
+            A dictionary with the "filters" it used, the [path, width,
+            height] of the "images" and how many were "rejected" per reason
+    """
+    def _filter(self):
+
+        blacklist_words = set(word.lower()
+                              for word in self.blacklist_words or [])
+
+        candidates = []
+        rejected = {}
+        for directory, entry in self._index["directories"].iteritems():
+            for name, (width, height) in entry["images"].iteritems():
+                path = os.path.join(directory, name)
+
+                reason = None
+                if width < self.min_width:
+                    reason = "width"
+                elif height < self.min_height:
+                    reason = "height"
+                elif blacklist_words and blacklist_words.intersection(
+                        re.split(r"[\W_]+", path.lower())):
+                    reason = "blacklist_words"
+
+                if reason is not None:
+                    rejected[reason] = rejected.get(reason, 0) + 1
+                    continue
+
+                candidates.append([path, width, height])
+
+        logger.info("%d images of the library pass our filters, rejected: "
+                    "%s", len(candidates), rejected)
+        return {"filters": self._filters(), "images": candidates,
+                "rejected": rejected}
+
+    def _reject(self, reason):
+
+        rejected = self.stats['rejected']
+        rejected[reason] = rejected.get(reason, 0) + 1
+
+    def _reset_stats(self):
+
+        self.stats = {'query': None, 'pages': 0, 'examined': 0,
+                      'rejected': {}, 'bytes': 0}
+
+    def _load(self):
+
+        if not os.path.exists(self.index):
+            return
+
+        try:
+            with open(self.index) as fp:
+                self._index = json.load(fp)
+        except (IOError, ValueError) as e:
+            logger.error("Couldn't load the local index {}".format(e))
+
+    def _save(self):
+
+        partial = "{}.part".format(self.index)
+        try:
+            with open(partial, "wt") as fp:
+                json.dump(self._index, fp, separators=(",", ":"))
+            os.rename(partial, self.index)
+        except (IOError, OSError) as e:
+            logger.error("Couldn't save the local index {}".format(e))
+
+
+"""
+    _list_directory
+
+    Lists a directory as (name, is_directory) tuples. With scandir (python
+    3.5, or the scandir backport) the file type comes with the listing, so
+    no stat is needed per file. Symlinked directories are not followed, so
+    a link loop can't trap the refresh.
+"""
+def _list_directory(directory):
+
+    try:
+        if _scandir is not None:
+            for entry in _scandir(directory):
+                try:
+                    yield entry.name, entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+            return
+
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            yield name, os.path.isdir(path) and not os.path.islink(path)
+
+    except OSError as e:
+        logger.error("Couldn't list {}: {}".format(directory, e))
+
+
+logger = logging.getLogger("bg_daemon")
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+import random
+import requests
+import os
+import json
+import logging
+
+from bg_daemon.util import HOME
+
+
+class mirror_image:
+    """
+        mirror_image
+
+        An image record from a mirror's catalog, the catalog fields are
+        available as attributes (title, link, width, height...).
+    """
+    def __init__(self, entry):
+
+        for key in entry:
+            setattr(self, key, entry[key])
+
+
+class mirrorfetcher:
+    """
+        mirrorfetcher class
+
+        Picks images from the catalog of a bg_daemon running in mirror mode
+        (see bg_daemon.mirror) instead of querying imgur directly. The mirror
+        already filtered the images, but the size, blacklist and nsfw
+        filters are applied again with this machine's settings.
+
+        <Properties>
+
+            mirror_url: the address of the mirror, e.g., http://mirror:8080
+
+            min_height: use the size of your screen here, so nothing is too
+                        ugly
+
+            min_width: same idea here
+
+            blacklist_words: a list containing words that might hint something
+                             you don't want to see
+
+            nsfw: Defines if images marked as nsfw should be fetched or not.
+
+            timeout: how long (in seconds) do we wait for the mirror
+
+            update_deadline: The deadline of the current update (see
+                             bg_daemon.deadline), set by the daemon
+
+        <Functions>
+
+            query(): Picks a candidate from the mirror's catalog
+            fetch(): From the candidate, get the image data.
+            usage(): The bytes and API calls spent so far
+    """
+    mirror_url = None
+    min_height = 0
+    min_width = 0
+    blacklist_words = None
+    nsfw = False
+    timeout = 30
+    update_deadline = None
+    stats = None
+    _used = (0, 0)
+
+    """
+        __init__
+
+        Loads filename (the settings file) and populates it with the pertinent
+        information
+
+        <Arguments>
+
+            filename: The location of the settings file.
+    """
+    def __init__(self, filename=None):
+
+        logger.debug("initializing mirror fetcher")
+        if not filename:
+            filename = os.path.join(HOME, "settings.json")
+
+        with open(filename, 'rU') as fp:
+            data = json.load(fp)
+
+        if 'fetcher' in data:
+
+            for key in data['fetcher']:
+                if key == 'query' or key == 'fetch' or key == 'save':
+                    raise ValueError("The settings file is corrupted!")
+
+                setattr(self, key, data['fetcher'][key])
+
+        if not self.mirror_url:
+            raise ValueError("mirror_url must be set to use the mirror!")
+
+        self.mirror_url = self.mirror_url.rstrip("/")
+        self._reset_stats()
+
+    """
+        query
+
+        Downloads the catalog from the mirror and picks a random image that
+        passes our filters.
+
+        <Returns>
+            A mirror_image, or None if there's no suitable image
+    """
+    def query(self):
+
+        self._reset_stats()
+        self.stats['query'] = self.mirror_url
+
+        req = requests.get("{}/catalog".format(self.mirror_url),
+                           timeout=self._timeout("search"))
+        req.raise_for_status()
+        catalog = req.json()
+        self.stats['pages'] += 1
+
+        candidates = [entry for entry in catalog if self._accept(entry)]
+        if not candidates:
+            return None
+
+        return mirror_image(random.choice(candidates))
+
+    """
+        fetch function
+
+        Downloads an image from the mirror.
+
+        <parameters>
+            imgobject: the mirror_image returned by query
+            filename:  the target filename. Where to save the file
+
+        <Returns>
+            True if everything is fine
+    """
+    def fetch(self, imgobject, filename):
+
+        if not isinstance(imgobject, mirror_image):
+            raise ValueError("ImgObject wasn't initialized properly!")
+
+        if not isinstance(filename, str):
+            raise ValueError("Filename should be a string!")
+
+        logger.info("Saving image {} to {}".format(imgobject.file, filename))
+
+        req = requests.get("{}/images/{}".format(self.mirror_url,
+                                                 imgobject.file),
+                           stream=True, timeout=self._timeout("download"))
+        req.raise_for_status()
+
+        with open(filename, 'wb') as fp:
+            for chunk in req.iter_content(chunk_size=64 * 1024):
+                fp.write(chunk)
+                self.stats['bytes'] += len(chunk)
+
+        req.close()
+        return True
+
+    def save_info(self, imgobject, filename):
+
+        if not isinstance(imgobject, mirror_image):
+            raise ValueError("ImgObject wasn't initialized properly!")
+
+        info = {}
+        info['title'] = imgobject.title
+        info['link'] = imgobject.link
+        info['author'] = imgobject.account_url or "N/A"
+        info['section'] = imgobject.section
+        info['views'] = imgobject.views
+        info['description'] = imgobject.description
+        info['mirror'] = self.mirror_url
+
+        with open(filename, "wt") as fp:
+            json.dump(info, fp)
+
+        return True
+
+    """
+        _accept
+
+        Applies our filters to a catalog entry
+    """
+    def _accept(self, entry):
+
+        self.stats['examined'] += 1
+
+        if (entry.get('width') or 0) < self.min_width:
+            return self._reject("width")
+
+        if (entry.get('height') or 0) < self.min_height:
+            return self._reject("height")
+
+        if entry.get('nsfw') and not self.nsfw:
+            return self._reject("nsfw")
+
+        if self.blacklist_words:
+            words = set(self.blacklist_words)
+            text = "{} {}".format(entry.get('title') or "",
+                                  entry.get('description') or "")
+            if words.intersection(text.split()):
+                return self._reject("blacklist_words")
+
+        return True
+
+    def _timeout(self, phase):
+
+        if self.update_deadline is None:
+            return self.timeout
+
+        return min(self.timeout, self.update_deadline.timeout(phase))
+
+    def _reject(self, reason):
+
+        rejected = self.stats['rejected']
+        rejected[reason] = rejected.get(reason, 0) + 1
+        return False
+
+    """
+        usage
+
+        The bytes downloaded and the API calls (pages) made since the
+        fetcher was created. The stats only cover the last query.
+
+        <Returns>
+            A (bytes, calls) tuple
+    """
+    def usage(self):
+
+        stats = self.stats or {}
+        return (self._used[0] + stats.get('bytes', 0),
+                self._used[1] + stats.get('pages', 0))
+
+    def _reset_stats(self):
+
+        stats = self.stats or {}
+        self._used = (self._used[0] + stats.get('bytes', 0),
+                      self._used[1] + stats.get('pages', 0))
+
+        self.stats = {'query': None, 'pages': 0, 'examined': 0,
+                      'rejected': {}, 'bytes': 0}
+
+
+logger = logging.getLogger("bg_daemon")
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+"""
+    bg_daemon.fetchers.planner
+
+    An adaptive query planner for the keywords mode. Instead of shuffling the
+    keywords blindly, it remembers how every term and every combination of
+    terms performed (results returned, how many candidates made it through
+    the filters and how long the search took) and samples combinations
+    weighted by their expected yield.
+
+    Combinations that returned nothing are cached as empty for a while (the
+    negative cache) and are not tried again until their entry expires.
+"""
+import os
+import json
+import time
+import random
+import logging
+
+from itertools import combinations
+
+# a combination we know nothing about is assumed to be as good as this many
+# queries of its terms' average
+PRIOR_WEIGHT = 2.0
+
+# the expected yield of a combination we know nothing at all about, we are
+# optimistic so new combinations get explored
+OPTIMISTIC_YIELD = 1.0
+
+# no combination is ever given less than this weight
+MIN_WEIGHT = 0.01
+
+# searches slower than this (in seconds) start to get penalized
+LATENCY_SCALE = 10.0
+
+# the maximum number of keywords in a query
+MAX_KEYWORDS = 2
+
+# the position of each counter in the stats lists
+_QUERIES, _RESULTS, _PASSED, _LATENCY = range(4)
+
+
+class query_planner:
+    """
+        query_planner
+
+        Picks keyword combinations and learns from their results.
+
+        <Properties>
+            filename:       Where the statistics are persisted
+
+            negative_ttl:   How long (in seconds) a combination that returned
+                            nothing is skipped
+
+            terms:          The statistics for each term
+
+            combos:         The statistics for each combination
+
+            empty:          The negative cache, combination -> expiration
+
+        <Functions>
+            plan():     Picks the keywords and subreddit for the next query
+
+            record():   Records the outcome of a query
+    """
+    filename = None
+    negative_ttl = None
+    terms = None
+    combos = None
+    empty = None
+
+    def __init__(self, filename, negative_ttl=86400):
+
+        self.filename = filename
+        self.negative_ttl = negative_ttl
+        self.terms = {}
+        self.combos = {}
+        self.empty = {}
+
+        self._load()
+
+    """
+        plan
+
+        Samples a combination of keywords and a subreddit weighted by their
+        expected yield.
+
+        <Arguments>
+            keywords:   The list of keywords to pick from
+
+            subreddits: The list of subreddits to pick from, can be empty
+
+        <Returns>
+            A tuple with a list of keywords and a subreddit (or None). If
+            every combination is known to be empty, the one whose negative
+            cache entry expires first is returned.
+    """
+    def plan(self, keywords, subreddits):
+
+        now = time.time()
+        candidates = []
+        weights = []
+        fallback = None
+
+        for combo in self._combinations(keywords, subreddits):
+            key = _key(*combo)
+
+            expires = self.empty.get(key)
+            if expires is not None and expires > now:
+                if fallback is None or expires < fallback[0]:
+                    fallback = (expires, combo)
+                continue
+
+            candidates.append(combo)
+            weights.append(self._weight(combo))
+
+        if not candidates:
+            if fallback is None:
+                return [], None
+            logger.info("every query is known to be empty, trying anyway")
+            return fallback[1]
+
+        pick = random.random() * sum(weights)
+        for combo, weight in zip(candidates, weights):
+            pick -= weight
+            if pick <= 0:
+                break
+
+        return combo
+
+    """
+        record
+
+        Updates the statistics with the outcome of a query and persists them.
+
+        <Arguments>
+            keywords:   The keywords used in the query
+
+            subreddit:  The subreddit used in the query, or None
+
+            results:    How many items the search returned
+
+            passed:     How many of the results are expected to pass the
+                        filters (results times the observed pass rate)
+
+            latency:    How long the search took, in seconds
+    """
+    def record(self, keywords, subreddit, results, passed, latency):
+
+        key = _key(keywords, subreddit)
+        sample = (1, results, passed, latency)
+
+        _accumulate(self.combos.setdefault(key, [0, 0, 0, 0.0]), sample)
+        for term in _terms(keywords, subreddit):
+            _accumulate(self.terms.setdefault(term, [0, 0, 0, 0.0]), sample)
+
+        if results == 0:
+            self.empty[key] = time.time() + self.negative_ttl
+        else:
+            self.empty.pop(key, None)
+
+        self._save()
+
+    def _combinations(self, keywords, subreddits):
+
+        subreddits = subreddits or [None]
+        for count in range(1, min(MAX_KEYWORDS, len(keywords)) + 1):
+            for chosen in combinations(sorted(set(keywords)), count):
+                for subreddit in subreddits:
+                    yield list(chosen), subreddit
+
+    """
+        _weight
+
+        The expected number of usable candidates per query for a combination,
+        its own history is blended with the average of its terms.
+    """
+    def _weight(self, combo):
+
+        term_yields = [_yield(self.terms[term])
+                       for term in _terms(*combo) if term in self.terms]
+        if term_yields:
+            prior = sum(term_yields) / len(term_yields)
+        else:
+            prior = OPTIMISTIC_YIELD
+
+        stats = self.combos.get(_key(*combo))
+        if stats is None:
+            return max(prior, MIN_WEIGHT)
+
+        expected = ((stats[_PASSED] + PRIOR_WEIGHT * prior) /
+                    (stats[_QUERIES] + PRIOR_WEIGHT))
+        latency = stats[_LATENCY] / stats[_QUERIES]
+
+        return max(expected / (1 + latency / LATENCY_SCALE), MIN_WEIGHT)
+
+    def _load(self):
+
+        if not os.path.exists(self.filename):
+            return
+
+        try:
+            with open(self.filename) as fp:
+                data = json.load(fp)
+        except (IOError, ValueError) as e:
+            logger.error("Couldn't load the planner stats {}".format(e))
+            return
+
+        self.terms = data.get("terms", {})
+        self.combos = data.get("combos", {})
+
+        # drop the expired entries of the negative cache while we're at it
+        now = time.time()
+        self.empty = dict((key, expires) for key, expires
+                          in data.get("empty", {}).items() if expires > now)
+
+    def _save(self):
+
+        data = {"terms": self.terms, "combos": self.combos,
+                "empty": self.empty}
+        partial = "{}.part".format(self.filename)
+
+        try:
+            with open(partial, "wt") as fp:
+                json.dump(data, fp, separators=(",", ":"))
+            os.rename(partial, self.filename)
+        except (IOError, OSError) as e:
+            logger.error("Couldn't save the planner stats {}".format(e))
+
+
+def _key(keywords, subreddit):
+
+    return "{}|{}".format(" ".join(sorted(keywords)), subreddit or "")
+
+
+def _terms(keywords, subreddit):
+
+    terms = list(keywords)
+    if subreddit:
+        terms.append("r/{}".format(subreddit))
+    return terms
+
+
+def _yield(stats):
+
+    return float(stats[_PASSED]) / stats[_QUERIES]
+
+
+def _accumulate(stats, sample):
+
+    for i, value in enumerate(sample):
+        stats[i] += value
+
+
+logger = logging.getLogger("bg_daemon")
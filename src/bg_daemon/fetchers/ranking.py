@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""
+    bg_daemon.fetchers.ranking
+
+    Ranks candidates instead of picking them at random (keywords mode) or by
+    date (recent mode). Every candidate gets a score from a few features,
+    each roughly between -1 and 1:
+
+        views:      popularity, log-scaled against the most viewed candidate
+        aspect:     how close its aspect ratio is to the screen's
+        headroom:   how much bigger than the screen it is, negative if it's
+                    smaller (it would be upscaled)
+        size:       the file size, bigger files score lower
+        recency:    how recent it is compared to the other candidates
+
+    The score is the weighted sum of the features. The attributes of all the
+    candidates are pulled into columns and scored in a single pass with
+    NumPy, which keeps ranking large candidate pools cheap. Without NumPy,
+    the same scores are computed in plain python.
+"""
+import math
+import random
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+FEATURES = ("views", "aspect", "headroom", "size", "recency")
+
+DEFAULT_WEIGHTS = {"views": 1.0, "aspect": 1.0, "headroom": 1.0,
+                   "size": 0.5, "recency": 1.0}
+
+
+"""
+    order
+
+    Orders candidates for selection: the top_k best ones are shuffled and
+    come first, followed by the rest from best to worst.
+
+    <Arguments>
+        candidates: The candidates (anything with width, height, views, size
+                    and datetime attributes, missing ones count as 0)
+
+        screen:     The (width, height) of the screen
+
+        weights:    The weight of each feature, missing ones use
+                    DEFAULT_WEIGHTS
+
+        top_k:      How many of the best candidates are sampled from
+
+    <Returns>
+        A new list with the candidates in the order they should be tried
+"""
+def order(candidates, screen, weights=None, top_k=10):
+
+    if not candidates:
+        return []
+
+    ranked = [candidates[i] for i in ranking(candidates, screen, weights)]
+
+    best = ranked[:top_k]
+    random.shuffle(best)
+    return best + ranked[top_k:]
+
+
+"""
+    ranking
+
+    The indices of the candidates from the best score to the worst
+"""
+def ranking(candidates, screen, weights=None):
+
+    values = scores(candidates, screen, weights)
+
+    if numpy is not None:
+        # a stable sort keeps the original order among equal scores
+        return list(numpy.argsort(-values, kind="mergesort"))
+
+    return sorted(range(len(values)), key=lambda i: -values[i])
+
+
+"""
+    scores
+
+    The score of every candidate, as a NumPy array if NumPy is available
+    and as a list otherwise
+"""
+def scores(candidates, screen, weights=None):
+
+    table = dict(DEFAULT_WEIGHTS)
+    table.update(weights or {})
+    weights = [float(table[name]) for name in FEATURES]
+    columns = _columns(candidates)
+
+    if numpy is not None:
+        return _numpy_scores(columns, screen, weights)
+
+    return _python_scores(columns, screen, weights)
+
+
+def _columns(candidates):
+
+    columns = dict((name, []) for name in ("views", "width", "height",
+                                           "size", "datetime"))
+    for candidate in candidates:
+        for name in columns:
+            columns[name].append(float(getattr(candidate, name, 0) or 0))
+
+    return columns
+
+
+def _numpy_scores(columns, screen, weights):
+
+    views = numpy.array(columns["views"])
+    width = numpy.array(columns["width"])
+    height = numpy.array(columns["height"])
+    size = numpy.array(columns["size"])
+    date = numpy.array(columns["datetime"])
+
+    screen_width, screen_height = [float(value or 1) for value in screen]
+    known = (width > 0) & (height > 0)
+
+    # unknown sizes get neutral features, the ratios are masked out
+    width = numpy.where(known, width, screen_width)
+    height = numpy.where(known, height, screen_height)
+
+    top = numpy.log1p(views.max())
+    feature_views = numpy.log1p(views) / top if top > 0 else views * 0
+
+    mismatch = numpy.abs(numpy.log(width / height) -
+                         math.log(screen_width / screen_height))
+    feature_aspect = numpy.where(known, 1 - numpy.minimum(mismatch, 1), 0)
+
+    ratio = numpy.minimum(width / screen_width, height / screen_height)
+    feature_headroom = numpy.where(known,
+                                   numpy.clip(numpy.log2(ratio), -1, 1), 0)
+
+    biggest = size.max()
+    feature_size = -size / biggest if biggest > 0 else size * 0
+
+    span = date.max() - date.min()
+    feature_recency = (date - date.min()) / span if span > 0 else date * 0
+
+    features = numpy.vstack((feature_views, feature_aspect, feature_headroom,
+                             feature_size, feature_recency))
+    return numpy.dot(numpy.array(weights), features)
+
+
+def _python_scores(columns, screen, weights):
+
+    screen_width, screen_height = [float(value or 1) for value in screen]
+    screen_aspect = math.log(screen_width / screen_height)
+
+    top = math.log1p(max(columns["views"]))
+    biggest = max(columns["size"])
+    oldest = min(columns["datetime"])
+    span = max(columns["datetime"]) - oldest
+
+    values = []
+    rows = zip(columns["views"], columns["width"], columns["height"],
+               columns["size"], columns["datetime"])
+
+    for views, width, height, size, date in rows:
+
+        feature_aspect = feature_headroom = 0.0
+        if width > 0 and height > 0:
+            mismatch = abs(math.log(width / height) - screen_aspect)
+            feature_aspect = 1 - min(mismatch, 1)
+
+            ratio = min(width / screen_width, height / screen_height)
+            feature_headroom = max(-1.0, min(1.0, math.log(ratio, 2)))
+
+        features = (math.log1p(views) / top if top > 0 else 0.0,
+                    feature_aspect,
+                    feature_headroom,
+                    -size / biggest if biggest > 0 else 0.0,
+                    (date - oldest) / span if span > 0 else 0.0)
+
+        values.append(sum(w * f for w, f in zip(weights, features)))
+
+    return values
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+"""
+    bg_daemon.hook
+
+    Runs the update_hook (feh, osascript or whatever sets the wallpaper) under
+    supervision. The hook gets its own environment instead of us patching
+    os.environ, runs in its own process group and is killed, along with
+    anything it spawned, if it doesn't finish in time.
+
+    In daemon mode, the hook_runner coalesces back-to-back wallpaper changes
+    so the hook runs once for the last image instead of once per change.
+"""
+import os
+import time
+import shlex
+import signal
+import subprocess
+import threading
+import logging
+
+# how often we check on a running hook
+_POLL_INTERVAL = 0.05
+
+# how long we wait after SIGTERM before sending SIGKILL
+_KILL_GRACE = 1
+
+
+def run_hook(command, env=None, timeout=None):
+    """
+        run_hook:
+
+        runs a command in a new process group and waits for it.
+
+        arguments:
+            command: the command line to run, it's split with shlex
+
+            env: a dictionary of variables that are added to (a copy of) the
+                 current environment for this call only
+
+            timeout: seconds to wait before killing the process group, None
+                     waits forever
+
+        output:
+            the return code of the command, or None if it timed out
+
+        side-effects:
+            the whole process group is killed on timeout
+    """
+    call_env = dict(os.environ)
+    if env:
+        call_env.update(env)
+
+    process = subprocess.Popen(shlex.split(command), env=call_env,
+                               preexec_fn=os.setsid, close_fds=True)
+
+    if timeout is None:
+        return process.wait()
+
+    deadline = time.time() + timeout
+    while process.poll() is None:
+        if time.time() > deadline:
+            logger.error("update hook timed out after {}s, "
+                         "killing it".format(timeout))
+            _kill_group(process)
+            return None
+
+        time.sleep(_POLL_INTERVAL)
+
+    return process.returncode
+
+
+def _kill_group(process):
+    """
+        _kill_group:
+
+        terminates the process group of a process, escalating to SIGKILL if
+        it doesn't go away.
+    """
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(process.pid, sig)
+        except OSError:
+            break
+
+        deadline = time.time() + _KILL_GRACE
+        while process.poll() is None and time.time() < deadline:
+            time.sleep(_POLL_INTERVAL)
+
+        if process.poll() is not None:
+            break
+
+    # reap it so we don't leave a zombie behind
+    process.poll()
+
+
+class hook_runner:
+    """
+        hook_runner
+
+        Runs the update hook either right away or from a background thread
+        that batches requests.
+
+        <Properties>
+            command:    The hook command line
+
+            env:        Environment variables for the hook
+
+            timeout:    How long can the hook run before being killed
+
+            delay:      How long do we wait for more changes before running
+                        a scheduled hook
+
+        <Functions>
+            run():      Run the hook and wait for it
+
+            schedule(): Ask for a hook run, requests arriving within "delay"
+                        seconds of each other are coalesced into one run.
+
+            stop():     Stop the background thread, running anything pending
+    """
+    command = None
+    env = None
+    timeout = None
+    delay = None
+
+    def __init__(self, command, env=None, timeout=None, delay=0):
+
+        self.command = command
+        self.env = env
+        self.timeout = timeout
+        self.delay = delay
+
+        self._condition = threading.Condition()
+        self._pending = False
+        self._last_request = 0
+        self._stopped = False
+        self._thread = None
+
+    """
+        run
+
+        Runs the hook synchronously.
+
+        <Arguments>
+            timeout: a shorter timeout for this run (e.g., what's left of the
+                     update deadline)
+
+        <Returns>
+            The return code of the hook, None if it timed out or failed to
+            start
+    """
+    def run(self, timeout=None):
+
+        if not self.command:
+            return None
+
+        if timeout is None or self.timeout is not None and \
+                self.timeout < timeout:
+            timeout = self.timeout
+
+        logger.debug("running update hook {}".format(self.command))
+        try:
+            result = run_hook(self.command, self.env, timeout)
+        except OSError as e:
+            logger.error("Couldn't run update hook! {}".format(e))
+            return None
+
+        if result:
+            logger.error("update hook exited with {}".format(result))
+
+        return result
+
+    """
+        schedule
+
+        Requests a hook run from the background thread. The thread waits
+        until no new request came in for "delay" seconds.
+    """
+    def schedule(self):
+
+        with self._condition:
+            self._pending = True
+            self._last_request = time.time()
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker,
+                                                name="update_hook")
+                self._thread.daemon = True
+                self._thread.start()
+
+            self._condition.notify()
+
+    """
+        stop
+
+        Stops the background thread after it runs whatever is pending.
+    """
+    def stop(self):
+
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+            thread = self._thread
+
+        if thread is not None:
+            thread.join()
+
+    def _worker(self):
+
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+
+                if not self._pending:
+                    return
+
+                # wait until the requests settle down
+                wait = self._last_request + self.delay - time.time()
+                if wait > 0 and not self._stopped:
+                    self._condition.wait(wait)
+                    continue
+
+                self._pending = False
+
+            self.run()
+
+
+logger = logging.getLogger("bg_daemon")
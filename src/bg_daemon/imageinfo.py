@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""
+    bg_daemon.imageinfo
+
+    Reads the dimensions of an image from its header, without decoding (or
+    even reading) the rest of the file. JPEG, PNG, GIF, WebP and BMP are
+    supported, which covers what imgur serves and what people keep in their
+    photo libraries.
+
+    The parser works on file objects, so the same code serves local files
+    and the first few kilobytes of a download (see dimensions_from_bytes).
+"""
+import io
+import struct
+
+# JPEG start of frame markers, they hold the dimensions
+_SOF_MARKERS = frozenset([0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                          0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF])
+
+# JPEG markers without a length field
+_STANDALONE_MARKERS = frozenset([0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5,
+                                 0xD6, 0xD7, 0xD8])
+
+
+"""
+    dimensions
+
+    Reads the dimensions of the image in a file object, the file object must
+    be positioned at the start of the image.
+
+    <Arguments>
+        fp:         A binary file object
+
+    <Returns>
+        A (width, height) tuple, or None if the format is unknown or the
+        header is incomplete
+"""
+def dimensions(fp):
+
+    head = fp.read(30)
+
+    if head.startswith("\x89PNG\r\n\x1a\n"):
+        if len(head) < 24 or head[12:16] != "IHDR":
+            return None
+        return struct.unpack(">II", head[16:24])
+
+    if head[:6] in ("GIF87a", "GIF89a"):
+        if len(head) < 10:
+            return None
+        return struct.unpack("<HH", head[6:10])
+
+    if head.startswith("RIFF") and head[8:12] == "WEBP":
+        return _webp_dimensions(head)
+
+    if head.startswith("BM"):
+        if len(head) < 26:
+            return None
+        width, height = struct.unpack("<ii", head[18:26])
+        return width, abs(height)
+
+    if head.startswith("\xff\xd8"):
+        fp.seek(2 - len(head), io.SEEK_CUR)
+        return _jpeg_dimensions(fp)
+
+    return None
+
+
+"""
+    dimensions_from_bytes
+
+    Same as dimensions, for the beginning of an image held in memory (e.g.,
+    the first bytes of a download).
+"""
+def dimensions_from_bytes(data):
+
+    return dimensions(io.BytesIO(data))
+
+
+"""
+    file_dimensions
+
+    Same as dimensions, for a file in disk. Returns None if the file can't be
+    read.
+"""
+def file_dimensions(filename):
+
+    try:
+        with open(filename, "rb") as fp:
+            return dimensions(fp)
+    except (IOError, OSError, struct.error):
+        return None
+
+
+def _webp_dimensions(head):
+
+    chunk = head[12:16]
+
+    # lossy, the frame header follows the start code
+    if chunk == "VP8 " and len(head) >= 30:
+        width, height = struct.unpack("<HH", head[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+
+    # lossless, 14 bits each packed after the signature byte
+    if chunk == "VP8L" and len(head) >= 25:
+        b0, b1, b2, b3 = [ord(c) for c in head[21:25]]
+        width = 1 + (((b1 & 0x3F) << 8) | b0)
+        height = 1 + (((b3 & 0x0F) << 10) | (b2 << 2) | ((b1 & 0xC0) >> 6))
+        return width, height
+
+    # extended, 24 bit canvas size minus one
+    if chunk == "VP8X" and len(head) >= 30:
+        width = struct.unpack("<I", head[24:27] + "\0")[0] + 1
+        height = struct.unpack("<I", head[27:30] + "\0")[0] + 1
+        return width, height
+
+    return None
+
+
+"""
+    _jpeg_dimensions
+
+    Walks the JPEG segments up to the first start of frame, skipping over
+    the rest (EXIF data can take tens of kilobytes).
+"""
+def _jpeg_dimensions(fp):
+
+    while True:
+        byte = fp.read(1)
+        if not byte:
+            return None
+        if byte != "\xff":
+            continue
+
+        # markers can be padded with any number of 0xff
+        marker = fp.read(1)
+        while marker == "\xff":
+            marker = fp.read(1)
+        if not marker:
+            return None
+
+        marker = ord(marker)
+        if marker in _STANDALONE_MARKERS or marker == 0x00:
+            continue
+
+        # end of image or start of scan before a frame, it's broken
+        if marker in (0xD9, 0xDA):
+            return None
+
+        data = fp.read(2)
+        if len(data) < 2:
+            return None
+        length = struct.unpack(">H", data)[0]
+
+        if marker in _SOF_MARKERS:
+            data = fp.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack(">HH", data[1:5])
+            return width, height
+
+        fp.seek(length - 2, io.SEEK_CUR)
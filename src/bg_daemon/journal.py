@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""
+    bg_daemon.journal
+
+    A journal of every poll/update, one compact JSON object per line. Each
+    record carries the query used, how many pages and candidates the fetcher
+    looked at, why candidates were rejected, how many bytes we downloaded,
+    how long each phase took and the outcome of the run.
+
+    The journal is append-only and can grow for months, so the analysis in
+    aggregate() streams through it and keeps constant-size state: counters
+    and fixed, log-spaced histograms for the timings.
+"""
+import os
+import json
+import math
+import time
+
+from contextlib import contextmanager
+
+# timing histograms go from 1ms up to ~2 hours with buckets that are 10%
+# apart, so percentiles are accurate to within 10%
+_HISTOGRAM_MIN = 0.001
+_HISTOGRAM_RATIO = 1.1
+_HISTOGRAM_BUCKETS = 160
+
+PERCENTILES = (50, 90, 99)
+
+
+class run_record:
+    """
+        run_record
+
+        Collects the information about a single run before it's written.
+
+        <Properties>
+            data:   The dictionary that's written to the journal
+
+        <Functions>
+            phase():    A context manager that times a phase of the run,
+                        the time of phases that run more than once adds up
+
+            finish():   Sets the outcome and the total time of the run
+    """
+    data = None
+
+    def __init__(self, **kwargs):
+
+        self._start = time.time()
+        self.data = {"time": int(self._start)}
+        self.data.update(kwargs)
+
+    @contextmanager
+    def phase(self, name):
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            # phases that run more than once (e.g., retries) add up
+            timings = self.data.setdefault("timings", {})
+            timings[name] = round(timings.get(name, 0) + time.time() - start,
+                                  4)
+
+    def finish(self, outcome):
+
+        self.data["outcome"] = outcome
+        self.data.setdefault("timings", {})["total"] = round(
+                time.time() - self._start, 4)
+        return self.data
+
+
+def append(filename, data):
+    """
+        append:
+
+        appends a record to the journal. The record is written with a single
+        write on a file opened in append mode, so concurrent writers don't
+        interleave their lines.
+
+        arguments:
+            filename: the journal file
+
+            data: a json-serializable dictionary
+    """
+    line = json.dumps(data, separators=(",", ":"), sort_keys=True) + "\n"
+
+    fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0640)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+class _histogram:
+    """
+        _histogram
+
+        A fixed-size histogram of durations, used to estimate percentiles
+        without keeping the samples around.
+    """
+    def __init__(self):
+
+        self.counts = [0] * _HISTOGRAM_BUCKETS
+        self.total = 0
+
+    def add(self, value):
+
+        if value <= _HISTOGRAM_MIN:
+            bucket = 0
+        else:
+            bucket = int(math.log(value / _HISTOGRAM_MIN, _HISTOGRAM_RATIO))
+            bucket = min(bucket + 1, _HISTOGRAM_BUCKETS - 1)
+
+        self.counts[bucket] += 1
+        self.total += 1
+
+    def percentile(self, percent):
+
+        if self.total == 0:
+            return None
+
+        rank = math.ceil(self.total * percent / 100.0)
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return _HISTOGRAM_MIN * _HISTOGRAM_RATIO ** bucket
+
+        return None
+
+
+def aggregate(filename):
+    """
+        aggregate:
+
+        streams through the journal and summarizes it.
+
+        arguments:
+            filename: the journal file
+
+        output:
+            a dictionary with:
+                runs: the number of records
+                outcomes: how many runs ended with each outcome
+                timings: percentiles for each phase
+                terms: for each query term, how many updates used it and
+                       how many of those changed the image
+                rejected: how many candidates were rejected for each reason
+                bytes: the total number of bytes downloaded
+    """
+    runs = 0
+    total_bytes = 0
+    outcomes = {}
+    rejected = {}
+    terms = {}
+    timings = {}
+
+    with open(filename) as fp:
+        for line in fp:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a partially written line, e.g., the disk filled up
+                continue
+
+            runs += 1
+            outcome = record.get("outcome")
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            total_bytes += record.get("bytes", 0)
+
+            for reason, count in record.get("rejected", {}).items():
+                rejected[reason] = rejected.get(reason, 0) + count
+
+            for phase, value in record.get("timings", {}).items():
+                timings.setdefault(phase, _histogram()).add(value)
+
+            if record.get("query") is None:
+                continue
+
+            for term in set(record["query"].split()):
+                used, hits = terms.get(term, (0, 0))
+                terms[term] = (used + 1, hits + (outcome == "updated"))
+
+    summary = {
+        "runs": runs,
+        "outcomes": outcomes,
+        "rejected": rejected,
+        "bytes": total_bytes,
+        "terms": terms,
+        "timings": {},
+    }
+
+    for phase, histogram in timings.items():
+        summary["timings"][phase] = dict(
+                (percent, histogram.percentile(percent))
+                for percent in PERCENTILES)
+
+    return summary
+
+
+def print_summary(summary):
+    """
+        print_summary:
+
+        prints the output of aggregate() in a human readable way
+    """
+    print("{:30}: {}".format("runs", summary["runs"]))
+    print("{:30}: {}".format("bytes downloaded", summary["bytes"]))
+
+    print("\nOutcomes:")
+    for outcome, count in sorted(summary["outcomes"].items()):
+        print("    {:26}: {}".format(outcome, count))
+
+    print("\nTimings (seconds):")
+    header = " ".join("{:>10}".format("p{}".format(p)) for p in PERCENTILES)
+    print("    {:26}  {}".format("phase", header))
+    for phase, percentiles in sorted(summary["timings"].items()):
+        values = " ".join("{:10.3f}".format(percentiles[p])
+                          for p in PERCENTILES)
+        print("    {:26}: {}".format(phase, values))
+
+    print("\nRejected candidates:")
+    for reason, count in sorted(summary["rejected"].items()):
+        print("    {:26}: {}".format(reason, count))
+
+    print("\nHit rate per query term:")
+    for term, (used, hits) in sorted(summary["terms"].items()):
+        print("    {:26}: {:5.1f}% ({}/{})".format(term, 100.0 * hits / used,
+                                                   hits, used))
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""
+    bg_daemon.lock
+
+    Single-instance locking for the daemon. Cron happily starts a new process
+    every tick, even if the last update is still sleeping between retries or
+    downloading a big image. Both processes would then race on the target
+    image, its backups and the timestamp file.
+
+    The lock is an advisory flock(2) on a file inside the bg_daemon home. The
+    kernel drops it when the holder dies, so a crashed run never blocks the
+    next one, and the descriptor is closed on exec so no child (e.g., the
+    hook) keeps it. The lock is never taken over: the holder only writes
+    its pid after it got the lock, so a pid in the file can't tell whether
+    its process still holds it. The pid is only there to be reported.
+
+    Invocations that can't get the lock can leave a request behind (a
+    ".pending" file next to the lock), the running instance will pick it up
+    and run one more update before exiting. This way, many overlapping
+    "--force" calls coalesce into a single extra update.
+"""
+import os
+import errno
+import fcntl
+import time
+
+
+class lockfile:
+    """
+        lockfile
+
+        An advisory lock on a file.
+
+        <Properties>
+            path:       The location of the lock file
+
+            fd:         The file descriptor holding the lock, None if we
+                        don't hold it.
+
+        <Functions>
+            acquire():  Try to take the lock without blocking
+
+            release():  Release the lock if we hold it
+
+            holder():   Returns the pid written in the lock file
+
+            request():  Leave a request for the lock holder
+
+            take_request(): Consume a request left by another instance
+    """
+    path = None
+    fd = None
+
+    def __init__(self, path):
+
+        self.path = path
+
+    """
+        acquire
+
+        Tries to get the lock without blocking.
+
+        <Returns>
+            True if we hold the lock, False otherwise
+    """
+    def acquire(self):
+
+        if self.fd is not None:
+            return True
+
+        # we try twice, the second attempt is only made if the file was
+        # replaced while we locked it
+        for attempt in range(2):
+
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0600)
+
+            # the hook and other children should never inherit the lock
+            flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+            fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError as e:
+                os.close(fd)
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+
+                return False
+
+            # somebody may have replaced the file while we waited on it, in
+            # that case we hold a lock on a file nobody else will look at
+            try:
+                current = os.stat(self.path)
+            except OSError:
+                current = None
+
+            if current is None or current.st_ino != os.fstat(fd).st_ino:
+                os.close(fd)
+                continue
+
+            os.ftruncate(fd, 0)
+            os.write(fd, "{} {}\n".format(os.getpid(), int(time.time())))
+            self.fd = fd
+            return True
+
+        return False
+
+    """
+        release
+
+        Releases the lock, it's a no-op if we don't hold it.
+    """
+    def release(self):
+
+        if self.fd is None:
+            return
+
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+
+    """
+        holder
+
+        Reads the pid of the last process that took the lock.
+
+        <Returns>
+            The pid as an integer, or None if it can't be read
+    """
+    def holder(self):
+
+        try:
+            with open(self.path) as fp:
+                return int(fp.read().split()[0])
+        except (IOError, OSError, ValueError, IndexError):
+            return None
+
+    """
+        request
+
+        Leaves a request for the current holder to run once more before
+        exiting.
+    """
+    def request(self):
+
+        with open(self._request_path(), "wt") as fp:
+            fp.write("{}\n".format(os.getpid()))
+
+    """
+        take_request
+
+        Consumes a request left by another instance.
+
+        <Returns>
+            True if there was a pending request
+    """
+    def take_request(self):
+
+        try:
+            os.unlink(self._request_path())
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+
+        return True
+
+    def __enter__(self):
+
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.release()
+
+    def _request_path(self):
+
+        return "{}.pending".format(self.path)
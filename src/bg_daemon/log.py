@@ -8,6 +8,11 @@
     The first time the module is imported, a logger instance is created, if
     it is allocated by other modules, the same logger instance will be queried.
 
+    Logging calls never touch the disk: records are handed over to a queue
+    and a background thread writes them to a (rotating) log file. The
+    levels and rotation policy can be changed from the "log" section in
+    settings.json, see configure().
+
     <usage>
         main program:
             import .log
@@ -20,8 +25,11 @@
 
 """
 import logging
+import logging.handlers
 import os
-from pkg_resources import Requirement, resource_filename, resource_string
+import atexit
+import threading
+import Queue
 from bg_daemon.util import HOME, initialize_home_directory
 
 # We set some sane defaults here, we filted differently if the logging
@@ -31,21 +39,201 @@ _DEFAULT_LOG_FILENAME = os.path.join(_BASE_PATH, "bg_daemon.log")
 _DEFAULT_LOG_LEVEL = logging.DEBUG
 _DEFAULT_CONSOLE_LOG_LEEL = logging.INFO
 _DEFAULT_FILE_LOG_LEVEL = logging.DEBUG
+_DEFAULT_MAX_BYTES = 1024 * 1024
+_DEFAULT_BACKUP_COUNT = 3
 
-# define the hardcoded format string
-_FORMAT_STRING = ("[%(asctime)s] [%(name)s] [%(levelname)s]"
-                  "[%(funcName)s:%(lineno)s@%(filename)s]\n\t%(message)s")
+# define the hardcoded format string, we don't include the caller's function
+# and line number since finding them is the most expensive part of a record
+_FORMAT_STRING = "[%(asctime)s] [%(name)s] [%(levelname)s] %(message)s"
 formatter = logging.Formatter(_FORMAT_STRING)
 
+
+class _queue_handler(logging.Handler):
+    """
+        _queue_handler
+
+        Hands records over to a queue instead of writing them. The message
+        is merged with its arguments here so the record can be written by
+        another thread.
+    """
+    def __init__(self, queue):
+
+        logging.Handler.__init__(self)
+        self.queue = queue
+
+    def emit(self, record):
+
+        try:
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = formatter.formatException(record.exc_info)
+                record.exc_info = None
+
+            self.queue.put_nowait(record)
+        except Exception:
+            self.handleError(record)
+
+
+class _queue_listener:
+    """
+        _queue_listener
+
+        Background thread that takes records from the queue and hands them
+        to the real handlers, honoring each handler's level.
+    """
+    _sentinel = None
+
+    def __init__(self, queue, handlers):
+
+        self.queue = queue
+        self.handlers = handlers
+        self._thread = None
+
+    def start(self):
+
+        self._thread = threading.Thread(target=self._monitor,
+                                        name="bg_daemon_log")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+
+        if self._thread is None:
+            return
+
+        self.queue.put(self._sentinel)
+        self._thread.join()
+        self._thread = None
+
+        for handler in self.handlers:
+            handler.close()
+
+    def _monitor(self):
+
+        while True:
+            record = self.queue.get()
+            if record is self._sentinel:
+                return
+
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+
+def _build_file_handler(settings):
+    """
+        _build_file_handler:
+
+        builds the handler that writes to the log file, rotating it by size
+        by default, or by time if "rotate_when" is set (e.g., "midnight").
+    """
+    filename = settings.get("filename", _DEFAULT_LOG_FILENAME)
+    backup_count = settings.get("backup_count", _DEFAULT_BACKUP_COUNT)
+
+    if settings.get("rotate_when"):
+        handler = logging.handlers.TimedRotatingFileHandler(
+                filename, when=settings["rotate_when"],
+                backupCount=backup_count)
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+                filename, maxBytes=settings.get("max_bytes",
+                                                _DEFAULT_MAX_BYTES),
+                backupCount=backup_count)
+
+    handler.setLevel(_get_level(settings.get("file_level"),
+                                _DEFAULT_FILE_LOG_LEVEL))
+    handler.setFormatter(formatter)
+    return handler
+
+
+def _no_caller(*args):
+    """
+        _no_caller:
+
+        stands in for Logger.findCaller on our logger, the format doesn't
+        use the caller so the stack isn't walked for every record
+    """
+    return "(unknown file)", 0, "(unknown function)"
+
+
+def _get_level(name, default):
+
+    if name is None:
+        return default
+
+    level = logging.getLevelName(str(name).upper())
+    if not isinstance(level, int):
+        raise ValueError("Unknown logging level {}".format(name))
+
+    return level
+
+
+def configure(settings):
+    """
+        configure:
+
+        reconfigures the log handlers from the "log" section of the settings
+        file.
+
+        arguments:
+            settings: a dictionary that may contain:
+
+                file_level: the level for the log file
+                console_level: the level for stderr, no console output if
+                               it's not set
+                max_bytes: size at which the log file is rotated
+                rotate_when: rotate by time instead (e.g., "midnight")
+                backup_count: how many rotated files to keep
+
+        side-effects:
+            the listener thread is restarted with the new handlers
+    """
+    global _listener
+
+    handlers = [_build_file_handler(settings)]
+
+    if settings.get("console_level"):
+        console_handler = logging.StreamHandler()
+        console_handler.setLevel(_get_level(settings["console_level"],
+                                            _DEFAULT_CONSOLE_LOG_LEEL))
+        console_handler.setFormatter(formatter)
+        handlers.append(console_handler)
+
+    _listener.stop()
+    _listener = _queue_listener(_queue, handlers)
+    _listener.start()
+
+    # records below every handler's level are dropped right away
+    logger.setLevel(min(handler.level for handler in handlers))
+
+
+def shutdown():
+    """
+        shutdown:
+
+        writes whatever is still in the queue and stops the listener thread,
+        it's called when the interpreter exits.
+    """
+    _listener.stop()
+
+
 # define the handler, we are going to write our log to a file
 if not os.path.exists(HOME):
     initialize_home_directory()
 
-file_handler = logging.FileHandler(_DEFAULT_LOG_FILENAME)
-file_handler.setLevel(_DEFAULT_FILE_LOG_LEVEL)
-file_handler.setFormatter(formatter)
+_queue = Queue.Queue()
+_listener = _queue_listener(_queue, [_build_file_handler({})])
+_listener.start()
+atexit.register(shutdown)
+
+queue_handler = _queue_handler(_queue)
 
 # define the logger itself
 logger = logging.getLogger('bg_daemon')
 logger.setLevel(_DEFAULT_LOG_LEVEL)
-logger.addHandler(file_handler)
+logger.addHandler(queue_handler)
+
+# only our logger skips the caller lookup, logging._srcfile (which turns it
+# off for every logger in the process) is left alone
+logger.findCaller = _no_caller
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+"""
+    bg_daemon.mirror
+
+    LAN mirror mode: a single bg_daemon runs the queries and downloads with
+    its regular fetcher (imgur so far), keeps a catalog of the images that
+    passed its filters and serves them over HTTP. The desktops in the fleet
+    use the "mirrorfetcher" to pick images from the catalog, so imgur only
+    sees one client no matter how many machines we have.
+
+    The server answers two requests:
+
+        GET /catalog        the catalog, a json list of image records
+        GET /images/<file>  the image itself
+"""
+import os
+import json
+import time
+import shutil
+import threading
+import logging
+import BaseHTTPServer
+import SocketServer
+
+from hashlib import sha256
+
+# the fields of a candidate that are kept in the catalog
+CATALOG_FIELDS = ("id", "title", "description", "link", "width", "height",
+                  "nsfw", "views", "section", "account_url", "datetime")
+
+
+class _http_server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+    mirror = None
+
+
+class _request_handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+
+        mirror = self.server.mirror
+
+        if self.path == "/catalog":
+            body = mirror.catalog_json()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if self.path.startswith("/images/"):
+            filename = mirror.image_path(self.path[len("/images/"):])
+            if filename is not None and os.path.exists(filename):
+                with open(filename, "rb") as fp:
+                    self.send_response(200)
+                    self.send_header("Content-Type",
+                                     "application/octet-stream")
+                    self.send_header("Content-Length",
+                                     str(os.fstat(fp.fileno()).st_size))
+                    self.end_headers()
+                    shutil.copyfileobj(fp, self.wfile)
+                return
+
+        self.send_error(404)
+
+    def log_message(self, format, *args):
+
+        logger.debug("mirror: %s %s", self.address_string(), format % args)
+
+
+class mirror_server:
+    """
+        mirror_server
+
+        Fills a catalog using a fetcher and serves it over HTTP.
+
+        <Properties>
+            fetcher:        The fetcher used to query and download images
+
+            directory:      Where the images and the catalog are kept
+
+            catalog_size:   How many images are kept, the oldest ones are
+                            dropped first
+
+            interval:       How often (in seconds) a new image is added
+
+        <Functions>
+            refresh():      Adds a new image to the catalog
+
+            serve_forever(): Serves the catalog and keeps refreshing it
+
+            shutdown():     Stops serving
+    """
+    fetcher = None
+    directory = None
+    catalog_size = None
+    interval = None
+
+    def __init__(self, fetcher, directory, address="", port=8080,
+                 catalog_size=200, interval=300):
+
+        self.fetcher = fetcher
+        self.directory = directory
+        self.catalog_size = catalog_size
+        self.interval = interval
+
+        self._lock = threading.Lock()
+        self._catalog = []
+        self._catalog_json = "[]"
+        self._stopped = threading.Event()
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self._load()
+
+        self.httpd = _http_server((address, port), _request_handler)
+        self.httpd.mirror = self
+
+    @property
+    def port(self):
+
+        return self.httpd.server_address[1]
+
+    """
+        refresh
+
+        Queries the fetcher for a new image, downloads it and adds it to the
+        catalog.
+
+        <Returns>
+            True if an image was added
+    """
+    def refresh(self):
+
+        query = self.fetcher.query()
+        if query is None:
+            return False
+
+        entry = dict((field, getattr(query, field, None))
+                     for field in CATALOG_FIELDS)
+
+        with self._lock:
+            if any(item["link"] == entry["link"] for item in self._catalog):
+                logger.debug("%s is already mirrored", entry["link"])
+                return False
+
+        ext = os.path.splitext(entry["link"] or "")[1][:5] or ".jpg"
+        entry["file"] = "{}{}".format(sha256(entry["link"]).hexdigest()[:16],
+                                      ext)
+        filename = os.path.join(self.directory, entry["file"])
+        partial = "{}.part".format(filename)
+
+        try:
+            self.fetcher.fetch(query, partial)
+        except Exception as e:
+            logger.error("Couldn't mirror {}: {}".format(entry["link"], e))
+            if os.path.exists(partial):
+                os.unlink(partial)
+            return False
+
+        os.rename(partial, filename)
+        entry["size"] = os.path.getsize(filename)
+        entry["mirrored"] = int(time.time())
+
+        with self._lock:
+            self._catalog.append(entry)
+            while len(self._catalog) > self.catalog_size:
+                old = self._catalog.pop(0)
+                try:
+                    os.unlink(os.path.join(self.directory, old["file"]))
+                except OSError:
+                    pass
+
+            self._update_catalog_json()
+
+        self._save()
+        logger.info("Mirrored {}".format(entry["link"]))
+        return True
+
+    """
+        serve_forever
+
+        Serves the catalog, refreshing it every "interval" seconds from a
+        background thread.
+    """
+    def serve_forever(self):
+
+        refresher = threading.Thread(target=self._refresh_loop,
+                                     name="mirror_refresh")
+        refresher.daemon = True
+        refresher.start()
+
+        logger.info("Serving the mirror on port {}".format(self.port))
+        self.httpd.serve_forever()
+
+    def shutdown(self):
+
+        self._stopped.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def catalog_json(self):
+
+        with self._lock:
+            return self._catalog_json
+
+    """
+        image_path
+
+        Maps a requested file to its path, only files in the catalog are
+        served.
+    """
+    def image_path(self, name):
+
+        with self._lock:
+            for entry in self._catalog:
+                if entry["file"] == name:
+                    return os.path.join(self.directory, name)
+
+        return None
+
+    def _refresh_loop(self):
+
+        while not self._stopped.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error("Couldn't refresh the mirror {}".format(e))
+
+            self._stopped.wait(self.interval)
+
+    def _update_catalog_json(self):
+
+        self._catalog_json = json.dumps(self._catalog, separators=(",", ":"))
+
+    def _load(self):
+
+        filename = os.path.join(self.directory, "catalog.json")
+        if not os.path.exists(filename):
+            return
+
+        with open(filename) as fp:
+            self._catalog = json.load(fp)
+        self._update_catalog_json()
+
+    def _save(self):
+
+        filename = os.path.join(self.directory, "catalog.json")
+        partial = "{}.part".format(filename)
+
+        with open(partial, "wt") as fp:
+            fp.write(self.catalog_json())
+        os.rename(partial, filename)
+
+
+logger = logging.getLogger("bg_daemon")
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+"""
+    bg_daemon.phash
+
+    Near-duplicate detection for wallpapers. Imgur reposts mean the same
+    picture comes back under different ids and links, so we compute a
+    perceptual hash (a 64-bit difference hash) of every image we promote and
+    reject new images that are within a few bits of a recent one.
+
+    The hashes are kept in a multi-index hash table: the 64 bits are split
+    in (distance + 1) chunks and each chunk is indexed on its own. Two hashes
+    within "distance" bits of each other must agree on at least one whole
+    chunk, so a lookup only compares against the few hashes that share a
+    chunk with it instead of scanning all of them.
+
+    Decoding images needs PIL (or Pillow). If it's not installed, images
+    can't be hashed and deduplication is disabled.
+"""
+import os
+import time
+import logging
+
+from collections import deque
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+HASH_BITS = 64
+
+# the difference hash compares each pixel with its right neighbour on a
+# (HASH_SIZE + 1) x HASH_SIZE thumbnail
+_HASH_SIZE = 8
+
+
+def dhash(filename):
+    """
+        dhash:
+
+        computes the difference hash of an image.
+
+        arguments:
+            filename: the image file
+
+        output:
+            the hash as an integer, or None if the image can't be decoded (or
+            PIL isn't available)
+    """
+    if Image is None:
+        return None
+
+    try:
+        image = Image.open(filename)
+        # decoding a downscaled version is much cheaper for jpegs
+        image.draft("L", (_HASH_SIZE * 4, _HASH_SIZE * 4))
+        image = image.convert("L").resize((_HASH_SIZE + 1, _HASH_SIZE),
+                                          Image.BILINEAR)
+    except (IOError, OSError, ValueError) as e:
+        logger.error("Couldn't hash {}: {}".format(filename, e))
+        return None
+
+    pixels = list(image.getdata())
+    value = 0
+    for row in range(_HASH_SIZE):
+        for column in range(_HASH_SIZE):
+            left = pixels[row * (_HASH_SIZE + 1) + column]
+            right = pixels[row * (_HASH_SIZE + 1) + column + 1]
+            value = (value << 1) | (left > right)
+
+    return value
+
+
+def hamming(a, b):
+    """
+        hamming:
+
+        the number of bits in which two hashes differ
+    """
+    return bin(a ^ b).count("1")
+
+
+class hash_index:
+    """
+        hash_index
+
+        A persistent multi-index hash table of the most recent image hashes.
+
+        <Properties>
+            filename:       The file in which the hashes are kept, one
+                            "hash id timestamp" line per image
+
+            distance:       Hashes that differ in this many bits or less are
+                            considered duplicates
+
+            max_entries:    How many of the most recent hashes are kept
+
+        <Functions>
+            find():     Finds a near-duplicate of a hash
+
+            add():      Adds a hash to the index
+    """
+    filename = None
+    distance = None
+    max_entries = None
+
+    def __init__(self, filename, distance=3, max_entries=50000):
+
+        self.filename = filename
+        self.distance = distance
+        self.max_entries = max_entries
+
+        # split the hash in (distance + 1) chunks as evenly as possible
+        chunks = distance + 1
+        self._chunks = []
+        offset = 0
+        for i in range(chunks):
+            width = HASH_BITS // chunks + (i < HASH_BITS % chunks)
+            self._chunks.append((offset, (1 << width) - 1))
+            offset += width
+
+        self._entries = {}
+        self._order = deque()
+        self._tables = [{} for chunk in self._chunks]
+        self._lines = 0
+
+        self._load()
+
+    """
+        find
+
+        Looks for a hash within "distance" bits of the given one.
+
+        <Arguments>
+            value:  The hash to look for
+
+        <Returns>
+            The id of the closest duplicate, or None if there is none
+    """
+    def find(self, value):
+
+        best = None
+        seen = set()
+
+        for table, chunk in zip(self._tables, self._chunk_values(value)):
+            for candidate in table.get(chunk, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+
+                distance = hamming(value, candidate)
+                if distance <= self.distance and (best is None or
+                                                  distance < best[0]):
+                    best = (distance, candidate)
+
+        if best is None:
+            return None
+
+        return self._entries[best[1]]
+
+    """
+        add
+
+        Adds a hash to the index and appends it to the index file. The file
+        is compacted once it has twice as many lines as entries we keep.
+
+        <Arguments>
+            value:  The hash of the image
+
+            name:   An identifier for the image (e.g., its link)
+    """
+    def add(self, value, name):
+
+        name = str(name).replace(" ", "_")
+        self._insert(value, name)
+
+        with open(self.filename, "at") as fp:
+            fp.write("{:016x} {} {}\n".format(value, name, int(time.time())))
+        self._lines += 1
+
+        if self._lines > 2 * self.max_entries:
+            self._compact()
+
+    def _chunk_values(self, value):
+
+        return [(value >> offset) & mask for offset, mask in self._chunks]
+
+    def _insert(self, value, name):
+
+        if value in self._entries:
+            self._entries[value] = name
+            return
+
+        self._entries[value] = name
+        self._order.append(value)
+        for table, chunk in zip(self._tables, self._chunk_values(value)):
+            table.setdefault(chunk, []).append(value)
+
+        while len(self._order) > self.max_entries:
+            self._remove(self._order.popleft())
+
+    def _remove(self, value):
+
+        del self._entries[value]
+        for table, chunk in zip(self._tables, self._chunk_values(value)):
+            bucket = table[chunk]
+            bucket.remove(value)
+            if not bucket:
+                del table[chunk]
+
+    def _load(self):
+
+        if not os.path.exists(self.filename):
+            return
+
+        with open(self.filename) as fp:
+            for line in fp:
+                self._lines += 1
+                try:
+                    value, name, timestamp = line.split()
+                    self._insert(int(value, 16), name)
+                except ValueError:
+                    continue
+
+    def _compact(self):
+
+        partial = "{}.part".format(self.filename)
+        with open(partial, "wt") as fp:
+            for value in self._order:
+                fp.write("{:016x} {} {}\n".format(value, self._entries[value],
+                                                  int(time.time())))
+
+        os.rename(partial, self.filename)
+        self._lines = len(self._order)
+
+
+logger = logging.getLogger("bg_daemon")
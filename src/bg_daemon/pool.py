@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""
+    bg_daemon.pool
+
+    The local image pool: every image we already have on disk (the backups
+    next to the target and anything in the pool directory). When the network
+    or imgur is down, the daemon rotates through the pool instead of
+    retrying for minutes and changing nothing.
+
+    The list of images is kept in an index file along with the modification
+    time of every directory it was built from, so picking the next image
+    doesn't need to list any directory unless one of them changed.
+"""
+import os
+import re
+import json
+import logging
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp")
+
+
+class image_pool:
+    """
+        image_pool
+
+        A persistent, round-robin index of the images on disk.
+
+        <Properties>
+            target:     The target image, its backups (target-digest.ext)
+                        are part of the pool
+
+            directory:  A directory whose images are all part of the pool
+
+            filename:   Where the index is kept
+
+        <Functions>
+            refresh():  Rebuilds the index if a directory changed
+
+            add():      Adds an image to the index
+
+            next():     Returns the next image in the rotation
+    """
+    target = None
+    directory = None
+    filename = None
+
+    def __init__(self, target, directory, filename):
+
+        self.target = target
+        self.directory = directory
+        self.filename = filename
+
+        name, ext = os.path.splitext(os.path.basename(target))
+        self._backup_pattern = re.compile("^{}-[0-9a-f]+{}$".format(
+                                          re.escape(name), re.escape(ext)))
+
+        self._index = {"directories": {}, "images": [], "cursor": 0}
+        self._load()
+
+    """
+        refresh
+
+        Rebuilds the list of images if any of the directories changed since
+        the index was built.
+    """
+    def refresh(self):
+
+        mtimes = self._directory_mtimes()
+        if mtimes == self._index["directories"]:
+            return
+
+        images = []
+        for directory in mtimes:
+            for filename in sorted(os.listdir(directory)):
+                if self._is_pool_image(directory, filename):
+                    images.append(os.path.join(directory, filename))
+
+        logger.debug("rebuilt the image pool, {} images".format(len(images)))
+        self._index["directories"] = mtimes
+        self._index["images"] = images
+        self._save()
+
+    """
+        add
+
+        Adds an image to the index without rebuilding it.
+
+        <Arguments>
+            filename:   The image to add
+    """
+    def add(self, filename):
+
+        if filename not in self._index["images"]:
+            self._index["images"].append(filename)
+
+        self._index["directories"] = self._directory_mtimes()
+        self._save()
+
+    """
+        next
+
+        Picks the next image in the rotation.
+
+        <Arguments>
+            exclude:    A file that shouldn't be picked (e.g., the image that
+                        is already the target)
+
+        <Returns>
+            The path to an image, or None if the pool is empty
+    """
+    def next(self, exclude=None):
+
+        self.refresh()
+
+        images = self._index["images"]
+        for i in range(len(images)):
+            cursor = (self._index["cursor"] + i) % len(images)
+            candidate = images[cursor]
+
+            if not os.path.exists(candidate):
+                continue
+
+            if exclude is not None and os.path.exists(exclude) and \
+                    os.path.samefile(candidate, exclude):
+                continue
+
+            self._index["cursor"] = cursor + 1
+            self._save()
+            return candidate
+
+        return None
+
+    def _is_pool_image(self, directory, filename):
+
+        if filename.startswith("."):
+            return False
+
+        if directory == self.directory:
+            return filename.lower().endswith(IMAGE_EXTENSIONS)
+
+        return self._backup_pattern.match(filename) is not None
+
+    def _directory_mtimes(self):
+
+        mtimes = {}
+        for directory in (os.path.dirname(self.target), self.directory):
+            if directory and os.path.isdir(directory):
+                mtimes[directory] = os.stat(directory).st_mtime
+
+        return mtimes
+
+    def _load(self):
+
+        if not os.path.exists(self.filename):
+            return
+
+        try:
+            with open(self.filename) as fp:
+                self._index = json.load(fp)
+        except (IOError, ValueError) as e:
+            logger.error("Couldn't load the pool index {}".format(e))
+
+    def _save(self):
+
+        partial = "{}.part".format(self.filename)
+        try:
+            with open(partial, "wt") as fp:
+                json.dump(self._index, fp, separators=(",", ":"))
+            os.rename(partial, self.filename)
+        except (IOError, OSError) as e:
+            logger.error("Couldn't save the pool index {}".format(e))
+
+
+logger = logging.getLogger("bg_daemon")
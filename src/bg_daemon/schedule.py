@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+"""
+    bg_daemon.schedule
+
+    Spreads the work of many machines over time. If every machine of a fleet
+    runs the same cron schedule, or was set up at the same time, they all
+    hit imgur (or the mirror) in the same second.
+
+    Every host gets a deterministic phase, derived from its hostname: its
+    cron entry runs on its own minutes, and its updates are due on its own
+    grid of seconds. On top of that, a bit of random jitter keeps hosts with
+    the same phase (or the same hostname) from staying in lockstep.
+
+    The same phase places prefetching (see background_daemon.prefetch) in
+    the idle window between two updates.
+
+    When we run from cron, the crontab entry is derived from "frequency"
+    (cron_fields), and updates are due exactly when cron fires
+    (next_cron_due), so cron never starts a python process for nothing.
+    Past a day, the entry runs daily and most runs find nothing due.
+"""
+import time
+import random
+import socket
+import hashlib
+
+# the periods (in seconds) a crontab entry can run at evenly: minutes that
+# divide an hour, hours that divide a day, and a day
+CRON_PERIODS = tuple([m * 60 for m in (1, 2, 3, 4, 5, 6, 10, 12, 15, 20,
+                                        30)] +
+                     [h * 3600 for h in (1, 2, 3, 4, 6, 8, 12)] + [86400])
+
+
+"""
+    host_offset
+
+    A deterministic offset for this host.
+
+    <Arguments>
+        period: The offset is in [0, period)
+
+        salt:   Different salts give unrelated offsets for the same host, so
+                the minute of the cron entry doesn't decide its hour
+
+    <Returns>
+        An integer offset
+"""
+def host_offset(period, salt=""):
+
+    period = int(period)
+    if period <= 1:
+        return 0
+
+    seed = "{}:{}".format(socket.gethostname(), salt)
+    digest = hashlib.sha256(seed.encode("utf-8")).hexdigest()
+    return int(digest[:12], 16) % period
+
+
+"""
+    host_fraction
+
+    A deterministic number in [0, 1) for this host
+"""
+def host_fraction(salt=""):
+
+    return host_offset(1 << 20, salt) / float(1 << 20)
+
+
+"""
+    next_update
+
+    When should the next update happen. Updates are due on a grid of
+    "frequency" seconds shifted by this host's offset, at least half a
+    period from now, plus up to "jitter" random seconds.
+
+    <Arguments>
+        now:        The current time (as a timestamp)
+
+        frequency:  The seconds between updates
+
+        jitter:     The largest random delay, in seconds
+
+    <Returns>
+        The timestamp of the next update
+"""
+def next_update(now, frequency, jitter=0):
+
+    frequency = max(1, int(frequency))
+    offset = host_offset(frequency, "update")
+
+    earliest = now + frequency / 2.0
+    slots = -((offset - earliest) // frequency)
+    when = offset + slots * frequency
+
+    if jitter:
+        when += random.uniform(0, jitter)
+
+    return when
+
+
+"""
+    cron_times
+
+    The values of a cron field that runs "every" units, shifted by this
+    host's offset, e.g., every 5 minutes could be 3,8,13,...,58
+
+    <Arguments>
+        every:  The interval, in the unit of the field
+
+        span:   How many values the field has (60 minutes, 24 hours)
+
+        salt:   See host_offset
+
+    <Returns>
+        A list of values, or None if "every" doesn't fit in the field
+"""
+def cron_times(every, span, salt=""):
+
+    every = int(every)
+    if every < 1 or every >= span:
+        return None
+
+    offset = host_offset(every, salt)
+    return list(range(offset, span, every))
+
+
+"""
+    idle_point
+
+    When should background work (prefetching) start in an idle window: a
+    point past its first tenth and before its last one, chosen by this
+    host's phase plus a bit of jitter.
+
+    <Arguments>
+        start, end: The idle window (timestamps)
+
+        jitter:     The largest random shift, in seconds
+
+    <Returns>
+        A timestamp within the window
+"""
+def idle_point(start, end, jitter=0):
+
+    length = max(0, end - start)
+    when = start + length * (0.1 + 0.8 * host_fraction("idle"))
+
+    if jitter:
+        when += random.uniform(-jitter, jitter) / 2.0
+
+    return min(max(when, start + length * 0.1), start + length * 0.9)
+
+
+"""
+    cron_period
+
+    The period cron can run at that's the closest to "frequency" (the
+    longer one on ties), in seconds
+"""
+def cron_period(frequency):
+
+    return min(CRON_PERIODS,
+               key=lambda period: (abs(period - frequency), -period))
+
+
+"""
+    cron_fields
+
+    The minute and hour fields of the crontab entry for "frequency",
+    shifted by this host's offsets.
+
+    <Returns>
+        A (minutes, hours) tuple of lists of values, hours is None if the
+        entry runs every hour
+"""
+def cron_fields(frequency):
+
+    period = cron_period(frequency)
+
+    if period < 3600:
+        return cron_times(period // 60, 60, "minute"), None
+
+    minutes = [host_offset(60, "minute")]
+    if period < 86400:
+        return minutes, cron_times(period // 3600, 24, "hour")
+
+    return minutes, [host_offset(24, "hour")]
+
+
+"""
+    next_cron_time
+
+    The first time at or after "start" when a crontab entry with these
+    fields runs (cron uses the local time).
+
+    <Arguments>
+        start:      A timestamp
+
+        minutes, hours: The fields, see cron_fields
+
+    <Returns>
+        The timestamp of the start of that minute
+"""
+def next_cron_time(start, minutes, hours=None):
+
+    when = int(-(-start // 60) * 60)
+
+    # a day has 1440 minutes, a bit more covers daylight saving changes
+    for i in range(1500):
+        local = time.localtime(when)
+        if local.tm_min in minutes and (hours is None or
+                                        local.tm_hour in hours):
+            return when
+        when += 60
+
+    return when
+
+
+"""
+    next_cron_due
+
+    When the next update is due, when we run from the crontab entry of
+    "frequency": the run of the entry that's the closest to "frequency"
+    seconds from now. Entries never run less than daily, so longer
+    frequencies skip runs.
+
+    <Arguments>
+        now:        The current time (as a timestamp), usually just after a
+                    run of the entry
+
+        frequency:  The seconds between updates
+
+    <Returns>
+        The timestamp of that run
+"""
+def next_cron_due(now, frequency):
+
+    minutes, hours = cron_fields(frequency)
+    start = now + frequency - cron_period(frequency) / 2.0
+    return next_cron_time(max(now, start), minutes, hours)
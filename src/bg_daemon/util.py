@@ -7,9 +7,14 @@
 """
 import sys
 import os
+import re
+import errno
 import shutil
 import json
+import socket
+import logging
 import crontab
+from bg_daemon.schedule import cron_times, cron_fields, cron_period
 from hashlib import sha256
 from pkg_resources import Requirement, resource_filename, resource_string
 
@@ -20,6 +25,8 @@ DEFAULT_IMAGE = "bg.jpg"
 PKG_LOCATION = resource_filename("bg_daemon", "")
 DIGEST_LENGTH = 10
 STDOUT_RELOCATION = os.path.join(HOME, "output.log")
+# the frequency the crontab entry was derived from
+CRONTAB_FREQUENCY = os.path.join(HOME, "crontab")
 DEFAULT_COMMAND = ("/usr/local/bin/background_daemon.py "
                    ">> {}".format(STDOUT_RELOCATION))
 
@@ -98,6 +105,98 @@ def get_digest_for_file(filename):
     return hexify(digest)[:DIGEST_LENGTH]
 
 
+def get_backup_filename(filename):
+    """
+        get_backup_filename
+
+            builds the name under which a file is backed up: the same name
+            with a hash-prefix of its contents appended, e.g.,
+            bg-0123456789.jpg
+
+        arguments:
+            filename: the file to back up
+
+        returns:
+            the filename of the backup
+    """
+    digest = get_digest_for_file(filename)
+    name, ext = os.path.splitext(filename)
+
+    return "{}-{}{}".format(name, digest, ext)
+
+
+def list_backups(target):
+    """
+        list_backups
+
+            finds the backups of a target (see get_backup_filename)
+
+        arguments:
+            target: the target image
+
+        returns:
+            a list of (digest, path) tuples
+    """
+    directory, basename = os.path.split(target)
+    name, ext = os.path.splitext(basename)
+    pattern = re.compile("^{}-([0-9a-f]+){}$".format(re.escape(name),
+                                                     re.escape(ext)))
+
+    backups = []
+    for filename in os.listdir(directory or "."):
+        match = pattern.match(filename)
+        if match is not None:
+            backups.append((match.group(1), os.path.join(directory,
+                                                         filename)))
+
+    return backups
+
+
+def link_or_copy(source, destination):
+    """
+        link_or_copy
+
+            hardlinks source into destination so no data is copied, falls
+            back to a copy if the filesystem doesn't support hardlinks.
+
+        arguments:
+            source: the existing file
+
+            destination: the new name, it must not exist
+    """
+    try:
+        os.link(source, destination)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK,
+                           errno.ENOTSUP):
+            raise
+        shutil.copyfile(source, destination)
+
+
+def is_online(host, port, timeout):
+    """
+        is_online
+
+            checks that we can open a connection to a host, it's a quick way
+            to know that the network works before trying to use it.
+
+        arguments:
+            host, port: where to connect to
+
+            timeout: how many seconds to wait for the connection
+
+        returns:
+            True if the connection succeeded
+    """
+    try:
+        connection = socket.create_connection((host, port), timeout)
+    except (socket.error, socket.timeout):
+        return False
+
+    connection.close()
+    return True
+
+
 def hexify(byte_array):
     """
         hexify:
@@ -147,12 +246,17 @@ def set_default_settings(settings):
     settings['daemon'] = daemon
     return settings
 
-def add_crontab_entry(days = None, hours = None, minutes = 5):
+def add_crontab_entry(days = None, hours = None, minutes = None,
+                      frequency = None):
     """
         add_crontab_entry:
 
-        adds a crontab entry to call the daemon every day, hour, and minute
-        that's specified as an argument
+        adds a crontab entry to call the daemon. By default, the entry is
+        derived from the frequency in the settings so cron only runs when an
+        update is due, and it's rewritten if the frequency changed since it
+        was added (see sync_crontab_entry). Every host runs on its own
+        minutes (and hours), so a fleet installed at once doesn't poll in
+        lockstep, see bg_daemon.schedule
 
         input:
             days: each [days] days this job will be executed
@@ -161,6 +265,9 @@ def add_crontab_entry(days = None, hours = None, minutes = 5):
 
             minutes: each [minutes] minutes this job will be executes
 
+            frequency: the seconds between updates, the frequency in the
+            settings if neither this nor days, hours or minutes are given
+
         output:
 
             the resulting crontab
@@ -173,20 +280,25 @@ def add_crontab_entry(days = None, hours = None, minutes = 5):
     """
     tab = crontab.CronTab(user=True)
 
+    if not (days or hours or minutes):
+        if frequency is None:
+            frequency = _settings_frequency()
+        return _write_crontab_entry(tab, frequency)
+
     # verify that we haven't populated the crontab yet
     if _is_crontab_populated(tab):
         return tab
 
     new_job = tab.new(command=DEFAULT_COMMAND)
-    
+
     if days:
         new_job.day.every(days)
 
     if hours:
-        new_job.hour.every(hours)
+        _spread(new_job.hour, hours, 24, "hour")
 
     if minutes:
-        new_job.minutes.every(minutes)
+        _spread(new_job.minutes, minutes, 60, "minute")
 
     new_job.set_comment("Background daemon")
 
@@ -198,6 +310,106 @@ def add_crontab_entry(days = None, hours = None, minutes = 5):
     return tab
 
 
+def sync_crontab_entry(frequency):
+    """
+        sync_crontab_entry:
+
+        rewrites the crontab entry if it was derived from another frequency.
+        Only the small file that records that frequency is read when nothing
+        changed, so it's cheap enough to call on every run.
+
+        input:
+            frequency: the seconds between updates in the settings
+
+        output:
+
+            True if the entry was rewritten
+    """
+    try:
+        with open(CRONTAB_FREQUENCY) as fp:
+            installed = fp.read().strip()
+    except IOError:
+        # there's no entry, or it wasn't derived from the frequency
+        return False
+
+    if installed == str(frequency):
+        return False
+
+    _write_crontab_entry(crontab.CronTab(user=True), frequency)
+    return True
+
+
+def _write_crontab_entry(tab, frequency):
+    """
+        _write_crontab_entry:
+
+        adds (or updates) the crontab entry that runs when updates are due
+        with this frequency, and records the frequency
+    """
+    minutes, hours = cron_fields(frequency)
+
+    period = cron_period(frequency)
+    if period != frequency:
+        logger.warning("cron can't run every {} seconds, the entry runs "
+                       "every {} seconds and updates are due on the run "
+                       "closest to the frequency".format(frequency, period))
+
+    jobs = [job for job in tab.find_command("background_daemon.py")
+            if job.command == DEFAULT_COMMAND]
+
+    if jobs:
+        job = jobs[0]
+        job.setall("* * * * *")
+    else:
+        job = tab.new(command=DEFAULT_COMMAND)
+        job.set_comment("Background daemon")
+
+    job.minutes.on(*minutes)
+    if hours is not None:
+        job.hour.on(*hours)
+
+    if not job.is_valid():
+        raise Exception("couldn't create job!")
+
+    tab.write_to_user(user=True)
+
+    initialize_home_directory()
+    with open(CRONTAB_FREQUENCY, "wt") as fp:
+        fp.write(str(frequency))
+
+    return tab
+
+
+def _settings_frequency():
+    """
+        _settings_frequency:
+
+        the frequency in the settings, what the daemon uses when there are
+        no settings yet
+    """
+    filename = os.path.join(HOME, "settings.json")
+    if not os.path.exists(filename):
+        filename = os.path.join(PKG_LOCATION, "settings.json")
+
+    with open(filename) as fp:
+        return json.load(fp)["daemon"]["frequency"]
+
+
+def _spread(field, every, span, salt):
+    """
+        _spread:
+
+        sets a crontab field to run every [every] units, shifted by this
+        host's offset
+    """
+    times = cron_times(every, span, salt)
+
+    if times is None:
+        field.every(every)
+    else:
+        field.on(*times)
+
+
 def remove_crontab_entry():
     """
         remove_crontab_entry:
@@ -219,6 +431,9 @@ def remove_crontab_entry():
 
     jobs = [x for x in tab.find_command("background_daemon.py")]
 
+    if os.path.exists(CRONTAB_FREQUENCY):
+        os.unlink(CRONTAB_FREQUENCY)
+
     if len(jobs) == 0:
         return tab
 
@@ -251,3 +466,6 @@ def _is_crontab_populated(cron):
             return True
 
     return False
+
+
+logger = logging.getLogger("bg_daemon")
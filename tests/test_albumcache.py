@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+    test_albumcache
+
+    Test suite for the album listing cache
+"""
+import shutil
+import tempfile
+import unittest
+import bg_daemon.fetchers.albumcache as albumcache
+
+from os.path import join
+from mock import patch
+from bg_daemon.fetchers.candidate import candidate
+
+
+class test_albumcache(unittest.TestCase):
+
+    workdir = None
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        self.filename = join(self.workdir, "albums.json")
+        self.images = [candidate("a", "http://i/a.jpg", "snow"),
+                       candidate("b", "http://i/b.jpg", "moon")]
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def test_get(self):
+        """
+        Tests storing and expanding albums
+
+        Tests for:
+            * Listings come back as equal records, after a reload too
+            * Unknown albums and model objects aren't cached
+            * Listings expire after the ttl
+        """
+        cache = albumcache.album_cache(self.filename, ttl=100)
+        self.assertTrue(cache.get("album") is None)
+
+        cache.put("album", self.images)
+        cache.put("models", [object()])
+
+        cache = albumcache.album_cache(self.filename, ttl=100)
+        self.assertEquals(cache.get("album"), self.images)
+        self.assertTrue(cache.get("models") is None)
+
+        later = albumcache.time.time() + 101
+        with patch("bg_daemon.fetchers.albumcache.time.time") as mock_time:
+            mock_time.return_value = later
+            self.assertTrue(cache.get("album") is None)
+
+    def test_eviction(self):
+        """
+        Tests the size bound
+
+        Tests for:
+            * The least recently used album is dropped first
+            * The order of the hits is kept across runs (processes)
+            * A hit on the most recently used album doesn't write the cache
+        """
+        cache = albumcache.album_cache(self.filename, max_entries=2)
+        cache.put("first", self.images)
+        cache.put("second", self.images)
+
+        with patch.object(cache, "_save") as save:
+            cache.get("second")
+            cache.get("flibble")
+            self.assertFalse(save.called)
+
+        cache = albumcache.album_cache(self.filename, max_entries=2)
+        cache.get("first")
+
+        cache = albumcache.album_cache(self.filename, max_entries=2)
+        cache.put("third", self.images)
+
+        cache = albumcache.album_cache(self.filename, max_entries=2)
+        self.assertTrue(cache.get("second") is None)
+        self.assertEquals(cache.get("first"), self.images)
+        self.assertEquals(cache.get("third"), self.images)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+    test_archive
+
+    Test suite for the cold archive of old backups
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import bg_daemon.archive as archive
+
+from os.path import join
+
+
+class test_archive(unittest.TestCase):
+
+    workdir = None
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def archive(self, **kwargs):
+
+        return archive.cold_archive(join(self.workdir, "archive.pack"),
+                                    join(self.workdir, "archive.json"),
+                                    **kwargs)
+
+    def write(self, name, data):
+
+        filename = join(self.workdir, name)
+        with open(filename, "wb") as fp:
+            fp.write(data)
+        return filename
+
+    def test_restore(self):
+        """
+        Tests archiving and restoring images
+
+        Tests for:
+            * Images are packed in a single container
+            * Images are restored by digest, after reloading the index
+            * Unknown digests restore nothing
+        """
+        cold = self.archive()
+        self.assertTrue(cold.add(self.write("bg-aaaa.jpg", "flibble"),
+                                 "aaaa"))
+        self.assertTrue(cold.add(self.write("bg-bbbb.jpg", "flobble!"),
+                                 "bbbb"))
+        self.assertEquals(os.path.getsize(join(self.workdir, "archive.pack")),
+                          len("flibble") + len("flobble!"))
+
+        cold = self.archive()
+        self.assertEquals(set(cold.digests()), set(["aaaa", "bbbb"]))
+
+        destination = join(self.workdir, "restored.jpg")
+        self.assertEquals(cold.restore("bbbb", destination), "bg-bbbb.jpg")
+        with open(destination, "rb") as fp:
+            self.assertEquals(fp.read(), "flobble!")
+
+        self.assertTrue(cold.restore("cccc", destination) is None)
+
+    def test_shrink(self):
+        """
+        Tests downscaling images on their way to the archive
+
+        Tests for:
+            * Big images are downscaled to fit in max_width x max_height
+            * They keep their format, and their name
+            * Small images are kept as they are
+        """
+        if archive.Image is None:
+            raise unittest.SkipTest("PIL is not installed")
+
+        big = join(self.workdir, "bg-aaaa.png")
+        archive.Image.new("RGB", (400, 200), (10, 20, 30)).save(big)
+        small = join(self.workdir, "bg-bbbb.png")
+        archive.Image.new("RGB", (40, 20), (10, 20, 30)).save(small)
+
+        cold = self.archive(max_width=100, max_height=100)
+        cold.add(big, "aaaa")
+        cold.add(small, "bbbb")
+
+        destination = join(self.workdir, "restored")
+        self.assertEquals(cold.restore("aaaa", destination), "bg-aaaa.png")
+        restored = archive.Image.open(destination)
+        self.assertEquals(restored.size, (100, 50))
+        self.assertEquals(restored.format, "PNG")
+
+        photo = join(self.workdir, "bg-cccc.jpg")
+        archive.Image.new("RGB", (400, 200), (10, 20, 30)).save(photo)
+        cold.add(photo, "cccc")
+        self.assertEquals(cold.restore("cccc", destination), "bg-cccc.jpg")
+        restored = archive.Image.open(destination)
+        self.assertEquals(restored.size, (100, 50))
+        self.assertEquals(restored.format, "JPEG")
+
+        self.assertEquals(cold.restore("bbbb", destination), "bg-bbbb.png")
+        self.assertEquals(archive.Image.open(destination).size, (40, 20))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,555 @@
+#!/usr/bin/env python
+"""
+    test_background_daemon
+
+    Test suite for the background daemon, it runs updates with a fake
+    fetcher against a target and a bg_daemon home in a temporary directory.
+"""
+import os
+import json
+import shutil
+import time
+import tempfile
+import threading
+import unittest
+import bg_daemon.background_daemon as background_daemon
+
+from os.path import join
+from mock import patch
+
+
+class fake_image:
+
+    def __init__(self, link):
+
+        self.link = link
+
+
+class fake_fetcher:
+    """
+        Returns the queued links and "downloads" their link as content. A
+        link in "broken" fails after writing half of it (and resumes the
+        next time), a link in "missing" fails without writing anything
+    """
+    def __init__(self, links, broken=(), missing=()):
+
+        self.links = list(links)
+        self.broken = set(broken)
+        self.missing = missing
+        self.stats = {}
+        self.fetched = []
+        self.installed = []
+        self.used = [0, 0]
+
+        # fetching "gated" waits for "gate", "started" tells it's waiting
+        self.gated = None
+        self.gate = threading.Event()
+        self.started = threading.Event()
+
+    def query(self):
+
+        self.stats = {"pages": 1, "bytes": 0}
+        self.used[1] += 1
+        if not self.links:
+            return None
+
+        link = self.links.pop(0)
+        return fake_image(link) if link is not None else None
+
+    def fetch(self, image, filename):
+
+        if image.link in self.missing:
+            raise IOError("404 Not Found")
+
+        if image.link == self.gated:
+            self.started.set()
+            self.gate.wait(5)
+
+        resume = "{}.resume".format(filename)
+        if os.path.exists(resume):
+            with open(filename, "ab") as fp:
+                fp.write(image.link[2:])
+            os.unlink(resume)
+
+        else:
+            with open(filename, "wb") as fp:
+                if image.link in self.broken:
+                    self.broken.remove(image.link)
+                    fp.write(image.link[:2])
+                    with open(resume, "wt") as state:
+                        json.dump({"link": image.link,
+                                   "validator": "1234"}, state)
+                    raise IOError("connection reset")
+                fp.write(image.link)
+
+        self.stats["bytes"] += len(image.link)
+        self.used[0] += len(image.link)
+        self.fetched.append(image.link)
+
+    def done(self, image):
+
+        self.installed.append(image.link)
+
+    def resumable(self, filename, image):
+
+        try:
+            with open("{}.resume".format(filename)) as fp:
+                return json.load(fp)["link"] == image.link
+        except IOError:
+            return False
+
+    def discard(self, filename):
+
+        resume = "{}.resume".format(filename)
+        if os.path.exists(resume):
+            os.unlink(resume)
+
+    def usage(self):
+
+        return tuple(self.used)
+
+    def save_info(self, image, filename):
+
+        with open(filename, "wt") as fp:
+            json.dump({"link": image.link}, fp)
+
+
+class test_background_daemon(unittest.TestCase):
+
+    workdir = None
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        self.home = join(self.workdir, "home")
+        self.backgrounds = join(self.workdir, "backgrounds")
+        self.target = join(self.backgrounds, "bg.jpg")
+        os.mkdir(self.home)
+        os.mkdir(self.backgrounds)
+
+        self.patcher = patch("bg_daemon.background_daemon.HOME", self.home)
+        self.patcher.start()
+
+    def tearDown(self):
+
+        self.patcher.stop()
+        shutil.rmtree(self.workdir)
+
+    def daemon(self, links=(), **settings):
+        """
+        Builds a daemon from a settings file, with a fake fetcher
+        """
+        filename = self.write_settings(**settings)
+        daemon = background_daemon.background_daemon(filename)
+        daemon.fetcher = fake_fetcher(links, settings.get("broken", ()),
+                                      settings.get("missing", ()))
+        return daemon
+
+    def write_settings(self, **settings):
+
+        data = {"frequency": 60, "retries": 2, "slack": 0,
+                "target": self.target, "backup": "yes",
+                "update_hook": None, "env": None,
+                "info_file": join(self.home, "info.json"),
+                "journal_file": join(self.home, "journal.jsonl")}
+        data.update(settings)
+
+        filename = join(self.home, "settings.json")
+        with open(filename, "wt") as fp:
+            json.dump({"daemon": data}, fp)
+
+        return filename
+
+    def due(self):
+        """
+        Makes an update due
+        """
+        with open(join(self.home, "timestamp"), "wt") as fp:
+            fp.write("1")
+
+    def read(self, filename):
+
+        with open(filename) as fp:
+            return fp.read()
+
+    def test_offline_fallback(self):
+        """
+        Tests the rotation through the local pool when we are offline
+
+        Tests for:
+            * the fetcher isn't used, a pool image becomes the target
+            * a leftover partial download doesn't break the rotation and
+              is kept to be resumed
+            * an empty pool leaves the target alone
+        """
+        daemon = self.daemon(["http://example.com/a.jpg"],
+                             offline_fallback=True)
+
+        os.mkdir(join(self.home, "pool"))
+        with open(join(self.home, "pool", "lake.jpg"), "wb") as fp:
+            fp.write("lake")
+
+        partial = join(self.backgrounds, ".bg.jpg.part")
+        with open(partial, "wb") as fp:
+            fp.write("half")
+
+        record = background_daemon.journal.run_record()
+        with patch("bg_daemon.background_daemon.is_online",
+                   return_value=False):
+            self.assertTrue(daemon.update(record))
+
+        self.assertEqual(record.data["outcome"], "fallback")
+        self.assertEqual(self.read(self.target), "lake")
+        self.assertEqual(self.read(partial), "half")
+        self.assertEqual(daemon.fetcher.fetched, [])
+
+        os.unlink(join(self.home, "pool", "lake.jpg"))
+        os.unlink(self.target)
+        record = background_daemon.journal.run_record()
+        with patch("bg_daemon.background_daemon.is_online",
+                   return_value=False):
+            self.assertEqual(daemon.update(record), None)
+
+        self.assertEqual(record.data["outcome"], "offline")
+        self.assertFalse(os.path.exists(self.target))
+
+    def test_install(self):
+        """
+        Tests installing a prepared image over the target
+
+        Tests for:
+            * the old target is backed up as a hardlink, without copying
+            * the prepared image replaces the target
+            * a target that's linked elsewhere (e.g., from the pool) isn't
+              backed up again
+        """
+        daemon = self.daemon()
+        daemon.target = self.target
+
+        with open(self.target, "wb") as fp:
+            fp.write("old")
+        inode = os.stat(self.target).st_ino
+
+        partial = daemon._partial_filename()
+        with open(partial, "wb") as fp:
+            fp.write("new")
+
+        daemon._install(partial)
+        self.assertEqual(self.read(self.target), "new")
+        self.assertFalse(os.path.exists(partial))
+
+        backups = background_daemon.list_backups(self.target)
+        self.assertEqual(len(backups), 1)
+        self.assertEqual(self.read(backups[0][1]), "old")
+        self.assertEqual(os.stat(backups[0][1]).st_ino, inode)
+
+        pooled = join(self.workdir, "pooled.jpg")
+        os.link(self.target, pooled)
+        with open(partial, "wb") as fp:
+            fp.write("newer")
+
+        daemon._install(partial)
+        self.assertEqual(self.read(self.target), "newer")
+        self.assertEqual(len(background_daemon.list_backups(self.target)), 1)
+        self.assertEqual(self.read(pooled), "new")
+
+    def test_interrupted_download(self):
+        """
+        Tests what's kept of a failed download
+
+        Tests for:
+            * a download that was cut short is resumed by the next attempt
+            * a stale partial of another image is dropped when the fetch
+              fails before writing anything, there's nothing to resume
+        """
+        daemon = self.daemon(["http://example.com/a.jpg"],
+                             broken=["http://example.com/a.jpg"])
+
+        record = background_daemon.journal.run_record()
+        self.assertTrue(daemon.update(record))
+        self.assertEqual(record.data["outcome"], "updated")
+        self.assertEqual(self.read(self.target), "http://example.com/a.jpg")
+        self.assertEqual(daemon.fetcher.fetched, ["http://example.com/a.jpg"])
+
+        partial = join(self.backgrounds, ".bg.jpg.part")
+        with open(partial, "wb") as fp:
+            fp.write("old bytes")
+        with open("{}.resume".format(partial), "wt") as fp:
+            json.dump({"link": "http://example.com/old.jpg",
+                       "validator": "1234"}, fp)
+
+        daemon = self.daemon(["http://example.com/gone.jpg"],
+                             missing=["http://example.com/gone.jpg"])
+        record = background_daemon.journal.run_record()
+        self.assertFalse(daemon.update(record))
+
+        self.assertEqual(record.data["outcome"], "fetch_failed")
+        self.assertFalse(os.path.exists(partial))
+        self.assertFalse(os.path.exists("{}.resume".format(partial)))
+        self.assertEqual(self.read(self.target), "http://example.com/a.jpg")
+
+    def test_caught_up(self):
+        """
+        Tests the end of an incremental walk
+
+        Tests for:
+            * the fetcher is told what was installed, not what failed
+            * nothing new ends the update without waiting to retry
+        """
+        a, b = "http://example.com/a.jpg", "http://example.com/b.jpg"
+        daemon = self.daemon([a, b], missing=[a], slack=60)
+
+        with patch("bg_daemon.background_daemon.time.sleep") as sleep:
+            record = background_daemon.journal.run_record()
+            self.assertFalse(daemon.update(record))
+            self.assertEqual(daemon.fetcher.installed, [])
+
+            record = background_daemon.journal.run_record()
+            self.assertTrue(daemon.update(record))
+            self.assertEqual(daemon.fetcher.installed, [b])
+
+            daemon.fetcher.stats = {"caught_up": True}
+            daemon.fetcher.query = lambda: None
+            record = background_daemon.journal.run_record()
+            self.assertEqual(daemon.update(record), None)
+
+            self.assertEqual(record.data["outcome"], "caught_up")
+            self.assertEqual(record.data["attempts"], 1)
+            self.assertEqual(sleep.call_count, 0)
+
+    def test_budget(self):
+        """
+        Tests the accounting of an update in the budget
+
+        Tests for:
+            * every attempt is charged, not only the last one
+            * an exhausted budget without a pool doesn't fetch anything
+        """
+        link = "http://example.com/a.jpg"
+        daemon = self.daemon([None, link],
+                             budget={"calls_per_day": 4,
+                                     "bytes_per_day": 1000})
+
+        record = background_daemon.journal.run_record()
+        self.assertTrue(daemon.update(record))
+        self.assertEqual(record.data["pages"], 1)
+
+        daemon = self.daemon([link], budget={"calls_per_day": 4,
+                                             "bytes_per_day": 1000})
+        self.assertEqual(daemon.budget.used(), 0.5)
+
+        daemon.budget.record(0, 2)
+        record = background_daemon.journal.run_record()
+        self.assertEqual(daemon.update(record), None)
+        self.assertEqual(record.data["outcome"], "over_budget")
+        self.assertEqual(daemon.fetcher.fetched, [])
+
+    def test_next_and_skip(self):
+        """
+        Tests the next and skip commands of the control socket
+
+        Tests for:
+            * next promotes the oldest prefetched image
+            * skip changes the image, doesn't back it up and remembers it
+            * a skipped image that's fetched again is dropped
+            * skipped images are remembered across restarts
+        """
+        a, b, c = ["http://example.com/{}.jpg".format(name)
+                   for name in "abc"]
+        daemon = self.daemon([a, b], prefetch=2)
+        self.assertTrue(daemon._prefetch())
+        self.assertTrue(daemon._prefetch())
+        self.assertFalse(daemon._prefetch())
+
+        self.due()
+        reply = daemon.next_image()
+        self.assertEqual(reply["outcome"], "prefetched")
+        self.assertEqual(self.read(self.target), a)
+        self.assertEqual(daemon.status()["queue"], 1)
+        self.assertEqual(daemon.status()["current"], a)
+
+        reply = daemon.skip_image()
+        self.assertEqual(reply["skipped"], a)
+        self.assertEqual(reply["outcome"], "prefetched")
+        self.assertEqual(self.read(self.target), b)
+        self.assertEqual(background_daemon.list_backups(self.target), [])
+
+        daemon.fetcher.links = [a, c]
+        reply = daemon.next_image()
+        self.assertEqual(reply["outcome"], "updated")
+        self.assertEqual(self.read(self.target), c)
+        self.assertEqual(daemon.fetcher.fetched, [a, b, c])
+
+        self.assertEqual(self.daemon()._skipped_links(), [a])
+
+    def test_next_during_prefetch(self):
+        """
+        Tests that next doesn't wait for a prefetch
+
+        Tests for:
+            * a queued image is promoted while another one downloads
+            * the download still makes it to the queue
+        """
+        a, b = "http://example.com/a.jpg", "http://example.com/b.jpg"
+        daemon = self.daemon([a, b], prefetch=2)
+        daemon._prefetch()
+
+        daemon.fetcher.gated = b
+        prefetch = threading.Thread(target=daemon._prefetch)
+        prefetch.start()
+        self.assertTrue(daemon.fetcher.started.wait(5))
+
+        self.due()
+        start = time.time()
+        reply = daemon.next_image()
+        elapsed = time.time() - start
+
+        daemon.fetcher.gate.set()
+        prefetch.join(5)
+
+        self.assertEqual(reply["outcome"], "prefetched")
+        self.assertTrue(elapsed < 1)
+        self.assertEqual(self.read(self.target), a)
+        self.assertEqual(daemon.status()["queue"], 1)
+
+    def test_daemon_errors(self):
+        """
+        Tests that daemon mode outlives a failed update
+
+        Tests for:
+            * the error is journaled and the daemon waits before polling
+              again
+            * the update that's still due is made by the next poll
+        """
+        link = "http://example.com/a.jpg"
+        daemon = self.daemon([link],
+                             control_socket=join(self.home, "control.sock"))
+        query = daemon.fetcher.query
+        failures = [IOError("dns failure")]
+
+        def failing():
+            if failures:
+                raise failures.pop()
+            return query()
+
+        daemon.fetcher.query = failing
+        self.due()
+
+        waits = []
+
+        def sleep(seconds):
+            waits.append(seconds)
+            if len(waits) > 1:
+                raise KeyboardInterrupt()
+
+        with patch("bg_daemon.background_daemon.time.sleep",
+                   side_effect=sleep):
+            self.assertTrue(daemon.daemon())
+
+        self.assertEqual(waits[0], background_daemon.DAEMON_ERROR_WAIT)
+        self.assertEqual(self.read(self.target), link)
+
+        with open(join(self.home, "journal.jsonl")) as fp:
+            outcomes = [json.loads(line)["outcome"] for line in fp]
+        self.assertEqual(outcomes, ["error", "updated"])
+
+    def test_weekly_cron(self):
+        """
+        Tests the next update of a frequency longer than a day, from cron
+
+        Tests for:
+            * the daily runs of the entry in between aren't due
+        """
+        daemon = self.daemon(frequency=604800)
+        marker = join(self.home, "crontab")
+        with open(marker, "wt") as fp:
+            fp.write("604800")
+
+        with patch("bg_daemon.background_daemon.CRONTAB_FREQUENCY", marker):
+            when = float(daemon._next_timestamp())
+
+        self.assertTrue(6.5 * 86400 < when - time.time() < 7.5 * 86400)
+
+    def test_reload(self):
+        """
+        Tests the reload command of the control socket
+
+        Tests for:
+            * new settings are used
+            * removed settings go back to their defaults
+            * the locks and the last run are kept
+        """
+        daemon = self.daemon(budget={"calls_per_day": 10}, frequency=60)
+        commands = daemon._commands
+        self.due()
+        daemon.next_image()
+        last_run = daemon._last_run
+
+        self.write_settings(frequency=120)
+        self.assertEqual(daemon.reload(), {"settings": daemon.settings_file})
+
+        self.assertEqual(daemon.frequency, 120)
+        self.assertEqual(daemon.budget, None)
+        self.assertTrue(daemon._commands is commands)
+        self.assertTrue(daemon._last_run is last_run)
+
+    def test_prefetch(self):
+        """
+        Tests the prefetch queue
+
+        Tests for:
+            * nothing is queued when prefetch is off
+            * a full queue doesn't fetch anything
+            * promoting an image installs it and keeps its information
+        """
+        a, b = "http://example.com/a.jpg", "http://example.com/b.jpg"
+        daemon = self.daemon([a, b])
+        self.assertFalse(daemon._prefetch())
+        self.assertFalse(daemon._prefetch_due())
+
+        daemon = self.daemon([a, b], prefetch=1)
+        self.assertTrue(daemon._prefetch())
+        self.assertFalse(daemon._prefetch())
+        self.assertEqual(daemon.fetcher.fetched, [a])
+        self.assertEqual(len(daemon._prefetched()), 1)
+
+        record = background_daemon.journal.run_record()
+        self.assertTrue(daemon._promote_prefetched(record))
+        self.assertEqual(record.data["outcome"], "prefetched")
+        self.assertEqual(self.read(self.target), a)
+        self.assertEqual(json.loads(self.read(join(self.home, "info.json"))),
+                         {"link": a})
+        self.assertEqual(os.listdir(join(self.home, "prefetch")), [])
+
+        record = background_daemon.journal.run_record()
+        self.assertFalse(daemon._promote_prefetched(record))
+
+    def test_prefetch_due(self):
+        """
+        Tests when prefetching happens
+
+        Tests for:
+            * once per idle window, at its idle point
+            * a new window gets a new idle point
+        """
+        daemon = self.daemon(prefetch=1)
+
+        with patch.object(daemon, "_next_poll", return_value=2000), \
+                patch("bg_daemon.background_daemon.idle_point",
+                      return_value=1500), \
+                patch("bg_daemon.background_daemon.time") as clock:
+            clock.time.return_value = 1000
+            self.assertFalse(daemon._prefetch_due())
+            clock.time.return_value = 1500
+            self.assertTrue(daemon._prefetch_due())
+            clock.time.return_value = 1600
+            self.assertFalse(daemon._prefetch_due())
+
+        with patch.object(daemon, "_next_poll", return_value=3000), \
+                patch("bg_daemon.background_daemon.idle_point",
+                      return_value=2500), \
+                patch("bg_daemon.background_daemon.time") as clock:
+            clock.time.return_value = 2100
+            self.assertFalse(daemon._prefetch_due())
+            clock.time.return_value = 2600
+            self.assertTrue(daemon._prefetch_due())
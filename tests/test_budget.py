@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+    test_budget
+
+    Test suite for the bandwidth and API call budget
+"""
+import shutil
+import tempfile
+import unittest
+import bg_daemon.budget as budget
+
+from os.path import join, dirname, abspath
+from mock import patch
+from bg_daemon.fetchers.imgurfetcher import imgurfetcher, _variant
+
+
+class test_budget(unittest.TestCase):
+
+    workdir = None
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        self.filename = join(self.workdir, "budget.json")
+        self.limits = {"bytes_per_hour": 1000, "calls_per_day": 10}
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def test_thresholds(self):
+        """
+        Tests when we should be thrifty and when we should stop
+
+        Tests for:
+            * Nothing used, not thrifty nor exhausted
+            * The largest fraction of any limit counts
+            * Past the threshold it's thrifty, at the limit it's exhausted
+        """
+        usage = budget.usage_budget(self.filename, self.limits, 0.8)
+        self.assertEqual(usage.used(), 0)
+        self.assertFalse(usage.thrifty())
+        self.assertFalse(usage.exhausted())
+
+        usage.record(bytes=500, calls=1)
+        self.assertEqual(usage.used(), 0.5)
+        self.assertFalse(usage.thrifty())
+
+        usage.record(bytes=0, calls=7)
+        self.assertEqual(usage.used(), 0.8)
+        self.assertTrue(usage.thrifty())
+        self.assertFalse(usage.exhausted())
+
+        usage.record(bytes=600)
+        self.assertTrue(usage.exhausted())
+
+    def test_windows(self):
+        """
+        Tests the hourly and daily windows
+
+        Tests for:
+            * Counters start over with the next window
+            * The daily counter outlives the hourly one
+        """
+        now = 86400 * 100 + 60
+        with patch("bg_daemon.budget.time.time", return_value=now):
+            usage = budget.usage_budget(self.filename, self.limits)
+            usage.record(bytes=1000, calls=5)
+            self.assertTrue(usage.exhausted())
+
+        with patch("bg_daemon.budget.time.time", return_value=now + 3600):
+            self.assertFalse(usage.exhausted())
+            self.assertEqual(usage.used(), 0.5)
+
+        with patch("bg_daemon.budget.time.time", return_value=now + 86400):
+            self.assertEqual(usage.used(), 0)
+
+    def test_persistence(self):
+        """
+        Tests the counters file
+
+        Tests for:
+            * The counters survive a restart
+            * No limits, nothing is ever exhausted
+        """
+        usage = budget.usage_budget(self.filename, self.limits)
+        usage.record(bytes=900, calls=2)
+
+        usage = budget.usage_budget(self.filename, self.limits)
+        self.assertEqual(usage.used(), 0.9)
+
+        usage = budget.usage_budget(self.filename, {})
+        self.assertEqual(usage.used(), 0)
+        self.assertFalse(usage.exhausted())
+
+    def test_variant(self):
+        """
+        Tests the smaller images used in thrifty mode
+
+        Tests for:
+            * imgur images get the thumbnail suffix
+            * Anything else is left alone
+        """
+        self.assertEqual(_variant("https://i.imgur.com/abc.jpg", "h"),
+                         "https://i.imgur.com/abch.jpg")
+        self.assertEqual(_variant("https://i.imgur.com/abc.gif", "h"),
+                         "https://i.imgur.com/abc.gif")
+        self.assertEqual(_variant("https://example.com/abc.jpg", "h"),
+                         "https://example.com/abc.jpg")
+
+    def test_fetcher_usage(self):
+        """
+        Tests the running total the budget is charged from
+
+        Tests for:
+            * the usage of earlier queries is kept when the stats are reset
+            * it includes what the current query spent so far
+        """
+        fetcher = imgurfetcher(join(dirname(abspath(__file__)),
+                                    "settings.json"))
+        self.assertEqual(fetcher.usage(), (0, 0))
+
+        fetcher.stats['pages'] += 2
+        fetcher.stats['bytes'] += 100
+        fetcher._reset_stats()
+        fetcher.stats['pages'] += 1
+        fetcher.stats['bytes'] += 50
+
+        self.assertEqual(fetcher.usage(), (150, 3))
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+    test_cache
+
+    Test suite for the shared download cache
+"""
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import bg_daemon.cache as cache
+
+from os.path import join
+
+LINK = "http://i.imgur.com/flibble.jpg"
+
+
+class test_cache(unittest.TestCase):
+
+    workdir = None
+    cache = None
+    downloads = None
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        os.mkdir(join(self.workdir, "cache"))
+        self.cache = cache.shared_cache(join(self.workdir, "cache"),
+                                        max_bytes=150, timeout=1)
+        self.downloads = []
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def _download(self, link, destination):
+
+        self.downloads.append(link)
+        with open(destination, "wb") as fp:
+            fp.write(link)
+
+    def test_fetch(self):
+        """
+        Tests that images are downloaded once and then served from the cache
+
+        Tests for:
+            * A miss downloads and publishes the image
+            * A hit doesn't download anything
+            * Cached entries are readable by everyone
+        """
+        first = join(self.workdir, "first.jpg")
+        second = join(self.workdir, "second.jpg")
+
+        self.cache.fetch(LINK, first, self._download)
+        self.cache.fetch(LINK, second, self._download)
+
+        self.assertEquals(self.downloads, [LINK])
+        with open(second) as fp:
+            self.assertEquals(fp.read(), LINK)
+
+        entry = self.cache._entry(LINK)
+        self.assertEquals(os.stat(entry).st_mode & 0777, 0644)
+
+    def test_evict(self):
+        """
+        Tests the LRU eviction
+
+        Tests for:
+            * The least recently used entries go first
+            * A hit refreshes an entry
+        """
+        links = ["http://i.imgur.com/{}.jpg".format("x" * 30 + str(i))
+                 for i in range(3)]
+
+        for i, link in enumerate(links[:2]):
+            self.cache.fetch(link, join(self.workdir, "{}.jpg".format(i)),
+                             self._download)
+            os.utime(self.cache._entry(link), (i, i))
+
+        # the oldest entry gets a hit, so the second one is evicted next
+        self.assertTrue(self.cache.get(links[0], join(self.workdir, "hit")))
+        self.cache.fetch(links[2], join(self.workdir, "2.jpg"),
+                         self._download)
+
+        self.assertTrue(os.path.exists(self.cache._entry(links[0])))
+        self.assertFalse(os.path.exists(self.cache._entry(links[1])))
+        self.assertTrue(os.path.exists(self.cache._entry(links[2])))
+
+    def test_locks(self):
+        """
+        Tests the lock files of the entries
+
+        Tests for:
+            * Entries share a fixed set of lock files
+            * A link always uses the same one
+        """
+        for i in range(200):
+            link = "http://i.imgur.com/{}.jpg".format(i)
+            self.cache.fetch(link, join(self.workdir, "{}.jpg".format(i)),
+                             self._download)
+
+        locks = [name for name in os.listdir(join(self.workdir, "cache"))
+                 if name.endswith(".lock")]
+        self.assertTrue(0 < len(locks) <= cache._LOCK_SLOTS)
+        self.assertEquals(self.cache._lock_filename(LINK),
+                          self.cache._lock_filename(LINK))
+
+if __name__ == '__main__':
+    unittest.main()
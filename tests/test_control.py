@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+    test_control
+
+    Test suite for the control socket of daemon mode, it runs a server on a
+    socket in a temporary directory.
+"""
+import os
+import socket
+import shutil
+import tempfile
+import unittest
+import bg_daemon.control as control
+
+from os.path import join
+
+
+class test_control(unittest.TestCase):
+
+    workdir = None
+    server = None
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        self.path = join(self.workdir, "control.sock")
+        self.calls = []
+
+        def next_image():
+            self.calls.append("next")
+            return {"outcome": "prefetched"}
+
+        def broken():
+            raise ValueError("no settings")
+
+        self.server = control.control_server(self.path,
+                                             {"next": next_image,
+                                              "status": lambda: None,
+                                              "reload": broken})
+        self.server.start()
+
+    def tearDown(self):
+
+        if self.server is not None:
+            self.server.shutdown()
+        shutil.rmtree(self.workdir)
+
+    def test_commands(self):
+        """
+        Tests that commands reach their handlers
+
+        Tests for:
+            * Commands run their handler and send back its reply
+            * Handlers without a reply still answer ok
+        """
+        reply = control.send(self.path, "next", 5)
+        self.assertEqual(reply, {"ok": True, "outcome": "prefetched"})
+        self.assertEqual(self.calls, ["next"])
+
+        self.assertEqual(control.send(self.path, "status", 5), {"ok": True})
+
+    def test_errors(self):
+        """
+        Tests the replies to bad commands
+
+        Tests for:
+            * Unknown commands and failing handlers answer with an error
+        """
+        reply = control.send(self.path, "dance", 5)
+        self.assertFalse(reply["ok"])
+        self.assertTrue("dance" in reply["error"])
+
+        reply = control.send(self.path, "reload", 5)
+        self.assertEqual(reply, {"ok": False, "error": "no settings"})
+
+    def test_lifecycle(self):
+        """
+        Tests the socket file
+
+        Tests for:
+            * Only the user can use the socket
+            * It's removed on shutdown and nobody answers anymore
+            * A leftover socket doesn't keep a new server from starting
+        """
+        self.assertEqual(os.stat(self.path).st_mode & 0777, 0600)
+
+        self.server.shutdown()
+        self.server = None
+        self.assertFalse(os.path.exists(self.path))
+        self.assertRaises(socket.error, control.send, self.path, "next", 5)
+
+        with open(self.path, "w") as fp:
+            fp.write("leftover")
+
+        self.server = control.control_server(self.path, {})
+        self.server.start()
+        self.assertFalse(control.send(self.path, "next", 5)["ok"])
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+    test_cursor
+
+    Test suite for the recent mode high-water mark
+"""
+import shutil
+import tempfile
+import unittest
+import bg_daemon.fetchers.cursor as cursor
+
+from os.path import join
+
+
+class post:
+
+    def __init__(self, id, datetime):
+
+        self.id = id
+        self.datetime = datetime
+
+
+class test_cursor(unittest.TestCase):
+
+    workdir = None
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        self.filename = join(self.workdir, "cursor.json")
+
+        # a page, newest first
+        self.page = [post("e", 50), post("d", 40), post("c", 40),
+                     post("b", 30), post("a", 20)]
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def ids(self, items):
+
+        return [item.id for item in items]
+
+    def test_walk(self):
+        """
+        Tests walking forward through the posts
+
+        Tests for:
+            * Without a mark, everything is unseen, oldest first
+            * Advancing hides what we went through, even across restarts
+            * Posts on the same second as the mark are told apart by id
+            * Newer posts show up after the mark
+            * Posts without a date are always kept
+        """
+        marks = cursor.recent_cursor(self.filename)
+        self.assertEquals(self.ids(marks.unseen("q", self.page)),
+                          ["a", "b", "d", "c", "e"])
+
+        marks.advance("q", [self.page[4], self.page[3], self.page[1]])
+
+        marks = cursor.recent_cursor(self.filename)
+        self.assertEquals(self.ids(marks.unseen("q", self.page)), ["c", "e"])
+        self.assertEquals(self.ids(marks.unseen("other", self.page)),
+                          ["a", "b", "d", "c", "e"])
+
+        marks.advance("q", [self.page[2], self.page[0]])
+        self.assertEquals(marks.unseen("q", self.page), [])
+
+        newer = [post("f", 60), post(None, None)] + self.page
+        self.assertEquals(self.ids(marks.unseen("q", newer)), ["f", None])
+
+        # advancing with older posts doesn't move the mark back
+        marks.advance("q", [self.page[4]])
+        self.assertEquals(self.ids(marks.unseen("q", newer)), ["f", None])
+
+
+if __name__ == "__main__":
+    unittest.main()
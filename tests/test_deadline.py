@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+    test_deadline
+
+    Test suite for the update deadline
+"""
+import unittest
+import bg_daemon.deadline as deadline
+
+from mock import patch
+
+
+class test_deadline(unittest.TestCase):
+
+    def test_timeout(self):
+        """
+        Tests how the budget is split across the phases
+
+        Tests for:
+            * Each phase gets the remaining time minus what's reserved for
+              the phases after it
+            * Time left by a phase is passed on to the next ones
+            * A phase without time left raises deadline_exceeded
+        """
+        with patch("bg_daemon.deadline.time.time") as mock_time:
+            mock_time.return_value = 1000
+            budget = deadline.deadline(100, {"search": 0.3, "album": 0.1,
+                                             "probe": 0.1, "download": 0.4,
+                                             "hook": 0.1})
+
+            self.assertAlmostEquals(budget.timeout("search"), 30)
+            self.assertAlmostEquals(budget.timeout("download"), 90)
+            self.assertAlmostEquals(budget.timeout("hook"), 100)
+
+            mock_time.return_value = 1045
+            self.assertRaises(deadline.deadline_exceeded, budget.timeout,
+                              "search")
+            self.assertAlmostEquals(budget.timeout("download"), 45)
+
+            mock_time.return_value = 1099
+            self.assertAlmostEquals(budget.remaining(), 1)
+            self.assertAlmostEquals(budget.timeout("hook"), 1)
+
+            mock_time.return_value = 1100
+            self.assertRaises(deadline.deadline_exceeded, budget.timeout,
+                              "hook")
+
+    def test_shares(self):
+        """
+        Tests the default shares
+
+        Tests for:
+            * Every phase has a share, and they add up to the whole budget
+            * Settings only need to override some of them
+        """
+        self.assertEquals(set(deadline.DEFAULT_SHARES), set(deadline.PHASES))
+        self.assertAlmostEquals(sum(deadline.DEFAULT_SHARES.values()), 1)
+
+        budget = deadline.deadline(10, {"hook": 0.5})
+        self.assertEquals(budget.shares["hook"], 0.5)
+        self.assertEquals(budget.shares["search"],
+                          deadline.DEFAULT_SHARES["search"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+    test_hedgedfetcher
+
+    Test suite for the hedged fan-out over several fetchers
+"""
+import time
+import unittest
+
+from bg_daemon.fetchers.hedgedfetcher import hedgedfetcher
+
+
+class _candidate:
+
+    def __init__(self, size):
+
+        self.width = size
+        self.height = size
+
+
+class _fetcher:
+
+    def __init__(self, size, delay=0, error=None):
+
+        self.size = size
+        self.delay = delay
+        self.error = error
+        self.stats = {'examined': size}
+        self.fetched = None
+
+    def query(self):
+
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return _candidate(self.size)
+
+    def fetch(self, imgobject, filename):
+
+        self.fetched = filename
+        return True
+
+    def save_info(self, imgobject, filename):
+
+        return True
+
+
+class test_hedgedfetcher(unittest.TestCase):
+
+    def test_first(self):
+        """
+        Tests the "first" strategy
+
+        Tests for:
+            * A slow fetcher doesn't delay the update
+            * The candidate is fetched by the fetcher that found it
+            * A fetcher that is still busy isn't queried again
+        """
+        slow = _fetcher(5000, delay=1)
+        fast = _fetcher(100)
+        fetcher = hedgedfetcher([slow, fast], deadline=5)
+
+        start = time.time()
+        candidate = fetcher.query()
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertEquals(candidate.width, 100)
+        self.assertEquals(fetcher.stats['examined'], 100)
+
+        fetcher.fetch(candidate, "flibble")
+        self.assertEquals(fast.fetched, "flibble")
+        self.assertTrue(slow.fetched is None)
+
+        self.assertTrue(slow in fetcher._busy)
+        fetcher.query()
+        time.sleep(1.2)
+        self.assertTrue(slow not in fetcher._busy)
+
+    def test_best(self):
+        """
+        Tests the "best" strategy
+
+        Tests for:
+            * The largest candidate within the deadline wins
+            * Fetchers past the deadline are abandoned
+        """
+        fetcher = hedgedfetcher([_fetcher(5000, delay=0.3), _fetcher(100)],
+                                deadline=5, strategy="best")
+        self.assertEquals(fetcher.query().width, 5000)
+
+        fetcher = hedgedfetcher([_fetcher(5000, delay=2), _fetcher(100)],
+                                deadline=0.3, strategy="best")
+        start = time.time()
+        self.assertEquals(fetcher.query().width, 100)
+        self.assertTrue(time.time() - start < 1)
+
+    def test_errors(self):
+        """
+        Tests the error handling
+
+        Tests for:
+            * A failing fetcher doesn't hide the others
+            * If every fetcher fails, the error is raised
+            * Bad arguments are refused
+        """
+        fetcher = hedgedfetcher([_fetcher(0, error=IOError("flibble")),
+                                 _fetcher(100)])
+        self.assertEquals(fetcher.query().width, 100)
+
+        fetcher = hedgedfetcher([_fetcher(0, error=IOError("flibble")),
+                                 _fetcher(0, error=IOError("flibble"))])
+        self.assertRaises(IOError, fetcher.query)
+        self.assertRaises(ValueError, fetcher.fetch, None, "flibble")
+
+        self.assertRaises(ValueError, hedgedfetcher, [])
+        self.assertRaises(ValueError, hedgedfetcher, [_fetcher(0)],
+                          strategy="flibble")
+
+
+if __name__ == "__main__":
+    unittest.main()
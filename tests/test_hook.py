@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+    test_hook
+
+    Test suite for the update hook runner
+"""
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import bg_daemon.hook as hook
+
+from os.path import join
+
+
+class test_hook(unittest.TestCase):
+
+    workdir = None
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def test_run_hook(self):
+        """
+        Tests the supervised hook execution
+
+        Tests for:
+            * The return code is passed through
+            * The environment is passed to the hook without touching ours
+            * A hung hook is killed on timeout
+        """
+        self.assertEquals(hook.run_hook("true"), 0)
+        self.assertEquals(hook.run_hook("false", timeout=5), 1)
+
+        output = join(self.workdir, "env")
+        command = "sh -c 'echo $BG_TEST_VAR > {}'".format(output)
+        hook.run_hook(command, {"BG_TEST_VAR": "flibble"}, timeout=5)
+
+        with open(output) as fp:
+            self.assertEquals(fp.read().strip(), "flibble")
+        self.assertTrue("BG_TEST_VAR" not in os.environ)
+
+        start = time.time()
+        self.assertTrue(hook.run_hook("sleep 30", timeout=0.2) is None)
+        self.assertTrue(time.time() - start < 5)
+
+    def test_schedule(self):
+        """
+        Tests that scheduled hook runs are coalesced
+
+        Tests for:
+            * Many requests close to each other result in a single run
+            * Stopping the runner flushes pending requests
+        """
+        output = join(self.workdir, "runs")
+        command = "sh -c 'echo run >> {}'".format(output)
+        runner = hook.hook_runner(command, timeout=5, delay=0.3)
+
+        for i in range(5):
+            runner.schedule()
+            time.sleep(0.05)
+
+        runner.stop()
+
+        with open(output) as fp:
+            self.assertEquals(len(fp.readlines()), 1)
+
+if __name__ == '__main__':
+    unittest.main()
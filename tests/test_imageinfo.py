@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+    test_imageinfo
+
+    Test suite for the header-only image dimensions parser
+"""
+import os
+import struct
+import shutil
+import tempfile
+import unittest
+import bg_daemon.imageinfo as imageinfo
+
+from os.path import join
+
+
+def png_header(width, height):
+
+    return "\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + "IHDR" + \
+        struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+
+
+def jpeg_header(width, height, padding=0):
+
+    # an APP1 segment (like EXIF) before the frame header
+    app1 = "\xff\xe1" + struct.pack(">H", padding + 2) + "\0" * padding
+    sof = "\xff\xc0" + struct.pack(">HBHHB", 11, 8, height, width, 3)
+    return "\xff\xd8" + app1 + sof + "\0" * 9 + "\xff\xd9"
+
+
+class test_imageinfo(unittest.TestCase):
+
+    workdir = None
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def test_formats(self):
+        """
+        Tests the dimensions of each format
+
+        Tests for:
+            * PNG, GIF, BMP, JPEG and the three WebP flavours
+            * Big JPEG segments before the frame are skipped
+        """
+        size = imageinfo.dimensions_from_bytes
+        self.assertEquals(size(png_header(1920, 1080)), (1920, 1080))
+        self.assertEquals(size("GIF89a" + struct.pack("<HH", 640, 480)),
+                          (640, 480))
+        self.assertEquals(size("BM" + "\0" * 16 +
+                               struct.pack("<ii", 800, -600)), (800, 600))
+        self.assertEquals(size(jpeg_header(2560, 1440)), (2560, 1440))
+        self.assertEquals(size(jpeg_header(2560, 1440, padding=60000)),
+                          (2560, 1440))
+
+        riff = "RIFF" + struct.pack("<I", 100) + "WEBP"
+        lossy = riff + "VP8 " + "\0" * 10 + struct.pack("<HH", 1024, 768)
+        self.assertEquals(size(lossy), (1024, 768))
+
+        bits = (1023) | (767 << 14)
+        lossless = riff + "VP8L" + "\0" * 4 + "\x2f" + struct.pack("<I", bits)
+        self.assertEquals(size(lossless), (1024, 768))
+
+        extended = riff + "VP8X" + "\0" * 8 + \
+            struct.pack("<I", 4095)[:3] + struct.pack("<I", 2159)[:3]
+        self.assertEquals(size(extended), (4096, 2160))
+
+    def test_incomplete(self):
+        """
+        Tests broken and incomplete headers
+
+        Tests for:
+            * Unknown formats and truncated headers return None
+            * Missing files return None
+            * Files are read from disk
+        """
+        size = imageinfo.dimensions_from_bytes
+        self.assertTrue(size("flibble") is None)
+        self.assertTrue(size("") is None)
+        self.assertTrue(size(png_header(10, 10)[:20]) is None)
+        self.assertTrue(size(jpeg_header(10, 10, padding=6000)[:4096]) is None)
+
+        self.assertTrue(imageinfo.file_dimensions(join(self.workdir, "no"))
+                        is None)
+
+        filename = join(self.workdir, "image.jpg")
+        with open(filename, "wb") as fp:
+            fp.write(jpeg_header(300, 200, padding=100))
+        self.assertEquals(imageinfo.file_dimensions(filename), (300, 200))
+        self.assertTrue(os.path.exists(filename))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,7 +8,12 @@ import unittest
 import bg_daemon.fetchers.imgurfetcher as imgurfetcher
 import requests
 import imgurpython
+import os
+import json
 import random
+import shutil
+import struct
+import tempfile
 
 from os.path import dirname, abspath, join
 from mock import patch, mock_open, Mock
@@ -91,6 +96,8 @@ class test_imgurfetcher(unittest.TestCase):
         # we monkeypatch the iter content method
         self.fake_response = Mock(spec=requests.Response)
         self.fake_response.iter_content = fake_iter_content
+        self.fake_response.status_code = 200
+        self.fake_response.headers = {}
 
     def test_build_query(self):
         """
@@ -221,7 +228,7 @@ class test_imgurfetcher(unittest.TestCase):
                                              self.good_image])
         self.assertEquals(result, self.good_image)
 
-        with patch("bg_daemon.fetchers.imgurfetcher.ImgurClient") as \
+        with patch("bg_daemon.fetchers.imgurfetcher.timed_client") as \
                 mock_class:
 
             mock_method = mock_class.return_value.get_album_images
@@ -277,7 +284,7 @@ class test_imgurfetcher(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.fetcher._get_image_from_album(self.gallery[0])
 
-        with patch("bg_daemon.fetchers.imgurfetcher.ImgurClient") as \
+        with patch("bg_daemon.fetchers.imgurfetcher.timed_client") as \
                 mock_class:
 
             mock_method = mock_class.return_value.get_album_images
@@ -342,7 +349,7 @@ class test_imgurfetcher(unittest.TestCase):
             * That imgurpython returns something valid and is properly
               selected.
         """
-        with patch("bg_daemon.fetchers.imgurfetcher.ImgurClient") as \
+        with patch("bg_daemon.fetchers.imgurfetcher.timed_client") as \
                 mock_class:
 
             mock_method = mock_class.return_value.gallery_search
@@ -365,6 +372,111 @@ class test_imgurfetcher(unittest.TestCase):
             self.assertEquals(result, self.good_image)
             mock_method.assert_called_once()
 
+    def test_advanced_search(self):
+        """
+        Tests the filters sent to imgur's advanced search
+
+        Tests for:
+            * All the query words must match and the blacklist must not
+            * On "auto", no size bucket is asked for unless only the
+              largest one holds images past min_width/min_height
+            * Empty queries don't use the advanced search
+        """
+        self.fetcher.min_width = 1920
+        self.fetcher.min_height = 1080
+        self.fetcher.search_type = "jpg"
+
+        advanced = self.fetcher._advanced_search("snow moon earthporn ")
+        self.assertEquals(advanced['q_all'], "snow moon earthporn")
+        self.assertEquals(advanced['q_not'], " ".join(
+                          self.fetcher.blacklist_words))
+        self.assertEquals(advanced['q_type'], "jpg")
+        self.assertTrue('q_size_px' not in advanced)
+
+        self.fetcher.search_size = "auto"
+        advanced = self.fetcher._advanced_search("snow")
+        self.assertTrue('q_size_px' not in advanced)
+
+        self.fetcher.min_width = 3840
+        advanced = self.fetcher._advanced_search("snow")
+        self.assertTrue('q_size_px' not in advanced)
+
+        self.fetcher.min_width = 0
+        self.fetcher.min_height = 0
+        advanced = self.fetcher._advanced_search("snow")
+        self.assertTrue('q_size_px' not in advanced)
+
+        self.fetcher.min_width = 12000
+        advanced = self.fetcher._advanced_search("snow")
+        self.assertEquals(advanced['q_size_px'], "huge")
+
+        self.fetcher.search_size = "huge"
+        advanced = self.fetcher._advanced_search("snow")
+        self.assertEquals(advanced['q_size_px'], "huge")
+
+        self.assertTrue(self.fetcher._advanced_search(" ") is None)
+
+    def test_probe(self):
+        """
+        Tests the header probe before downloading
+
+        Tests for:
+            * Only the first bytes are requested
+            * Candidates whose metadata is wrong are rejected
+            * Candidates without metadata are checked with their real size
+              and aren't changed
+            * Failing probes reject the candidate
+            * Unreadable headers reject candidates without metadata
+        """
+        header = "GIF89a" + struct.pack("<HH", 2000, 1500)
+        response = Mock(spec=requests.Response)
+        response.iter_content.return_value = [header]
+
+        image = imgurpython.helpers.GalleryImage(link="http://i/a.gif",
+                                                 title="mountain",
+                                                 description=None,
+                                                 width=2000, height=1500,
+                                                 nsfw=False)
+
+        self.fetcher.probe = True
+        self.fetcher.min_width = 1000
+        self.fetcher.min_height = 1000
+
+        with patch("bg_daemon.fetchers.imgurfetcher.requests.get") as \
+                mock_method:
+
+            mock_method.return_value = response
+            self.assertEquals(self.fetcher._probe(image), (2000, 1500))
+            headers = mock_method.call_args[1]["headers"]
+            self.assertEquals(headers["Range"], "bytes=0-16383")
+
+            image.width = 4000
+            self.assertTrue(self.fetcher._probe(image) is None)
+            self.assertEquals(
+                self.fetcher.stats['rejected']['probe_mismatch'], 1)
+
+            image.width = None
+            image.height = None
+            self.assertEquals(self.fetcher._select_image([image]), image)
+            self.assertEquals((image.width, image.height), (None, None))
+
+            self.fetcher.min_width = 3000
+            self.assertTrue(self.fetcher._select_image([image]) is None)
+
+            response.iter_content.return_value = ["flibble"]
+            self.assertTrue(self.fetcher._probe(image) is None)
+            self.assertEquals(self.fetcher.stats['rejected']['unprobed'], 1)
+
+            image.width = 2000
+            image.height = 1500
+            self.assertEquals(self.fetcher._probe(image), (2000, 1500))
+            self.assertEquals(self.fetcher.stats['rejected']['unprobed'], 1)
+
+            mock_method.side_effect = requests.ConnectionError("flibble")
+            self.assertTrue(self.fetcher._probe(image) is None)
+            self.assertEquals(
+                self.fetcher.stats['rejected']['probe_failed'], 1)
+
     def test_fetch(self):
         """
         test for the "fetch" method
@@ -426,6 +538,275 @@ class test_imgurfetcher(unittest.TestCase):
                 self.fetcher.fetch(imgobject, "filename")
                 open_mock.assert_called_once_with("filename.gif", "wb")
 
+    def test_timeouts(self):
+        """
+        test for the network timeouts
+
+        we verify that:
+            * Every imgur API request has a timeout
+            * Requests use the time left for their phase of the update
+        """
+        response = Mock(spec=requests.Response)
+        response.status_code = 200
+        response.headers = {}
+        response.json.return_value = {"data": []}
+
+        with patch("bg_daemon.fetchers.imgurfetcher.requests.request") as \
+                mock_method:
+            mock_method.return_value = response
+
+            client = imgurfetcher.timed_client("flibble", 5)
+            self.assertEquals(client.gallery_search("mountain"), [])
+            for call in mock_method.call_args_list:
+                self.assertEquals(call[1]["timeout"], 5)
+
+            self.assertEquals(self.fetcher._timeout("search"),
+                              self.fetcher.timeout)
+
+            self.fetcher.update_deadline = Mock()
+            self.fetcher.update_deadline.timeout.return_value = 3
+            self.fetcher.query()
+            self.fetcher.update_deadline.timeout.assert_any_call("search")
+            self.assertEquals(mock_method.call_args[1]["timeout"], 3)
+
+    def test_make_request(self):
+        """
+        test for the requests of the timed client
+
+        we verify that:
+            * The rate limits are kept in the credits
+            * Mashape keys go to the mashape endpoint
+            * An expired token is refreshed and the request made again
+            * Rate limits and errors are raised
+        """
+        expired = Mock(spec=requests.Response)
+        expired.status_code = 403
+        expired.headers = {}
+
+        response = Mock(spec=requests.Response)
+        response.status_code = 200
+        response.headers = {"X-RateLimit-ClientRemaining": "1234"}
+        response.json.return_value = {"data": {"id": "a"}}
+
+        with patch("bg_daemon.fetchers.imgurfetcher.requests.request") as \
+                mock_method:
+            mock_method.return_value = response
+
+            client = imgurfetcher.timed_client("flibble", 5)
+            self.assertEquals(client.make_request("GET", "image/a"),
+                              {"id": "a"})
+            self.assertEquals(mock_method.call_args[0][1],
+                              imgurfetcher.API_URL + "3/image/a")
+            self.assertEquals(client.credits["ClientRemaining"], "1234")
+            self.assertEquals(client.credits["UserLimit"], None)
+
+            client.mashape_key = "wibble"
+            client.make_request("GET", "image/a")
+            self.assertEquals(mock_method.call_args[0][1],
+                              imgurfetcher.MASHAPE_URL + "3/image/a")
+            self.assertEquals(
+                mock_method.call_args[1]["headers"]["X-Mashape-Key"],
+                "wibble")
+
+            client.mashape_key = None
+            client.auth = Mock()
+            client.auth.get_current_access_token.return_value = "token"
+            mock_method.reset_mock()
+            mock_method.side_effect = [expired, response]
+            self.assertEquals(client.make_request("GET", "image/a"),
+                              {"id": "a"})
+            self.assertTrue(client.auth.refresh.called)
+            self.assertEquals(mock_method.call_count, 2)
+            for call in mock_method.call_args_list:
+                self.assertEquals(call[1]["timeout"], 5)
+
+            client.auth = None
+            mock_method.side_effect = None
+            response.status_code = 429
+            self.assertRaises(imgurfetcher.ImgurClientRateLimitError,
+                              client.make_request, "GET", "image/a")
+
+            response.status_code = 400
+            response.json.return_value = {"data": {"error": "flibble"}}
+            self.assertRaises(imgurfetcher.ImgurClientError,
+                              client.make_request, "GET", "image/a")
+
+    def test_candidates(self):
+        """
+        test for the compact candidate records
+
+        we verify that:
+            * Search results are parsed straight into candidate records
+            * Only the fields we use are kept, without a __dict__
+            * Records go through a list and back unchanged
+            * Records are selected, fetched and described like the models
+            * Untitled records aren't changed, their info says "undefined"
+        """
+        items = [{"id": "a", "link": "http://i.imgur.com/a.jpg",
+                  "title": "snow", "description": None, "width": 4000,
+                  "height": 3000, "views": 10, "nsfw": False,
+                  "is_album": False, "comment_count": 3, "tags": []},
+                 {"id": "b", "title": "moon", "is_album": True,
+                  "images_count": 2}]
+
+        response = Mock(spec=requests.Response)
+        response.status_code = 200
+        response.headers = {}
+        response.json.return_value = {"data": items}
+
+        with patch("bg_daemon.fetchers.imgurfetcher.requests.request") as \
+                mock_method:
+            mock_method.return_value = response
+            client = imgurfetcher.timed_client("flibble", 5)
+            records = client.gallery_search("snow")
+
+        self.assertEquals([record.id for record in records], ["a", "b"])
+        self.assertFalse(hasattr(records[0], "__dict__"))
+        self.assertFalse(hasattr(records[0], "comment_count"))
+        self.assertEquals((records[0].width, records[0].height), (4000, 3000))
+
+        restored = imgurfetcher.candidate.from_list(records[0].to_list())
+        self.assertEquals(restored, records[0])
+
+        self.assertTrue(imgurfetcher._is_album(records[1]))
+        self.assertTrue(imgurfetcher._is_image(records[0]))
+
+        self.fetcher.min_width = 1000
+        self.fetcher.min_height = 1000
+        records[0].title = None
+        with patch("bg_daemon.fetchers.imgurfetcher.timed_client") as \
+                mock_class:
+            mock_class.return_value.get_album_images.return_value = []
+            self.assertEquals(self.fetcher._select_image(list(records)),
+                              records[0])
+        self.assertTrue(records[0].title is None)
+
+        self.assertRaises(ValueError, self.fetcher.fetch, records[1], "a.jpg")
+
+        workdir = tempfile.mkdtemp()
+        try:
+            info = join(workdir, "info.json")
+            self.fetcher.save_info(records[0], info)
+            with open(info) as fp:
+                self.assertEquals(json.load(fp)["title"], "undefined")
+        finally:
+            shutil.rmtree(workdir)
+
+    def test_incremental(self):
+        """
+        test for the recent mode cursor
+
+        we verify that:
+            * Consecutive queries walk forward through the posts
+            * A post that wasn't installed is picked again
+            * Nothing is returned once every post was seen, and the stats
+              say so
+        """
+        page = [imgurfetcher.candidate(str(i), "http://i/{}.jpg".format(i),
+                                       "snow", None, 4000, 3000, None, 1, i,
+                                       False)
+                for i in range(3, 0, -1)]
+
+        workdir = tempfile.mkdtemp()
+        self.fetcher.min_width = 1000
+        self.fetcher.min_height = 1000
+        self.fetcher.cursor = imgurfetcher.recent_cursor(
+            join(workdir, "cursor.json"))
+
+        try:
+            with patch("bg_daemon.fetchers.imgurfetcher.timed_client") as \
+                    mock_class:
+                mock_method = mock_class.return_value.gallery_search
+                mock_method.side_effect = lambda *args, **kwargs: list(page)
+
+                self.assertEquals(self.fetcher.query().id, "1")
+                self.assertEquals(self.fetcher.query().id, "1")
+
+                picked = []
+                for i in range(4):
+                    picked.append(self.fetcher.query())
+                    self.fetcher.done(picked[-1])
+
+                self.assertEquals([image.id for image in picked[:3]],
+                                  ["1", "2", "3"])
+                self.assertTrue(picked[3] is None)
+                self.assertTrue(self.fetcher.stats['caught_up'])
+        finally:
+            shutil.rmtree(workdir)
+
+    def test_resume(self):
+        """
+        test for resuming interrupted downloads
+
+        we verify that:
+            * The validator of an interrupted download is kept
+            * The next download asks for the rest of the file with If-Range
+            * A full response (the image changed) starts over
+            * Nothing is left behind once the download completes
+            * Only an interrupted download of the same image is resumable
+            * The resume state can be discarded
+        """
+        workdir = tempfile.mkdtemp()
+        filename = join(workdir, "image.jpg")
+        resume = "{}.resume".format(filename)
+        link = "http://i.imgur.com/flibble.jpg"
+
+        def interrupted(chunk_size=1):
+            yield "flib"
+            raise requests.ConnectionError("flibble")
+
+        try:
+            with patch("bg_daemon.fetchers.imgurfetcher.requests.get") as \
+                    mock_method:
+
+                response = Mock(spec=requests.Response)
+                response.status_code = 200
+                response.headers = {"ETag": '"v1"'}
+                response.iter_content = interrupted
+                mock_method.return_value = response
+
+                with self.assertRaises(requests.ConnectionError):
+                    self.fetcher._download(link, filename)
+                self.assertTrue(os.path.exists(resume))
+
+                image = imgurpython.helpers.GalleryImage(link=link)
+                other = imgurpython.helpers.GalleryImage(
+                    link="http://i.imgur.com/other.jpg")
+                self.assertTrue(self.fetcher.resumable(filename, image))
+                self.assertFalse(self.fetcher.resumable(filename, other))
+
+                response.status_code = 206
+                response.iter_content = lambda chunk_size=1: ["ble"]
+                self.fetcher._download(link, filename)
+
+                headers = mock_method.call_args[1]["headers"]
+                self.assertEquals(headers["Range"], "bytes=4-")
+                self.assertEquals(headers["If-Range"], '"v1"')
+                with open(filename) as fp:
+                    self.assertEquals(fp.read(), "flibble")
+                self.assertFalse(os.path.exists(resume))
+
+                response.status_code = 200
+                response.iter_content = interrupted
+                with self.assertRaises(requests.ConnectionError):
+                    self.fetcher._download(link, filename)
+
+                response.iter_content = lambda chunk_size=1: ["new"]
+                self.fetcher._download(link, filename)
+                with open(filename) as fp:
+                    self.assertEquals(fp.read(), "new")
+                self.assertFalse(self.fetcher.resumable(filename, image))
+
+                response.iter_content = interrupted
+                with self.assertRaises(requests.ConnectionError):
+                    self.fetcher._download(link, filename)
+                self.fetcher.discard(filename)
+                self.assertFalse(os.path.exists(resume))
+                self.assertFalse(self.fetcher.resumable(filename, image))
+
+        finally:
+            shutil.rmtree(workdir)
+
     def _generate_title(self):
 
         with_blacklist = True if random.random() > .6 else False
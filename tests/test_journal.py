@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+    test_journal
+
+    Test suite for the run journal
+"""
+import shutil
+import tempfile
+import unittest
+import bg_daemon.journal as journal
+
+from os.path import join
+
+
+class test_journal(unittest.TestCase):
+
+    workdir = None
+    filename = None
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        self.filename = join(self.workdir, "journal.jsonl")
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def test_run_record(self):
+        """
+        Tests that records are written as single compact lines
+
+        Tests for:
+            * phases are timed
+            * the outcome and total time are set when finishing
+            * each record is a line in the journal
+        """
+        record = journal.run_record(forced=True)
+        with record.phase("query"):
+            pass
+
+        data = record.finish("updated")
+        self.assertEquals(data["outcome"], "updated")
+        self.assertTrue("query" in data["timings"])
+        self.assertTrue("total" in data["timings"])
+
+        journal.append(self.filename, data)
+        journal.append(self.filename, journal.run_record().finish("not_due"))
+
+        with open(self.filename) as fp:
+            lines = fp.readlines()
+
+        self.assertEquals(len(lines), 2)
+        self.assertTrue(" " not in lines[0])
+
+    def test_aggregate(self):
+        """
+        Tests the streaming analysis of the journal
+
+        Tests for:
+            * outcomes, rejections and bytes are added up
+            * percentiles are within the histogram's resolution
+            * hit rates are computed per query term
+            * corrupted lines are skipped
+        """
+        for i in range(100):
+            outcome = "updated" if i % 4 == 0 else "no_candidate"
+            journal.append(self.filename, {
+                "outcome": outcome,
+                "query": "snow earthporn" if i % 2 == 0 else "moon earthporn",
+                "rejected": {"width": 1},
+                "bytes": 10,
+                "timings": {"total": (i + 1) / 100.0},
+            })
+
+        with open(self.filename, "at") as fp:
+            fp.write('{"outcome": "upd')
+
+        summary = journal.aggregate(self.filename)
+
+        self.assertEquals(summary["runs"], 100)
+        self.assertEquals(summary["outcomes"]["updated"], 25)
+        self.assertEquals(summary["rejected"]["width"], 100)
+        self.assertEquals(summary["bytes"], 1000)
+
+        median = summary["timings"]["total"][50]
+        self.assertTrue(0.45 < median < 0.56)
+
+        self.assertEquals(summary["terms"]["earthporn"], (100, 25))
+        self.assertEquals(summary["terms"]["snow"], (50, 25))
+        self.assertEquals(summary["terms"]["moon"], (50, 0))
+
+if __name__ == '__main__':
+    unittest.main()
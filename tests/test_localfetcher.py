@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+"""
+    test_localfetcher
+
+    Test suite for the localfetcher class, it builds a small library in a
+    temporary directory.
+"""
+import os
+import json
+import struct
+import time
+import shutil
+import tempfile
+import unittest
+import bg_daemon.fetchers.localfetcher as localfetcher
+
+from os.path import join
+
+
+def png_header(width, height):
+
+    return "\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + "IHDR" + \
+        struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+
+
+class test_localfetcher(unittest.TestCase):
+
+    workdir = None
+    library = None
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        self.library = join(self.workdir, "library")
+        os.makedirs(join(self.library, "2019", "summer"))
+
+        self.add_image("big.png", 3000, 2000)
+        self.add_image("2019/small.png", 100, 100)
+        self.add_image("2019/summer/beach.png", 3000, 2000)
+        self.add_image("2019/summer/gore.png", 3000, 2000)
+
+        with open(join(self.library, "notes.txt"), "w") as fp:
+            fp.write("flibble")
+
+        self.settings = join(self.workdir, "settings.json")
+        with open(self.settings, "w") as fp:
+            json.dump({"fetcher": {"local_directory": self.library,
+                                   "min_width": 1920,
+                                   "min_height": 1080,
+                                   "blacklist_words": ["gore"]}}, fp)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def add_image(self, name, width, height):
+
+        with open(join(self.library, name), "wb") as fp:
+            fp.write(png_header(width, height))
+
+    def fetcher(self):
+
+        return localfetcher.localfetcher(self.settings,
+                                         join(self.workdir, "index.json"))
+
+    def test_query(self):
+        """
+        Tests picking and copying images
+
+        Tests for:
+            * Only images passing the size and blacklist filters are picked
+            * fetch copies the image and save_info describes it
+            * local_directory is required
+        """
+        fetcher = self.fetcher()
+        expected = set([join(self.library, "big.png"),
+                        join(self.library, "2019", "summer", "beach.png")])
+
+        picked = set()
+        for i in range(40):
+            image = fetcher.query()
+            picked.add(image.path)
+        self.assertEquals(picked, expected)
+
+        target = join(self.workdir, "bg.png")
+        fetcher.fetch(image, target)
+        with open(target, "rb") as fp:
+            self.assertEquals(fp.read(), png_header(3000, 2000))
+
+        fetcher.save_info(image, join(self.workdir, "info.json"))
+        with open(join(self.workdir, "info.json")) as fp:
+            self.assertEquals(json.load(fp)["link"], image.path)
+
+        with open(self.settings, "w") as fp:
+            json.dump({"fetcher": {}}, fp)
+        self.assertRaises(ValueError, self.fetcher)
+
+    def test_refresh(self):
+        """
+        Tests the incremental index
+
+        Tests for:
+            * The index is persisted and reused by a new fetcher
+            * Only directories whose mtime changed are listed again
+            * Deleted images are never returned
+        """
+        fetcher = self.fetcher()
+        fetcher.query()
+        self.assertTrue(os.path.exists(join(self.workdir, "index.json")))
+
+        listed = []
+        original = localfetcher._list_directory
+
+        def counting(directory):
+            listed.append(directory)
+            return original(directory)
+
+        localfetcher._list_directory = counting
+        try:
+            self.add_image("2019/summer/sunset.png", 3000, 2000)
+            summer = join(self.library, "2019", "summer")
+            future = time.time() + 10
+            os.utime(summer, (future, future))
+
+            fetcher = self.fetcher()
+            fetcher.refresh()
+            self.assertEquals(listed, [summer])
+        finally:
+            localfetcher._list_directory = original
+
+        os.unlink(join(self.library, "big.png"))
+        os.unlink(join(summer, "beach.png"))
+        for i in range(20):
+            self.assertEquals(fetcher.query().path, join(summer, "sunset.png"))
+
+    def test_candidates(self):
+        """
+        Tests the filtered images kept in the index
+
+        Tests for:
+            * A new fetcher picks from the saved candidates without
+              filtering the library again
+            * A query only reports the images it examined
+            * Other filters build the candidates again
+        """
+        fetcher = self.fetcher()
+        fetcher.query()
+        self.assertEquals(fetcher.stats['examined'], 1)
+        self.assertEquals(fetcher.stats['rejected'], {})
+        self.assertEquals(fetcher._index["candidates"]["rejected"],
+                          {"width": 1, "blacklist_words": 1})
+
+        original = localfetcher.localfetcher._filter
+        filtered = []
+
+        def counting(fetcher):
+            filtered.append(fetcher)
+            return original(fetcher)
+
+        localfetcher.localfetcher._filter = counting
+        try:
+            fetcher = self.fetcher()
+            for i in range(3):
+                self.assertTrue(fetcher.query() is not None)
+                self.assertEquals(fetcher.stats['rejected'], {})
+            self.assertEquals(filtered, [])
+
+            fetcher.min_width = 50
+            fetcher.min_height = 50
+            fetcher.query()
+            self.assertEquals(filtered, [fetcher])
+            self.assertEquals(fetcher._index["candidates"]["rejected"],
+                              {"blacklist_words": 1})
+            self.assertEquals(len(fetcher._get_candidates()), 3)
+
+            # the examined images that are gone are rejected
+            for path, width, height in fetcher._get_candidates():
+                os.unlink(path)
+            self.assertTrue(fetcher.query() is None)
+            self.assertEquals(fetcher.stats['examined'], 3)
+            self.assertEquals(fetcher.stats['rejected'], {"gone": 3})
+        finally:
+            localfetcher.localfetcher._filter = original
+
+
+if __name__ == "__main__":
+    unittest.main()
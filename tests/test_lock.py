@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+    test_lock
+
+    Test suite for the single-instance lock
+"""
+import os
+import fcntl
+import shutil
+import tempfile
+import unittest
+import subprocess
+import bg_daemon.lock as lock
+
+from os.path import join
+
+
+class test_lock(unittest.TestCase):
+
+    workdir = None
+    path = None
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        self.path = join(self.workdir, "lock")
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def hold(self, content):
+        """
+        Holds the lock from a bare descriptor, as a child that inherited it
+        would, with "content" in the file
+        """
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0600)
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.write(fd, content)
+        return fd
+
+    def test_acquire(self):
+        """
+        Tests taking and releasing the lock
+
+        Tests for:
+            * only one instance holds the lock
+            * the holder's pid is written in the lock file
+            * the lock can be taken once it's released
+            * it works as a context manager
+        """
+        first = lock.lockfile(self.path)
+        second = lock.lockfile(self.path)
+
+        self.assertTrue(first.acquire())
+        self.assertTrue(first.acquire())
+        self.assertFalse(second.acquire())
+        self.assertEquals(second.holder(), os.getpid())
+
+        first.release()
+        first.release()
+        self.assertTrue(second.acquire())
+        second.release()
+
+        with lock.lockfile(self.path) as acquired:
+            self.assertTrue(acquired)
+            self.assertFalse(lock.lockfile(self.path).acquire())
+
+        self.assertTrue(first.acquire())
+        first.release()
+
+    def test_stale(self):
+        """
+        Tests that a lock is never taken over
+
+        Tests for:
+            * a lock held with the pid of a process that's gone is left alone
+            * it can be taken once its descriptor is closed
+            * a lock without a pid is left alone
+        """
+        child = subprocess.Popen(["true"])
+        child.wait()
+
+        fd = self.hold("{} 0\n".format(child.pid))
+        try:
+            self.assertFalse(lock.lockfile(self.path).acquire())
+            self.assertEquals(os.fstat(fd).st_ino, os.stat(self.path).st_ino)
+        finally:
+            os.close(fd)
+
+        stale = lock.lockfile(self.path)
+        self.assertTrue(stale.acquire())
+        self.assertEquals(stale.holder(), os.getpid())
+        stale.release()
+
+        os.unlink(self.path)
+        fd = self.hold("\n")
+        try:
+            self.assertEquals(lock.lockfile(self.path).holder(), None)
+            self.assertFalse(lock.lockfile(self.path).acquire())
+        finally:
+            os.close(fd)
+
+    def test_request(self):
+        """
+        Tests leaving requests for the holder
+
+        Tests for:
+            * many requests coalesce into a single one
+            * a request is only taken once
+            * there's nothing to take without a request
+        """
+        holder = lock.lockfile(self.path)
+        self.assertTrue(holder.acquire())
+        self.assertFalse(holder.take_request())
+
+        for i in range(5):
+            lock.lockfile(self.path).request()
+
+        self.assertTrue(os.path.exists("{}.pending".format(self.path)))
+        self.assertTrue(holder.take_request())
+        self.assertFalse(holder.take_request())
+        holder.release()
+
+
+if __name__ == "__main__":
+    unittest.main()
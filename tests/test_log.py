@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+    test_log
+
+    Test suite for the queued, rotating log of bg_daemon. The log is
+    configured to write in a temporary directory.
+"""
+import os
+import logging
+import shutil
+import tempfile
+import unittest
+import bg_daemon.log as log
+
+from os.path import join
+
+
+class test_log(unittest.TestCase):
+
+    workdir = None
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        self.filename = join(self.workdir, "bg_daemon.log")
+
+    def tearDown(self):
+
+        log.configure({})
+        shutil.rmtree(self.workdir)
+
+    def flush(self):
+        """
+        Writes what's queued and closes the log files
+        """
+        log._listener.stop()
+
+    def read(self, filename=None):
+
+        with open(filename or self.filename) as fp:
+            return fp.read()
+
+    def test_levels(self):
+        """
+        Tests the levels of the handlers
+
+        Tests for:
+            * the file only gets records at its level or above
+            * the logger drops what no handler wants
+            * arguments are merged into the message
+            * unknown levels are refused
+        """
+        log.configure({"filename": self.filename, "file_level": "warning"})
+        self.assertEqual(log.logger.level, logging.WARNING)
+
+        log.logger.info("flibble")
+        log.logger.warning("%s of %d", "one", 2)
+        self.flush()
+
+        content = self.read()
+        self.assertTrue("[WARNING] one of 2" in content)
+        self.assertFalse("flibble" in content)
+
+        log.configure({"filename": self.filename, "file_level": "error",
+                       "console_level": "debug"})
+        self.assertEqual(log.logger.level, logging.DEBUG)
+
+        self.assertRaises(ValueError, log.configure,
+                          {"filename": self.filename,
+                           "file_level": "flibble"})
+
+    def test_rotation(self):
+        """
+        Tests the rotation of the log file
+
+        Tests for:
+            * the file is rotated past max_bytes
+            * only backup_count rotated files are kept
+        """
+        log.configure({"filename": self.filename, "max_bytes": 200,
+                       "backup_count": 2})
+
+        for i in range(40):
+            log.logger.info("line %d", i)
+        self.flush()
+
+        self.assertEqual(sorted(os.listdir(self.workdir)),
+                         ["bg_daemon.log", "bg_daemon.log.1",
+                          "bg_daemon.log.2"])
+        self.assertTrue("line 39" in self.read())
+        self.assertTrue(os.path.getsize(self.filename) <= 200)
+
+        log.configure({"filename": self.filename, "rotate_when": "midnight"})
+        self.assertTrue(isinstance(log._listener.handlers[0],
+                        logging.handlers.TimedRotatingFileHandler))
+
+    def test_caller(self):
+        """
+        Tests that the caller isn't looked up
+
+        Tests for:
+            * our logger doesn't walk the stack
+            * other loggers aren't changed
+        """
+        self.assertEqual(log.logger.findCaller()[1], 0)
+        self.assertTrue(logging._srcfile is not None)
+        self.assertNotEqual(logging.getLogger("flibble").findCaller()[1], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+    test_mirrorfetcher
+
+    Test suite for the mirror mode and the mirrorfetcher class, it runs a
+    mirror on a local port.
+"""
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+import bg_daemon.mirror as mirror
+import bg_daemon.fetchers.mirrorfetcher as mirrorfetcher
+
+from os.path import join
+
+
+class fake_image:
+
+    def __init__(self, link, width=2000, height=2000, title="mountain",
+                 nsfw=False):
+
+        self.id = link
+        self.link = link
+        self.width = width
+        self.height = height
+        self.title = title
+        self.description = None
+        self.nsfw = nsfw
+        self.views = 1
+        self.section = "earthporn"
+        self.account_url = None
+        self.datetime = 0
+
+
+class fake_fetcher:
+    """
+        Returns the queued images and "downloads" their link as content
+    """
+    def __init__(self, images):
+
+        self.images = images
+
+    def query(self):
+
+        if not self.images:
+            return None
+        return self.images.pop(0)
+
+    def fetch(self, image, filename):
+
+        with open(filename, "wb") as fp:
+            fp.write(image.link)
+
+
+class test_mirrorfetcher(unittest.TestCase):
+
+    workdir = None
+    server = None
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        images = [fake_image("http://i.imgur.com/big.jpg"),
+                  fake_image("http://i.imgur.com/small.jpg", width=10),
+                  fake_image("http://i.imgur.com/gore.jpg", title="gore")]
+
+        self.server = mirror.mirror_server(fake_fetcher(images),
+                                           join(self.workdir, "mirror"),
+                                           address="127.0.0.1", port=0,
+                                           catalog_size=10)
+        for i in range(3):
+            self.server.refresh()
+
+        thread = threading.Thread(target=self.server.httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.settings_path = join(self.workdir, "settings.json")
+        with open(self.settings_path, "wt") as fp:
+            json.dump({"fetcher": {
+                "mirror_url": "http://127.0.0.1:{}/".format(self.server.port),
+                "min_width": 1000,
+                "min_height": 1000,
+                "blacklist_words": ["gore"]}}, fp)
+
+    def tearDown(self):
+
+        self.server.shutdown()
+        shutil.rmtree(self.workdir)
+
+    def test_catalog(self):
+        """
+        Tests the mirror's catalog
+
+        Tests for:
+            * Every mirrored image is in the catalog
+            * The same link isn't mirrored twice
+            * Only the newest catalog_size images are kept
+        """
+        self.assertEquals(len(json.loads(self.server.catalog_json())), 3)
+
+        self.server.fetcher.images = [fake_image("http://i.imgur.com/big.jpg")]
+        self.assertFalse(self.server.refresh())
+
+        self.server.catalog_size = 2
+        self.server.fetcher.images = [fake_image("http://i.imgur.com/new.jpg")]
+        self.assertTrue(self.server.refresh())
+
+        links = [entry["link"] for entry in
+                 json.loads(self.server.catalog_json())]
+        self.assertEquals(links, ["http://i.imgur.com/gore.jpg",
+                                  "http://i.imgur.com/new.jpg"])
+
+    def test_query_and_fetch(self):
+        """
+        Tests the mirrorfetcher against a local mirror
+
+        Tests for:
+            * The local filters are applied to the catalog
+            * The image is downloaded from the mirror
+            * Files that aren't in the catalog are not served
+        """
+        fetcher = mirrorfetcher.mirrorfetcher(self.settings_path)
+
+        image = fetcher.query()
+        self.assertEquals(image.link, "http://i.imgur.com/big.jpg")
+        self.assertEquals(fetcher.stats["rejected"],
+                          {"width": 1, "blacklist_words": 1})
+
+        target = join(self.workdir, "bg.jpg")
+        fetcher.fetch(image, target)
+        with open(target) as fp:
+            self.assertEquals(fp.read(), "http://i.imgur.com/big.jpg")
+
+        image.file = "../settings.json"
+        with self.assertRaises(Exception):
+            fetcher.fetch(image, target)
+
+        fetcher.min_width = 100000
+        self.assertTrue(fetcher.query() is None)
+
+if __name__ == '__main__':
+    unittest.main()
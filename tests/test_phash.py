@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+    test_phash
+
+    Test suite for the perceptual hash index
+"""
+import math
+import time
+import random
+import shutil
+import tempfile
+import unittest
+import bg_daemon.phash as phash
+
+from os.path import join
+
+NUMBER_OF_HASHES = 20000
+
+
+class test_phash(unittest.TestCase):
+
+    workdir = None
+    filename = None
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        self.filename = join(self.workdir, "phash.idx")
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def test_find(self):
+        """
+        Tests near-duplicate lookups
+
+        Tests for:
+            * Hashes within the distance are found
+            * Hashes farther away are not
+            * The index is persisted and reloaded
+            * Only the most recent max_entries hashes are kept
+        """
+        index = phash.hash_index(self.filename, distance=3, max_entries=100)
+
+        index.add(0xffff0000ffff0000, "first")
+        self.assertEquals(index.find(0xffff0000ffff0000), "first")
+
+        # flip three bits, each in a different chunk
+        self.assertEquals(index.find(0xfffe0001ffff0001), "first")
+
+        # four bits away is not a duplicate anymore
+        self.assertTrue(index.find(0xfffe0001fffe0001) is None)
+
+        reloaded = phash.hash_index(self.filename, distance=3,
+                                    max_entries=100)
+        self.assertEquals(reloaded.find(0xffff0000ffff0001), "first")
+
+        for i in range(100):
+            reloaded.add(random.getrandbits(64), "filler")
+
+        self.assertTrue(reloaded.find(0xffff0000ffff0000) is None)
+
+    def test_lookup_speed(self):
+        """
+        Tests that lookups don't scan the whole index
+
+        Tests for:
+            * Lookups on a large index take well under a millisecond
+        """
+        index = phash.hash_index(self.filename, distance=3,
+                                 max_entries=NUMBER_OF_HASHES)
+        for i in range(NUMBER_OF_HASHES):
+            index._insert(random.getrandbits(64), i)
+
+        queries = [random.getrandbits(64) for i in range(1000)]
+        start = time.time()
+        for query in queries:
+            index.find(query)
+
+        self.assertTrue((time.time() - start) / len(queries) < 0.001)
+
+    @unittest.skipIf(phash.Image is None, "PIL is not installed")
+    def test_dhash(self):
+        """
+        Tests the difference hash
+
+        Tests for:
+            * The same picture at a different size hashes (almost) the same
+            * A different picture does not
+        """
+        gradient = phash.Image.new("L", (400, 300))
+        gradient.putdata([int(128 + 100 * math.sin(x / 40.0) *
+                              math.cos(y / 25.0))
+                          for y in range(300) for x in range(400)])
+
+        gradient.save(join(self.workdir, "big.png"))
+        gradient.resize((200, 150)).save(join(self.workdir, "small.png"))
+        gradient.rotate(90).save(join(self.workdir, "rotated.png"))
+
+        big = phash.dhash(join(self.workdir, "big.png"))
+        small = phash.dhash(join(self.workdir, "small.png"))
+        rotated = phash.dhash(join(self.workdir, "rotated.png"))
+
+        self.assertTrue(phash.hamming(big, small) <= 3)
+        self.assertTrue(phash.hamming(big, rotated) > 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+    test_planner
+
+    Test suite for the adaptive query planner
+"""
+import shutil
+import tempfile
+import unittest
+import bg_daemon.fetchers.planner as planner
+
+from os.path import join
+
+KEYWORDS = ["mountain", "forest", "snow"]
+SUBREDDITS = ["earthporn"]
+
+
+class test_planner(unittest.TestCase):
+
+    workdir = None
+    planner = None
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        self.filename = join(self.workdir, "planner.json")
+        self.planner = planner.query_planner(self.filename, 3600)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def test_plan(self):
+        """
+        Tests that plans are built from the settings
+
+        Tests for:
+            * Only keywords and subreddits in the settings are used
+            * At most MAX_KEYWORDS keywords are used
+        """
+        for i in range(50):
+            keywords, subreddit = self.planner.plan(KEYWORDS, SUBREDDITS)
+
+            self.assertTrue(0 < len(keywords) <= planner.MAX_KEYWORDS)
+            self.assertTrue(set(keywords).issubset(KEYWORDS))
+            self.assertTrue(subreddit in SUBREDDITS)
+
+    def test_negative_cache(self):
+        """
+        Tests that combinations that returned nothing are skipped
+
+        Tests for:
+            * Empty combinations aren't planned until they expire
+            * If everything is empty, something is still planned
+            * The negative cache is persisted
+        """
+        self.planner.record(["snow"], "earthporn", 0, 0, 1)
+
+        for i in range(50):
+            keywords, subreddit = self.planner.plan(KEYWORDS, SUBREDDITS)
+            self.assertNotEquals(keywords, ["snow"])
+
+        reloaded = planner.query_planner(self.filename, 3600)
+        self.assertTrue(planner._key(["snow"], "earthporn") in reloaded.empty)
+
+        keywords, subreddit = reloaded.plan(["snow"], SUBREDDITS)
+        self.assertEquals(keywords, ["snow"])
+
+    def test_weights(self):
+        """
+        Tests that productive combinations are preferred
+
+        Tests for:
+            * A combination with a high yield is sampled more often than one
+              with a low yield
+        """
+        for i in range(20):
+            self.planner.record(["mountain"], "earthporn", 60, 30, 1)
+            self.planner.record(["forest"], "earthporn", 60, 0.1, 1)
+
+        picks = {"mountain": 0, "forest": 0}
+        for i in range(500):
+            keywords, subreddit = self.planner.plan(["mountain", "forest"],
+                                                    SUBREDDITS)
+            if len(keywords) == 1:
+                picks[keywords[0]] += 1
+
+        self.assertTrue(picks["mountain"] > 5 * picks["forest"])
+
+if __name__ == '__main__':
+    unittest.main()
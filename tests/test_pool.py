@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+    test_pool
+
+    Test suite for the local image pool
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import bg_daemon.pool as pool
+
+from os.path import join
+
+
+class test_pool(unittest.TestCase):
+
+    workdir = None
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        self.backgrounds = join(self.workdir, "backgrounds")
+        self.directory = join(self.workdir, "pool")
+        self.index = join(self.workdir, "pool.json")
+        self.target = join(self.backgrounds, "bg.jpg")
+        os.mkdir(self.backgrounds)
+        os.mkdir(self.directory)
+
+        for name in ("bg.jpg", "bg-0123456789.jpg", "notes.txt",
+                     ".bg.jpg.part"):
+            self.touch(join(self.backgrounds, name))
+
+        for name in ("a.jpg", "b.PNG", "readme.md", ".hidden.jpg"):
+            self.touch(join(self.directory, name))
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def touch(self, filename):
+
+        with open(filename, "wb") as fp:
+            fp.write(os.path.basename(filename))
+
+    def new_pool(self):
+
+        return pool.image_pool(self.target, self.directory, self.index)
+
+    def test_refresh(self):
+        """
+        Tests which images are part of the pool
+
+        Tests for:
+            * backups of the target and images in the pool directory
+            * not the target, hidden files or other files
+        """
+        images = self.new_pool()
+        images.refresh()
+
+        self.assertEqual(sorted(os.path.basename(image)
+                                for image in images._index["images"]),
+                         ["a.jpg", "b.PNG", "bg-0123456789.jpg"])
+
+    def test_next(self):
+        """
+        Tests the rotation
+
+        Tests for:
+            * every image comes up once per round
+            * the excluded image is skipped, deleted ones are dropped
+            * the position in the rotation survives a restart
+            * an empty pool gives None
+        """
+        images = self.new_pool()
+        first_round = [images.next() for i in range(3)]
+        self.assertEqual(len(set(first_round)), 3)
+        self.assertEqual(images.next(), first_round[0])
+
+        images = self.new_pool()
+        self.assertEqual(images.next(), first_round[1])
+
+        self.assertEqual(images.next(exclude=first_round[2]), first_round[0])
+
+        os.unlink(first_round[0])
+        self.assertTrue(images.next() in first_round[1:])
+
+        for image in first_round[1:]:
+            os.unlink(image)
+        self.assertEqual(images.next(), None)
+
+    def test_add(self):
+        """
+        Tests adding an image without a rebuild
+
+        Tests for:
+            * the new image is in the rotation
+            * the index isn't rebuilt afterwards, it's up to date
+        """
+        images = self.new_pool()
+        images.refresh()
+
+        backup = join(self.backgrounds, "bg-abcdef0123.jpg")
+        self.touch(backup)
+        images.add(backup)
+
+        with open(self.index) as fp:
+            saved = fp.read()
+
+        images.refresh()
+        self.assertTrue(backup in images._index["images"])
+        with open(self.index) as fp:
+            self.assertEqual(fp.read(), saved)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+    test_ranking
+
+    Test suite for the candidate ranking
+"""
+import time
+import random
+import unittest
+import bg_daemon.fetchers.ranking as ranking
+
+from mock import patch
+
+SCREEN = (1920, 1080)
+
+
+class candidate:
+
+    def __init__(self, width, height, views=0, size=0, datetime=0):
+
+        self.width = width
+        self.height = height
+        self.views = views
+        self.size = size
+        self.datetime = datetime
+
+
+class test_ranking(unittest.TestCase):
+
+    def setUp(self):
+
+        self.candidates = [
+            candidate(3840, 2160, views=1000, size=10, datetime=10),
+            candidate(1000, 3000, views=1000, size=10, datetime=10),
+            candidate(960, 540, views=1000, size=10, datetime=10),
+            candidate(3840, 2160, views=10, size=10, datetime=10),
+            candidate(3840, 2160, views=1000, size=10, datetime=0),
+            candidate(None, None, views=1000, size=10, datetime=10),
+        ]
+
+    def test_ranking(self):
+        """
+        Tests the ranking of candidates
+
+        Tests for:
+            * Each feature moves a candidate down when it's worse
+            * Candidates without a size aren't penalized by it
+            * Weights change the ranking
+        """
+        best = ranking.ranking(self.candidates, SCREEN)
+        self.assertEquals(best[0], 0)
+        self.assertEquals(set(best[1:3]), set([3, 4]))
+
+        values = ranking.scores(self.candidates, SCREEN)
+        for worse in (1, 2, 3, 4):
+            self.assertTrue(values[0] > values[worse])
+        self.assertTrue(values[5] > values[1])
+
+        weights = {"views": 0, "aspect": 0, "headroom": 0, "size": 0,
+                   "recency": 0}
+        values = ranking.scores(self.candidates, SCREEN, weights)
+        self.assertEquals(list(values), [0] * len(self.candidates))
+
+    def test_fallback(self):
+        """
+        Tests the pure python scores
+
+        Tests for:
+            * They match the NumPy scores
+        """
+        if ranking.numpy is None:
+            raise unittest.SkipTest("NumPy is not installed")
+
+        expected = ranking.scores(self.candidates, SCREEN)
+        with patch("bg_daemon.fetchers.ranking.numpy", None):
+            values = ranking.scores(self.candidates, SCREEN)
+            self.assertEquals(ranking.ranking(self.candidates, SCREEN)[0], 0)
+
+        for value, score in zip(values, expected):
+            self.assertAlmostEquals(value, score)
+
+    def test_order(self):
+        """
+        Tests the selection order
+
+        Tests for:
+            * Only the top k candidates come first
+            * Every candidate is kept
+            * Large pools are ranked quickly
+        """
+        ordered = ranking.order(self.candidates, SCREEN, top_k=3)
+        self.assertEquals(set(ordered[:3]),
+                          set([self.candidates[i] for i in (0, 3, 4)]))
+        self.assertEquals(len(ordered), len(self.candidates))
+        self.assertEquals(ranking.order([], SCREEN), [])
+
+        pool = [candidate(random.randint(100, 5000), random.randint(100, 5000),
+                          random.randint(0, 10 ** 6), random.randint(0, 10 ** 7),
+                          random.randint(0, 10 ** 9)) for i in range(10 ** 5)]
+        start = time.time()
+        ranking.order(pool, SCREEN)
+        self.assertTrue(time.time() - start < 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
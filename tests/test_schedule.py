@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+"""
+    test_schedule
+
+    Test suite for the per-host phases and jitter of the scheduler
+"""
+import time
+import unittest
+import bg_daemon.schedule as schedule
+
+from mock import patch
+
+
+class test_schedule(unittest.TestCase):
+
+    def test_host_offset(self):
+        """
+        Tests the per-host offsets
+
+        Tests for:
+            * The offset is in range and the same on every call
+            * Other hosts and other salts get other offsets
+        """
+        with patch("socket.gethostname", return_value="alpha"):
+            offset = schedule.host_offset(3600)
+            self.assertEqual(offset, schedule.host_offset(3600))
+            self.assertTrue(0 <= offset < 3600)
+            self.assertEqual(schedule.host_offset(1), 0)
+
+            salted = [schedule.host_offset(3600, str(salt))
+                      for salt in range(5)]
+
+        with patch("socket.gethostname", return_value="beta"):
+            other = schedule.host_offset(3600)
+
+        self.assertNotEqual(offset, other)
+        self.assertTrue(len(set(salted)) > 1)
+
+    def test_next_update(self):
+        """
+        Tests when updates are due
+
+        Tests for:
+            * Updates land on the host's grid
+            * At least half a period from now
+            * Jitter only delays, and by no more than asked
+        """
+        with patch("socket.gethostname", return_value="alpha"):
+            offset = schedule.host_offset(300, "update")
+
+            for now in (1000000, 1000137, 1000299.5):
+                when = schedule.next_update(now, 300)
+                self.assertEqual((when - offset) % 300, 0)
+                self.assertTrue(now + 150 <= when <= now + 450)
+
+            plain = schedule.next_update(1000000, 300)
+            for i in range(20):
+                when = schedule.next_update(1000000, 300, jitter=30)
+                self.assertTrue(plain <= when <= plain + 30)
+
+    def test_cron_times(self):
+        """
+        Tests the values of a cron field
+
+        Tests for:
+            * Cron values are spaced by the interval from the host's offset
+            * Intervals that don't fit the field give None
+        """
+        with patch("socket.gethostname", return_value="alpha"):
+            minutes = schedule.cron_times(5, 60, "minute")
+            offset = schedule.host_offset(5, "minute")
+
+        self.assertEqual(minutes, list(range(offset, 60, 5)))
+        self.assertEqual(len(minutes), 12)
+        self.assertEqual(schedule.cron_times(90, 60), None)
+        self.assertEqual(schedule.cron_times(0, 60), None)
+
+    def test_idle_point(self):
+        """
+        Tests where prefetching starts in an idle window
+
+        Tests for:
+            * The idle point is inside the window, away from its edges
+            * It's the same for the same host without jitter
+        """
+        with patch("socket.gethostname", return_value="alpha"):
+            point = schedule.idle_point(1000, 2000)
+            self.assertEqual(point, schedule.idle_point(1000, 2000))
+            self.assertTrue(1100 <= point <= 1900)
+
+            for i in range(20):
+                point = schedule.idle_point(1000, 2000, jitter=500)
+                self.assertTrue(1100 <= point <= 1900)
+
+        self.assertEqual(schedule.idle_point(1000, 1000), 1000)
+
+    def test_cron_fields(self):
+        """
+        Tests the crontab entry of a frequency
+
+        Tests for:
+            * Frequencies snap to the closest period cron can run at
+            * The fields run once per period
+        """
+        self.assertEqual(schedule.cron_period(60), 60)
+        self.assertEqual(schedule.cron_period(400), 360)
+        self.assertEqual(schedule.cron_period(5400), 7200)
+        self.assertEqual(schedule.cron_period(10 ** 6), 86400)
+
+        with patch("socket.gethostname", return_value="alpha"):
+            minutes, hours = schedule.cron_fields(600)
+            self.assertEqual(len(minutes), 6)
+            self.assertEqual(hours, None)
+
+            minutes, hours = schedule.cron_fields(3 * 3600)
+            self.assertEqual(len(minutes), 1)
+            self.assertEqual(len(hours), 8)
+
+            minutes, hours = schedule.cron_fields(86400)
+            self.assertEqual((len(minutes), len(hours)), (1, 1))
+
+    def test_next_cron_time(self):
+        """
+        Tests when a crontab entry runs next
+
+        Tests for:
+            * The next cron time is the start of a matching minute
+            * It's never before the start
+        """
+        start = 1500000000.5
+        when = schedule.next_cron_time(start, [7, 37])
+        local = time.localtime(when)
+
+        self.assertEqual(when % 60, 0)
+        self.assertTrue(start <= when <= start + 1800)
+        self.assertTrue(local.tm_min in (7, 37))
+
+        when = schedule.next_cron_time(start, [0], [3])
+        local = time.localtime(when)
+        self.assertEqual((local.tm_hour, local.tm_min), (3, 0))
+        self.assertTrue(start <= when <= start + 86400)
+
+    def test_next_cron_due(self):
+        """
+        Tests when updates are due with the crontab entry
+
+        Tests for:
+            * The update is due on a run of the entry, about a frequency
+              from now
+            * Frequencies past a day skip the daily runs
+        """
+        with patch("socket.gethostname", return_value="alpha"):
+            for frequency in (600, 3600, 5400, 604800):
+                minutes, hours = schedule.cron_fields(frequency)
+                period = schedule.cron_period(frequency)
+
+                # cron just started us
+                now = schedule.next_cron_time(1500000000, minutes,
+                                              hours) + 5
+                when = schedule.next_cron_due(now, frequency)
+                local = time.localtime(when)
+
+                self.assertTrue(local.tm_min in minutes)
+                self.assertTrue(hours is None or local.tm_hour in hours)
+                self.assertTrue(abs(when - now - frequency) <= period / 2.0)
+
+            self.assertTrue(schedule.next_cron_due(now, 604800) - now >
+                            6 * 86400)
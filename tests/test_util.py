@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""
+    test_util
+
+    Test suite for the helpers in bg_daemon.util
+"""
+import os
+import errno
+import socket
+import shutil
+import tempfile
+import unittest
+import crontab
+import bg_daemon.util as util
+
+from os.path import join
+from mock import patch, Mock
+from bg_daemon.schedule import cron_fields
+
+
+class test_util(unittest.TestCase):
+
+    workdir = None
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        self.frequency_file = join(self.workdir, "crontab")
+        self.patchers = [patch("bg_daemon.util.HOME", self.workdir),
+                         patch("bg_daemon.util.CRONTAB_FREQUENCY",
+                               self.frequency_file)]
+        for patcher in self.patchers:
+            patcher.start()
+
+        # an empty crontab that's never written to the user's
+        self.tab = crontab.CronTab(tab="")
+        self.tab.write_to_user = Mock()
+
+    def tearDown(self):
+
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.workdir)
+
+    def job(self):
+
+        jobs = list(self.tab.find_command("background_daemon.py"))
+        self.assertEqual(len(jobs), 1)
+        return jobs[0]
+
+    def recorded_frequency(self):
+
+        with open(self.frequency_file) as fp:
+            return fp.read()
+
+    def test_link_or_copy(self):
+        """
+        Tests linking a file to a new name
+
+        Tests for:
+            * a hardlink is made when the filesystem can
+            * across filesystems (EXDEV), the file is copied
+            * other errors are raised
+        """
+        source = join(self.workdir, "source.jpg")
+        with open(source, "wb") as fp:
+            fp.write("flibble")
+
+        linked = join(self.workdir, "linked.jpg")
+        util.link_or_copy(source, linked)
+        self.assertTrue(os.path.samefile(source, linked))
+        self.assertEqual(os.stat(source).st_nlink, 2)
+
+        copied = join(self.workdir, "copied.jpg")
+        with patch("bg_daemon.util.os.link",
+                   side_effect=OSError(errno.EXDEV, "cross-device link")):
+            util.link_or_copy(source, copied)
+
+        self.assertFalse(os.path.samefile(source, copied))
+        with open(copied, "rb") as fp:
+            self.assertEqual(fp.read(), "flibble")
+
+        with patch("bg_daemon.util.os.link",
+                   side_effect=OSError(errno.EACCES, "permission denied")):
+            self.assertRaises(OSError, util.link_or_copy, source,
+                              join(self.workdir, "denied.jpg"))
+        self.assertFalse(os.path.exists(join(self.workdir, "denied.jpg")))
+
+    def test_write_crontab_entry(self):
+        """
+        Tests the crontab entry derived from the frequency
+
+        Tests for:
+            * the minute and hour fields are the host's cron fields
+            * the frequency is recorded next to the entry
+            * a rewrite updates the entry instead of adding another one
+        """
+        with patch("socket.gethostname", return_value="alpha"):
+            minutes, hours = cron_fields(600)
+            util._write_crontab_entry(self.tab, 600)
+
+            job = self.job()
+            self.assertEqual(job.command, util.DEFAULT_COMMAND)
+            self.assertEqual(str(job.minutes),
+                             ",".join(str(m) for m in minutes))
+            self.assertEqual(str(job.hour), "*")
+            self.assertEqual(self.recorded_frequency(), "600")
+            self.assertTrue(self.tab.write_to_user.called)
+
+            minutes, hours = cron_fields(3 * 3600)
+            util._write_crontab_entry(self.tab, 3 * 3600)
+
+            job = self.job()
+            self.assertEqual(str(job.minutes), str(minutes[0]))
+            self.assertEqual(str(job.hour), ",".join(str(h) for h in hours))
+            self.assertEqual(self.recorded_frequency(), str(3 * 3600))
+
+    def test_sync_crontab_entry(self):
+        """
+        Tests keeping the crontab entry in sync with the settings
+
+        Tests for:
+            * without a recorded frequency, the crontab isn't touched
+            * the same frequency doesn't rewrite anything
+            * another frequency rewrites the entry and records it
+        """
+        # util's reference only, crontab itself still needs the real class
+        with patch("bg_daemon.util.crontab") as module:
+            cron = module.CronTab
+            cron.return_value = self.tab
+
+            self.assertFalse(util.sync_crontab_entry(600))
+            self.assertFalse(cron.called)
+            self.assertFalse(os.path.exists(self.frequency_file))
+
+            util._write_crontab_entry(self.tab, 600)
+            self.tab.write_to_user.reset_mock()
+
+            self.assertFalse(util.sync_crontab_entry(600))
+            self.assertFalse(cron.called)
+            self.assertFalse(self.tab.write_to_user.called)
+
+            self.assertTrue(util.sync_crontab_entry(1800))
+            cron.assert_called_with(user=True)
+            self.assertTrue(self.tab.write_to_user.called)
+            self.assertEqual(self.recorded_frequency(), "1800")
+
+            minutes, hours = cron_fields(1800)
+            self.assertEqual(str(self.job().minutes),
+                             ",".join(str(m) for m in minutes))
+
+    def test_is_online(self):
+        """
+        Tests the connectivity check
+
+        Tests for:
+            * a connection that opens means we're online, and it's closed
+            * connection errors and timeouts mean we're offline
+        """
+        connection = Mock()
+        with patch("bg_daemon.util.socket.create_connection",
+                   return_value=connection) as create:
+            self.assertTrue(util.is_online("api.imgur.com", 443, 2))
+            create.assert_called_with(("api.imgur.com", 443), 2)
+            self.assertTrue(connection.close.called)
+
+        for error in (socket.error("unreachable"), socket.timeout()):
+            with patch("bg_daemon.util.socket.create_connection",
+                       side_effect=error):
+                self.assertFalse(util.is_online("api.imgur.com", 443, 2))